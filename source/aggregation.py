@@ -0,0 +1,344 @@
+import heapq
+from math import ceil, sqrt
+
+import numpy as np
+
+
+def nearest_rank(q: float, n: int):
+    """
+    :param q: Fraction between 0 and 1
+    :param n: Number of values, positive
+    :return: Rank (from 1) of the nearest-rank quantile: the smallest rank covering q of the values,
+             1 for q = 0 and n for q = 1. The product is rounded first, so 0.7 of 10 values is rank 7
+    """
+    return min(n, max(1, ceil(round(q * n, 9))))
+
+
+class Moments:
+    """
+    Running count, sum, mean and second central moment of a numeric column.
+
+    Updated with Welford's online algorithm, merged with Chan's pairwise formula,
+    so partial results of different chunks can be combined without a second pass.
+    """
+    __slots__ = ('count', 'total', 'mean', 'm2')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, x: float):
+        self.count += 1
+        self.total += x
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    @classmethod
+    def from_array(cls, values):
+        """
+        :param values: NumPy array of a column chunk, NaN values are skipped
+        :return: Moments of the chunk
+        """
+        if values.dtype.kind == 'f':
+            values = values[~np.isnan(values)]
+        moments = cls()
+        moments.count = len(values)
+        if moments.count:
+            moments.total = float(values.sum())
+            moments.mean = moments.total / moments.count
+            moments.m2 = float(np.square(values - moments.mean).sum())
+        return moments
+
+    def merge(self, other):
+        """
+        Combine statistics collected over another part of the data.
+        :param other: Moments of the other part
+        :return: self
+        """
+        if other.count == 0:
+            return self
+        n = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / n
+        self.mean += delta * other.count / n
+        self.total += other.total
+        self.count = n
+        return self
+
+    def variance(self, ddof: int = 1):
+        """
+        :param ddof: Delta degrees of freedom, the divisor is count - ddof
+        :return: Variance of the values seen, None if it is not defined
+        """
+        if self.count - ddof <= 0:
+            return None
+        return self.m2 / (self.count - ddof)
+
+
+class CoMoments:
+    """
+    Running means, second moments and co-moment of two numeric columns.
+
+    Enough to compute covariance and Pearson correlation in one pass.
+    """
+    __slots__ = ('count', 'mean_x', 'mean_y', 'm2_x', 'm2_y', 'c_xy')
+
+    def __init__(self):
+        self.count = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.m2_x = 0.0
+        self.m2_y = 0.0
+        self.c_xy = 0.0
+
+    def update(self, x: float, y: float):
+        self.count += 1
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        self.mean_x += dx / self.count
+        self.mean_y += dy / self.count
+        self.m2_x += dx * (x - self.mean_x)
+        self.m2_y += dy * (y - self.mean_y)
+        self.c_xy += dx * (y - self.mean_y)
+
+    @classmethod
+    def from_arrays(cls, x, y):
+        """
+        :param x: NumPy array of the first column chunk
+        :param y: NumPy array of the second column chunk
+        :return: CoMoments of the chunk, pairs with a NaN value are skipped
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        mask = ~(np.isnan(x) | np.isnan(y))
+        if not mask.all():
+            x, y = x[mask], y[mask]
+        comoments = cls()
+        comoments.count = len(x)
+        if comoments.count:
+            comoments.mean_x = float(x.mean())
+            comoments.mean_y = float(y.mean())
+            dx = x - comoments.mean_x
+            dy = y - comoments.mean_y
+            comoments.m2_x = float(np.dot(dx, dx))
+            comoments.m2_y = float(np.dot(dy, dy))
+            comoments.c_xy = float(np.dot(dx, dy))
+        return comoments
+
+    def merge(self, other):
+        """
+        Combine co-moments collected over another part of the data.
+        :param other: CoMoments of the other part
+        :return: self
+        """
+        if other.count == 0:
+            return self
+        n = self.count + other.count
+        dx = other.mean_x - self.mean_x
+        dy = other.mean_y - self.mean_y
+        weight = self.count * other.count / n
+        self.m2_x += other.m2_x + dx * dx * weight
+        self.m2_y += other.m2_y + dy * dy * weight
+        self.c_xy += other.c_xy + dx * dy * weight
+        self.mean_x += dx * other.count / n
+        self.mean_y += dy * other.count / n
+        self.count = n
+        return self
+
+    def covariance(self, ddof: int = 1):
+        if self.count - ddof <= 0:
+            return None
+        return self.c_xy / (self.count - ddof)
+
+    def pearson(self):
+        """
+        :return: Pearson correlation coefficient, None if one of the columns is constant
+        """
+        if self.m2_x * self.m2_y == 0:
+            return None
+        return self.c_xy / sqrt(self.m2_x * self.m2_y)
+
+
+class Extremes:
+    """
+    Running minimum and maximum of a column. Works with any comparable values.
+    """
+    __slots__ = ('min', 'max')
+
+    def __init__(self):
+        self.min = None
+        self.max = None
+
+    def update(self, x):
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    def update_array(self, values):
+        """
+        :param values: NumPy array of a column chunk, NaN values are skipped
+        """
+        if values.dtype.kind == 'f':
+            values = values[~np.isnan(values)]
+        if len(values):
+            self.update(values.min().item())
+            self.update(values.max().item())
+
+    def merge(self, other):
+        if other.min is not None:
+            self.update(other.min)
+            self.update(other.max)
+        return self
+
+
+class QuantileSketch:
+    """
+    KLL sketch of the distribution of a numeric column.
+
+    Values are kept in levels of compactors, an item of level h stands for 2 ** h values.
+    A level over its capacity is sorted and every other item of it goes to the next level,
+    so the sketch holds O(k) items and answers rank queries with an error of about 2 / k
+    of the number of values. Sketches of different parts of the data can be merged.
+    """
+    __slots__ = ('k', 'count', 'levels', 'rng')
+
+    def __init__(self, k: int = 200, seed=None):
+        """
+        Initialize the sketch.
+        :param k: Capacity of the top level, the error decreases as 1 / k
+        :param seed: Seed of the coin choosing which half of a level is kept
+        """
+        self.k = k
+        self.count = 0
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def with_error(cls, error: float, seed=None):
+        """
+        :param error: Acceptable rank error as a fraction of the number of values
+        :return: Empty sketch with the capacity giving about this error
+        """
+        if not 0 < error < 1:
+            raise ValueError(f'Unexpected quantile error: {error}')
+        return cls(max(8, int(np.ceil(2 / error))), seed)
+
+    def update_array(self, values):
+        """
+        :param values: NumPy array of a column chunk, NaN values are skipped
+        """
+        if values.dtype.kind == 'f':
+            values = values[~np.isnan(values)]
+        if len(values):
+            self.levels[0] = np.concatenate((self.levels[0], values.astype(np.float64)))
+            self.count += len(values)
+            self.__compress()
+
+    def merge(self, other):
+        """
+        Combine the sketch of another part of the data.
+        :param other: QuantileSketch of the other part
+        :return: self
+        """
+        for h, level in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[h] = np.concatenate((self.levels[h], level))
+        self.count += other.count
+        self.__compress()
+        return self
+
+    def __capacity(self, h):
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - h - 1))))
+
+    def __compress(self):
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if len(level) > self.__capacity(h):
+                level = np.sort(level)
+                odd = len(level) % 2
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                promoted = level[odd + self.rng.integers(2)::2]
+                self.levels[h + 1] = np.concatenate((self.levels[h + 1], promoted))
+                self.levels[h] = level[:odd]
+            h += 1
+
+    def quantiles(self, qs):
+        """
+        :param qs: Fractions between 0 and 1
+        :return: List of approximate values of the nearest-rank quantiles, None for an empty sketch
+        """
+        if not self.count:
+            return [None for _ in qs]
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2 ** h, dtype=np.int64) for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values = values[order]
+        ranks = np.cumsum(weights[order])
+        res = []
+        for q in qs:
+            target = nearest_rank(q, int(ranks[-1]))
+            res.append(values[min(np.searchsorted(ranks, target), len(values) - 1)].item())
+        return res
+
+
+class TopK:
+    """
+    Bounded min-heap of the k entries with the largest keys seen so far: O(log k) per entry pushed
+    and O(k) memory. Ties are resolved in favour of the entries with the smaller order numbers.
+    """
+    def __init__(self, k: int):
+        """
+        Initialize an empty heap.
+        :param k: Number of entries to keep
+        """
+        self.k = k
+        self.heap = []
+        self.payloads = {}
+        self.__uid = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def threshold(self):
+        """
+        :return: Smallest key kept if the heap is full (only larger or equal keys can get in), None otherwise
+        """
+        if self.k and len(self.heap) >= self.k:
+            return self.heap[0][0]
+        return None
+
+    def push(self, key, order: int, payload=None):
+        """
+        :param key: Comparable key of the entry
+        :param order: Number of the entry, the earlier one wins a tie
+        :param payload: Object kept with the key
+        """
+        if not self.k:
+            return
+        item = (key, -order, self.__uid)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+        elif item > self.heap[0]:
+            del self.payloads[heapq.heapreplace(self.heap, item)[2]]
+        else:
+            return
+        self.payloads[self.__uid] = payload
+        self.__uid += 1
+
+    def merge(self, other):
+        for key, order, uid in other.heap:
+            self.push(key, -order, other.payloads[uid])
+        return self
+
+    def result(self):
+        """
+        :return: List of (key, payload) from the largest key
+        """
+        return [(key, self.payloads[uid]) for key, _, uid in sorted(self.heap, reverse=True)]
@@ -0,0 +1,99 @@
+import tempfile
+
+import numpy as np
+
+from memory import manager
+
+
+class ArrayBuilder:
+    """
+    Collects chunks of a column into one contiguous array.
+
+    Chunks are kept in memory while the limit (or the process-wide memory budget) allows,
+    then they are moved to an anonymous temporary file and the result is memory-mapped from it.
+    The dtype is widened (e.g. int64 -> float64 when a missing value shows up) as chunks come.
+    """
+    def __init__(self, limit: int = None, chunk: int = 1 << 20):
+        """
+        Initialize the builder.
+        :param limit: Number of bytes to keep in memory, None to reserve them from the memory manager
+        :param chunk: Number of values rewritten at once when the dtype of a spilled array is widened
+        """
+        self.limit = limit
+        self.chunk = chunk
+        self.dtype = None
+        self.count = 0
+        self.nbytes = 0
+        self.__chunks = []
+        self.__file = None
+        self.__reserved = 0
+
+    @property
+    def spilled(self):
+        return self.__file is not None
+
+    def append(self, values):
+        """
+        :param values: NumPy array with the next values
+        """
+        values = np.asarray(values)
+        if self.dtype is None:
+            self.dtype = values.dtype
+        elif values.dtype != self.dtype:
+            dtype = np.result_type(self.dtype, values.dtype)
+            if dtype != self.dtype:
+                self.__widen(dtype)
+            values = values.astype(self.dtype)
+        if self.__file is None and self.dtype != object and not self.__fits(values.nbytes):
+            self.__spill()
+        if self.__file is None:
+            self.__chunks.append(values)
+        else:
+            values.tofile(self.__file)
+        self.count += len(values)
+        self.nbytes += values.nbytes
+
+    def result(self):
+        """
+        :return: Array with all the values, a read-only memmap if they did not fit into the limit
+        """
+        dtype = self.dtype if self.dtype is not None else np.float64
+        if self.__file is None:
+            res = np.concatenate(self.__chunks) if self.__chunks else np.empty(0, dtype=dtype)
+            if self.__reserved:
+                manager.track(res, self.__reserved)
+                self.__reserved = 0
+            return res
+        self.__file.flush()
+        return np.memmap(self.__file, dtype=dtype, mode='r', shape=(self.count,))
+
+    def __del__(self):
+        manager.release(self.__reserved)
+
+    def __fits(self, nbytes):
+        if self.limit is not None:
+            return self.nbytes + nbytes <= self.limit
+        if manager.reserve(nbytes):
+            self.__reserved += nbytes
+            return True
+        return False
+
+    def __spill(self):
+        self.__file = tempfile.TemporaryFile(prefix='samwise-')
+        for values in self.__chunks:
+            values.tofile(self.__file)
+        self.__chunks = []
+        manager.release(self.__reserved)
+        self.__reserved = 0
+
+    def __widen(self, dtype):
+        if self.__file is None:
+            self.__chunks = [values.astype(dtype) for values in self.__chunks]
+        else:
+            old, self.__file = self.__file, tempfile.TemporaryFile(prefix='samwise-')
+            old.seek(0)
+            with old:
+                for _ in range(0, self.count, self.chunk):
+                    np.fromfile(old, dtype=self.dtype, count=self.chunk).astype(dtype).tofile(self.__file)
+        self.nbytes = self.count * np.dtype(dtype).itemsize
+        self.dtype = dtype
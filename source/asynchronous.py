@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from functools import partial
+
+from options import get_option
+
+QUEUE_SIZE = 8  # items a producer may run ahead of its consumer
+POLL = 0.5  # seconds a blocked producer waits before checking that its consumer is still there
+
+_executor = None
+_lock = threading.Lock()
+
+
+def executor():
+    """
+    :return: Thread pool shared by all the async calls of the process, created on first use
+             with the number of threads of the async_workers option
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(get_option('async_workers'), thread_name_prefix='samwise')
+        return _executor
+
+
+def set_executor(pool):
+    """
+    Run the async calls in another executor (e.g. the one of the application), the previous one is shut down.
+    :param pool: concurrent.futures.Executor, None to create the default one on the next call
+    """
+    global _executor
+    with _lock:
+        previous, _executor = _executor, pool
+    if previous is not None and previous is not pool:
+        previous.shutdown(wait=False)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Call a blocking function in the shared pool without blocking the event loop.
+    :return: Result of the function
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor(), partial(func, *args, **kwargs))
+
+
+async def stream(make_iterator, maxsize: int = QUEUE_SIZE):
+    """
+    Iterate a blocking iterator in the shared pool and pass its items to the event loop.
+
+    The items go through a bounded queue: the producer thread waits while it is full, so a slow
+    consumer does not let the items pile up in memory. If the consumer stops early, the
+    iterator is closed in its thread after the item it is producing.
+    :param make_iterator: Function returning the iterator, called in the pool
+    :param maxsize: Number of items the producer may run ahead
+    :return: Async iterator over the items, exceptions of the iterator are raised in the consumer
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize)
+    stopped = threading.Event()
+
+    def put(item):
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while not stopped.is_set():
+            try:
+                return future.result(POLL)
+            except FutureTimeout:
+                pass
+        future.cancel()
+
+    def produce():
+        iterator = None
+        try:
+            iterator = iter(make_iterator())
+            for item in iterator:
+                if stopped.is_set():
+                    return
+                put((True, item))
+            put((False, None))
+        except BaseException as exc:
+            if not stopped.is_set():
+                put((False, exc))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    producer = loop.run_in_executor(executor(), produce)
+    try:
+        while True:
+            ok, item = await queue.get()
+            if not ok:
+                if item is not None:
+                    raise item
+                break
+            yield item
+        await producer
+    finally:
+        stopped.set()
+        while not queue.empty():
+            queue.get_nowait()
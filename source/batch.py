@@ -0,0 +1,153 @@
+from itertools import compress
+
+import numpy as np
+
+from schema import to_array
+
+
+class Batch:
+    """
+    A chunk of rows stored column by column.
+
+    Columns are cut out of the parsed csv rows only when they are accessed,
+    numeric views of them are built with NumPy and cached.
+    """
+    def __init__(self, header, rows=None, columns=None, schema=None):
+        """
+        Initialize the batch.
+        :param header: Column labels, may contain duplicates like a csv header (the last one wins)
+        :param rows: Lists of raw values aligned with the header
+        :param columns: Mapping label -> column values, overrides the values taken from rows
+        :param schema: Schema of the file the rows come from
+        """
+        self.header = list(header)
+        self.schema = schema
+        self.__index = {key: i for i, key in enumerate(self.header)}
+        self.keys = list(self.__index)
+        self.__rows = rows
+        self.__columns = dict(columns) if columns else {}
+        self.__arrays = {}
+        for key in self.__columns:
+            if key not in self.__index:
+                self.__index[key] = None
+                self.keys.append(key)
+
+    @classmethod
+    def from_dicts(cls, rows, schema=None):
+        """
+        Build a batch from row dicts, e.g. after they went through apply callbacks.
+        :param rows: List of dicts
+        :param schema: Schema of the file the rows come from
+        :return: Batch holding the same rows
+        """
+        keys = {}
+        for row in rows:
+            keys.update(dict.fromkeys(row))
+        columns = {key: [row.get(key) for row in rows] for key in keys}
+        return cls(list(keys), columns=columns, schema=schema)
+
+    def __len__(self):
+        if self.__rows is not None:
+            return len(self.__rows)
+        for column in self.__columns.values():
+            return len(column)
+        return 0
+
+    def __contains__(self, key):
+        return key in self.__index
+
+    def __getitem__(self, key):
+        """
+        :param key: Column label
+        :return: Column values as a list (or an array if it was assigned one)
+        """
+        column = self.__columns.get(key)
+        if column is None:
+            if key not in self.__index:
+                raise KeyError(key)
+            i = self.__index[key]
+            column = [row[i] for row in self.__rows]
+            self.__columns[key] = column
+        return column
+
+    def __setitem__(self, key, values):
+        if key not in self.__index:
+            self.__index[key] = None
+            self.keys.append(key)
+        self.__columns[key] = values
+        self.__arrays.pop(key, None)
+
+    def array(self, key):
+        """
+        :param key: Column label
+        :return: Values of a numeric column as a NumPy array, missing values are NaN
+        """
+        arr = self.__arrays.get(key)
+        if arr is None:
+            values = self[key]
+            if isinstance(values, np.ndarray):
+                arr = values
+            elif self.schema is not None:
+                arr = self.schema.to_array(key, values)
+            else:
+                arr = to_array(values)
+            if arr is None:
+                raise ValueError(f'Column {key} is not numeric')
+            self.__arrays[key] = arr
+        return arr
+
+    def typed(self, key):
+        """
+        :param key: Column label
+        :return: Column values converted to the type of the column
+        """
+        if self.schema is None:
+            return list(self[key])
+        return self.schema.convert(key, self[key])
+
+    def take(self, mask):
+        """
+        :param mask: Boolean mask over the rows
+        :return: New batch with the rows where mask is True
+        """
+        mask = np.asarray(mask, dtype=bool)
+        selectors = mask.tolist()
+        rows = None if self.__rows is None else list(compress(self.__rows, selectors))
+        columns = {key: column[mask] if isinstance(column, np.ndarray) else list(compress(column, selectors))
+                   for key, column in self.__columns.items()}
+        return self.__derived(rows, columns)
+
+    def slice(self, start, stop):
+        """
+        :return: New batch with the rows from start to stop
+        """
+        rows = None if self.__rows is None else self.__rows[start:stop]
+        columns = {key: column[start:stop] for key, column in self.__columns.items()}
+        return self.__derived(rows, columns)
+
+    def __derived(self, rows, columns):
+        batch = Batch(self.header, rows, columns, self.schema)
+        batch.keys = list(self.keys)
+        return batch
+
+    def rows(self):
+        """
+        Thin adapter for code working with rows.
+        :return: List of row dicts
+        """
+        if self.__rows is not None and not self.__columns:
+            header = self.header
+            return [dict(zip(header, row)) for row in self.__rows]
+        keys = self.keys
+        return [dict(zip(keys, values)) for values in zip(*[self[key] for key in keys])]
+
+    def typed_rows(self, columns=None):
+        """
+        Rows as the batch versions of compiled expressions see them.
+        :param columns: Labels of the columns to take, all of them if None
+        :return: List of row dicts with the values converted to the types of the columns
+        """
+        keys = [key for key in self.keys if columns is None or key in columns]
+        if not keys:
+            return [{} for _ in range(len(self))]
+        return [dict(zip(keys, values)) for values in zip(*[self.typed(key) for key in keys])]
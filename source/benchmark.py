@@ -0,0 +1,346 @@
+"""
+Benchmarks of Samwise (and of pandas/modin if they are installed) over synthetic datasets.
+
+Every run of a case is forked from a process without cached results or a row index of the
+dataset, so that earlier runs do not help it and its peak resident memory is its own.
+Results are saved as JSON which can be compared between versions to catch regressions:
+
+    python benchmark.py --rows 1000000 --output new.json --compare old.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from writer import CsvWriter
+
+DEFAULT_COLUMNS = {'int': 2, 'float': 3, 'str': 1}
+WORDS = 1000  # distinct values of a str column
+
+CASES = ('read_csv', 'filter', 'transform', 'sum', 'mean', 'min', 'max', 'pearson', 'spearman', 'kendall',
+         'sort_values', 'quantile')
+
+
+def generate(filename: str, rows: int, columns: dict = None, missing: float = 0.0, seed: int = 0):
+    """
+    Write a synthetic dataset.
+    :param filename: Name of the file, .csv or .zip (a zip archive with one csv file)
+    :param rows: Number of rows
+    :param columns: Mapping type ('int', 'float', 'str') -> number of columns, the columns are named
+                    i0, i1, ..., f0, f1, ..., s0, s1, ...
+    :param missing: Fraction of empty values in every column
+    :param seed: Seed of the random values
+    :return: Column labels
+    """
+    columns = DEFAULT_COLUMNS if columns is None else columns
+    rnd = random.Random(seed)
+    makers = []
+    for kind, count in columns.items():
+        for j in range(count):
+            if kind == 'int':
+                makers.append((f'i{j}', lambda: str(rnd.randint(-10 ** 6, 10 ** 6))))
+            elif kind == 'float':
+                makers.append((f'f{j}', lambda: repr(rnd.gauss(0, 1))))
+            elif kind == 'str':
+                makers.append((f's{j}', lambda: f'w{rnd.randrange(WORDS)}'))
+            else:
+                raise ValueError(f'Unexpected column type: {kind}')
+    header = [label for label, _ in makers]
+    with CsvWriter(filename, header) as writer:
+        writer.write_rows([None if missing and rnd.random() < missing else make() for _, make in makers]
+                          for _ in range(rows))
+    return header
+
+
+def _samwise_case(case, filename, labels, workers):
+    from dataframe import DataFrame
+    x, y = labels['x'], labels['y']
+    df = DataFrame(filename, workers=workers)
+    if case == 'read_csv':
+        return sum(1 for _ in df)
+    if case == 'filter':
+        return len(df.filter(f"df['{x}'] > 0"))
+    if case == 'transform':
+        df.transform(f"df['t'] = df['{x}'] * 2", inplace=True)
+        return df.sum('t', progressbar=False)
+    if case in ('sum', 'mean', 'min', 'max'):
+        return getattr(df, case)(x, progressbar=False)
+    if case in ('pearson', 'spearman', 'kendall'):
+        return getattr(df, case)(x, y, progressbar=False)
+    if case == 'sort_values':
+        return len(df.sort_values(x))
+    if case == 'quantile':
+        return df.quantile(0.9, x, progressbar=False)
+    raise ValueError(f'Unexpected case: {case}')
+
+
+def _pandas_case(case, filename, labels, pd):
+    x, y = labels['x'], labels['y']
+    df = pd.read_csv(filename)
+    if case == 'read_csv':
+        return len(df)
+    if case == 'filter':
+        return len(df[df[x] > 0])
+    if case == 'transform':
+        df['t'] = df[x] * 2
+        return df['t'].sum()
+    if case in ('sum', 'mean', 'min', 'max'):
+        return getattr(df[x], case)()
+    if case in ('pearson', 'spearman', 'kendall'):
+        return df[x].corr(df[y], method=case)
+    if case == 'sort_values':
+        return len(df.sort_values(x))
+    if case == 'quantile':
+        return df[x].quantile(0.9)
+    raise ValueError(f'Unexpected case: {case}')
+
+
+def engines():
+    """
+    :return: Names of the engines which can run here
+    """
+    res = ['samwise']
+    for name, module in (('pandas', 'pandas'), ('modin', 'modin.pandas')):
+        try:
+            __import__(module)
+            res.append(name)
+        except ImportError:
+            pass
+    return res
+
+
+def _run_case(engine, case, filename, labels, workers):
+    if engine == 'samwise':
+        return _samwise_case(case, filename, labels, workers)
+    if engine == 'pandas':
+        import pandas
+        return _pandas_case(case, filename, labels, pandas)
+    if engine == 'modin':
+        import modin.pandas
+        return _pandas_case(case, filename, labels, modin.pandas)
+    raise ValueError(f'Unexpected engine: {engine}')
+
+
+def _rss():
+    """
+    :return: Current resident memory of the process in bytes, None if unknown
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _measure(engine, case, filename, labels, workers):
+    """
+    :return: Dict with the wall time, the peak resident memory and the result of the case
+    """
+    base = _rss()
+    start = time.perf_counter()
+    result = _run_case(engine, case, filename, labels, workers)
+    seconds = time.perf_counter() - start
+    peak = _peak_rss()
+    return {'seconds': seconds, 'peak_rss': peak, 'rss_growth': None if base is None else max(0, peak - base),
+            'result': result if isinstance(result, (int, float, str, type(None))) else repr(result)}
+
+
+def _child(conn, *args):
+    try:
+        conn.send(_measure(*args))
+    except Exception as e:
+        conn.send({'error': f'{type(e).__name__}: {e}'})
+    finally:
+        conn.close()
+
+
+def measure(engine, case, filename, labels, workers=1):
+    """
+    Run one case in a forked process (in this one if fork is not available).
+    :return: Dict with seconds, peak_rss, rss_growth (bytes) and result, or error
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return _measure(engine, case, filename, labels, workers)
+    ctx = multiprocessing.get_context('fork')
+    parent, child = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_child, args=(child, engine, case, filename, labels, workers))
+    process.start()
+    child.close()
+    try:
+        res = parent.recv()
+    except EOFError:
+        res = {'error': f'process exited with code {process.exitcode}'}
+    process.join()
+    return res
+
+
+def _version():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(rows: int = 100000, columns: dict = None, fmt: str = 'csv', cases=CASES, engine_names=None, repeat: int = 3,
+        workers: int = 1, missing: float = 0.0, directory: str = None, log=print):
+    """
+    Generate a dataset and run the cases over it.
+    :param rows: Number of rows of the dataset
+    :param columns: Mapping type -> number of columns, see generate
+    :param fmt: 'csv' or 'zip'
+    :param cases: Names of the cases to run, see CASES
+    :param engine_names: Engines to run ('samwise', 'pandas', 'modin'), all of the installed ones by default
+    :param repeat: Number of runs of every case, the fastest one is reported
+    :param workers: Number of processes Samwise aggregations run in
+    :param missing: Fraction of empty values
+    :param directory: Directory for the dataset, a temporary one (removed at the end) by default
+    :param log: Function reporting progress, None for silence
+    :return: Dict with meta (environment and parameters) and results (a dict per engine and case)
+    """
+    if fmt not in ('csv', 'zip'):
+        raise ValueError(f'Unexpected format: {fmt}')
+    columns = DEFAULT_COLUMNS if columns is None else columns
+    engine_names = engines() if engine_names is None else list(engine_names)
+    created = directory is None
+    if created:
+        directory = tempfile.mkdtemp(prefix='samwise-bench-')
+    else:
+        os.makedirs(directory, exist_ok=True)
+    try:
+        return _run(rows, columns, fmt, cases, engine_names, repeat, workers, missing, directory, log)
+    finally:
+        if created:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def _run(rows, columns, fmt, cases, engine_names, repeat, workers, missing, directory, log):
+    filename = os.path.join(directory, f'bench_{rows}.{fmt}')
+    header = generate(filename, rows, columns, missing)
+    numeric = [label for label in header if label[0] in 'if']
+    if not numeric:
+        raise ValueError('The dataset needs a numeric column.')
+    labels = {'x': numeric[0], 'y': numeric[1] if len(numeric) > 1 else numeric[0]}
+    results = []
+    for engine in engine_names:
+        for case in cases:
+            runs = []
+            for _ in range(repeat):
+                _isolate(filename)
+                runs.append(measure(engine, case, filename, labels, workers))
+            errors = [r['error'] for r in runs if 'error' in r]
+            entry = {'engine': engine, 'case': case, 'rows': rows}
+            if errors:
+                entry['error'] = errors[0]
+            else:
+                times = [r['seconds'] for r in runs]
+                entry.update(seconds=min(times), median_seconds=statistics.median(times),
+                             rows_per_sec=rows / min(times) if min(times) > 0 else None,
+                             peak_rss=max(r['peak_rss'] for r in runs),
+                             rss_growth=max((r['rss_growth'] or 0) for r in runs),
+                             result=runs[0]['result'])
+            results.append(entry)
+            if log is not None:
+                log(_format(entry))
+    meta = {'version': _version(), 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'rows': rows, 'columns': columns, 'format': fmt, 'workers': workers,
+            'missing': missing, 'repeat': repeat, 'file_size': os.path.getsize(filename),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+
+def _isolate(filename):
+    """
+    Drop what a run leaves for the next ones: the row index next to the dataset and the cached results.
+    """
+    from conveyor import Conveyor
+    Conveyor.results.clear()
+    try:
+        os.remove(filename + '.idx')
+    except FileNotFoundError:
+        pass
+
+
+def _format(entry):
+    if 'error' in entry:
+        return f"{entry['engine']:8} {entry['case']:12} error: {entry['error']}"
+    return (f"{entry['engine']:8} {entry['case']:12} {entry['seconds']:9.3f} s {entry['rows_per_sec'] or 0:12.0f} rows/s "
+            f"{entry['peak_rss'] / 2 ** 20:8.1f} MB peak")
+
+
+def save(report: dict, filename: str):
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+def load(filename: str):
+    with open(filename, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(old: dict, new: dict, threshold: float = 0.1):
+    """
+    :param old: Report of the baseline version
+    :param new: Report of the new version
+    :param threshold: Relative slowdown (or memory growth) reported as a regression
+    :return: List of dicts engine, case, metric, old, new, ratio for the cases which got worse
+    """
+    before = {(r['engine'], r['case']): r for r in old['results'] if 'error' not in r}
+    res = []
+    for entry in new['results']:
+        base = before.get((entry['engine'], entry['case']))
+        if base is None or 'error' in entry:
+            continue
+        for metric in ('seconds', 'peak_rss'):
+            if base[metric] and entry[metric] > base[metric] * (1 + threshold):
+                res.append({'engine': entry['engine'], 'case': entry['case'], 'metric': metric,
+                            'old': base[metric], 'new': entry[metric], 'ratio': entry[metric] / base[metric]})
+    return res
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--int', type=int, default=DEFAULT_COLUMNS['int'], help='number of int columns')
+    parser.add_argument('--float', type=int, default=DEFAULT_COLUMNS['float'], help='number of float columns')
+    parser.add_argument('--str', type=int, default=DEFAULT_COLUMNS['str'], help='number of str columns')
+    parser.add_argument('--missing', type=float, default=0.0, help='fraction of empty values')
+    parser.add_argument('--format', choices=('csv', 'zip'), default='csv')
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--engines', nargs='+', choices=('samwise', 'pandas', 'modin'), default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--dir', default=None, help='directory for the dataset')
+    parser.add_argument('--output', default=None, help='JSON file to save the results to')
+    parser.add_argument('--compare', default=None, help='JSON results of a baseline to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change reported as a regression')
+    args = parser.parse_args(argv)
+    report = run(args.rows, {'int': args.int, 'float': args.float, 'str': args.str}, args.format, args.cases,
+                 args.engines, args.repeat, args.workers, args.missing, args.dir)
+    if args.output:
+        save(report, args.output)
+    if args.compare:
+        regressions = compare(load(args.compare), report, args.threshold)
+        for r in regressions:
+            print(f"regression: {r['engine']} {r['case']} {r['metric']} {r['old']:.4g} -> {r['new']:.4g} "
+                  f"(x{r['ratio']:.2f})")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
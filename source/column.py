@@ -1,47 +1,131 @@
 from conveyor import Conveyor
+from array_builder import ArrayBuilder
+from memory import manager
+from options import get_option
 import numpy as np
 
 class Column:
 
-    def __init__(self, label: str, filename: str):
-        self.MAX_RAM = 65536  # 0.5 * 1024 ** 3
+    def __init__(self, label: str, filename: str, workers: int = 1, cache=False, dtype: dict = None,
+                 conveyor: Conveyor = None):
         self.__label = label
         self.__filename = filename
-        self.__conveyor = Conveyor(filename)
-        self.__buffer = [''] * self.MAX_RAM
-        self.__len = len(self.__conveyor)
-        self.__cache = 0
-        i = 0
-        for r in self.__conveyor.run():
-            if i >= self.MAX_RAM:
+        if conveyor is None:
+            conveyor = Conveyor(filename, workers=workers, cache=cache, dtype=dtype)
+        self.__conveyor = conveyor
+        self.__buffer = None
+        self.__start = 0
+        self.__reserved = 0
+        self.__len = None
+        manager.register(self)
+
+    def __load(self, start):
+        """
+        Fill the buffer with the typed values of buffer_rows rows starting from row start.
+        """
+        self.spill()
+        rows = get_option('buffer_rows')
+        parts = []
+        n = 0
+        for values in self.chunks(start=start):
+            parts.append(values)
+            n += len(values)
+            if n >= rows:
                 break
-            self.__buffer[i] = r[self.__label]
-            i += 1
+        buffer = np.concatenate(parts)[:rows] if parts else np.empty(0)
+        if manager.reserve(buffer.nbytes, self):
+            self.__reserved = buffer.nbytes
+        self.__buffer = buffer
+        self.__start = start
+
+    def spill(self):
+        """
+        Drop the buffer, it is read again on access.
+        :return: Number of bytes freed
+        """
+        freed = self.__reserved
+        self.__buffer = None
+        self.__reserved = 0
+        manager.release(freed)
+        return freed
 
     def __getitem__(self, item):
-        if item >= self.__len:
+        if item >= len(self):
             raise IndexError("list index out of range")
-        if item >= self.__cache and item < self.__cache + self.MAX_RAM:
-            res = self.__buffer[item - self.__cache]
-        else:
-            self.__cache = item
-            i = 0
-            for r in self.__conveyor.run():
-                if i - item >= self.MAX_RAM:
-                    break
-                if i == item:
-                    res = r[self.__label]
-                    self.__buffer[0] = res
-                if i > item:
-                    self.__buffer[i - item] = r[self.__label]
-                i += 1
-        if res.isnumeric():
-            return np.float(res)
-        return res
+        if self.__buffer is None or not (self.__start <= item < self.__start + len(self.__buffer)):
+            self.__load(item)
+        value = self.__buffer[item - self.__start]
+        if isinstance(value, np.generic):
+            value = value.item()
+        if isinstance(value, float) and value != value:
+            return None
+        return value
 
     def __len__(self):
+        if self.__len is None:
+            self.__len = len(self.__conveyor)
         return self.__len
 
+    def __iter__(self):
+        for batch in self.__conveyor.run_batches(columns=[self.__label]):
+            yield from batch.typed(self.__label)
+
+    def chunks(self, size: int = None, start: int = 0):
+        """
+        Iterate over the column chunk by chunk.
+        :param size: Number of rows parsed at once, chunksize of the conveyor by default
+        :param start: Number of the first row
+        :return: Iterator over arrays of the values: int64 or float64 (missing values are NaN)
+                 for numeric columns, object arrays for the others
+        """
+        label = self.__label
+        numeric = self.__conveyor.schema.type(label) != 'str'
+        for batch in self.__conveyor.run_batches(size, start, columns=[label]):
+            if numeric:
+                try:
+                    yield batch.array(label)
+                    continue
+                except ValueError:
+                    numeric = False
+            yield np.asarray(batch.typed(label), dtype=object)
+
+    def to_numpy(self, chunk: int = None, memory_limit: int = None):
+        """
+        Load the column into one contiguous typed array.
+
+        Columns of a file without operations come from the column cache if it is enabled.
+        :param chunk: Number of rows parsed at once
+        :param memory_limit: Number of bytes to keep in memory, a larger numeric column is written
+                             to a temporary file and memory-mapped. By default the array takes
+                             memory from the process-wide memory_limit budget
+        :return: int64 or float64 array (missing values are NaN) for numeric columns, object array for the others
+        """
+        cached = None if self.__conveyor.todos else self.__conveyor.cached_columns([self.__label])
+        if cached is not None:
+            values, dictionary = cached[self.__label]
+            if dictionary is not None:
+                values = np.asarray(dictionary, dtype=object)[values]
+            return values
+        builder = ArrayBuilder(memory_limit)
+        for values in self.chunks(chunk):
+            if builder.dtype == object and values.dtype != object:
+                values = np.asarray(values.tolist(), dtype=object)
+            elif values.dtype == object and builder.dtype not in (None, object):
+                # a column inferred as numeric turned out to hold strings, start over
+                return np.asarray(list(self), dtype=object)
+            builder.append(values)
+        return builder.result()
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.to_numpy()
+        if dtype is not None:
+            values = values.astype(dtype)
+        return values
+
+    def __buffer__(self, flags):
+        # buffer protocol of Python 3.12+, numeric columns only
+        return memoryview(np.ascontiguousarray(self.to_numpy()))
+
     def min(self, progressbar=True):
         return self.__conveyor.min(self.__label, progressbar)
 
@@ -51,9 +135,21 @@ def max(self, progressbar=True):
     def mean(self, progressbar=True):
         return self.__conveyor.mean(self.__label, progressbar)
 
+    def var(self, ddof=1, progressbar=True):
+        return self.__conveyor.var(self.__label, ddof, progressbar)
+
     def sum(self, progressbar=True):
         return  self.__conveyor.sum(self.__label, progressbar)
 
+    def top_k(self, k: int, largest: bool = True, progressbar=True):
+        """
+        :param k: Number of values to select
+        :param largest: Select the largest values, the smallest ones otherwise
+        :param progressbar: Show progress bar
+        :return: List of the k largest (smallest) values from the first in the order, missing values are skipped
+        """
+        return [values[0] for values in self.__conveyor.top_k(self.__label, k, largest, False, progressbar)]
+
     def corr(self, other, method = 'pearson', progressbar=True):
         if method=='pearson':
             return self.__conveyor.pearson(self.__label, other.__label, progressbar)
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from schema import to_array
+
+
+class ColumnCache:
+    """
+    Columns of csv/zip files stored as typed binary files and memory-mapped on access.
+
+    Numeric columns are kept as int64 or float64, the rest as int32 codes into a dictionary
+    of distinct strings. Entries are keyed by the absolute path of the source file,
+    its modification time and size and the column label, so a changed file is parsed again.
+    """
+    def __init__(self, directory: str = None):
+        """
+        Initialize the cache.
+        :param directory: Directory to keep the binary files in, ~/.cache/samwise by default
+        """
+        if directory is None:
+            directory = os.path.join(os.path.expanduser('~'), '.cache', 'samwise')
+        self.directory = directory
+
+    def __path(self, filename, column):
+        stat = os.stat(filename)
+        key = '\0'.join([os.path.abspath(filename), str(stat.st_mtime_ns), str(stat.st_size), column])
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, filename: str, column: str):
+        """
+        :return: Values of the column and the dictionary of a string column (None for numeric ones),
+                 None if the column is not cached yet
+        """
+        path = self.__path(filename, column)
+        try:
+            with open(path + '.json', encoding='utf-8') as f:
+                meta = json.load(f)
+        except OSError:
+            return None
+        if meta['rows']:
+            values = np.memmap(path + '.bin', dtype=meta['dtype'], mode='r', shape=(meta['rows'],))
+        else:
+            values = np.empty(0, dtype=meta['dtype'])
+        return values, meta.get('dictionary')
+
+    def load(self, filename: str, columns, batches, schema=None):
+        """
+        Read the columns from the cache, building the missing ones in one pass over batches.
+        :param filename: Name of the source file
+        :param columns: Column labels
+        :param batches: Function returning an iterator over raw batches of the file
+        :param schema: Schema of the file, string columns are dictionary-encoded right away
+        :return: Dict label -> (values, dictionary)
+        """
+        res = {column: self.get(filename, column) for column in columns}
+        missing = [column for column, entry in res.items() if entry is None]
+        if schema is not None:
+            strings = [column for column in missing if schema.type(column) == 'str']
+            if strings:
+                self.build(filename, strings, batches(), numeric=False)
+                missing = [column for column in missing if column not in strings]
+                res.update({column: self.get(filename, column) for column in strings})
+        if missing:
+            self.build(filename, missing, batches())
+            for column in missing:
+                entry = self.get(filename, column)
+                if entry is None:
+                    # a numeric column turned out to hold strings, parse it once more
+                    self.build(filename, [column], batches(), numeric=False)
+                    entry = self.get(filename, column)
+                res[column] = entry
+        return res
+
+    def build(self, filename: str, columns, batches, numeric: bool = True):
+        """
+        Convert columns of the file to binary files.
+
+        A column is stored as int64 while every value parses as an integer, then float64
+        (missing values become NaN).
+        If a value which is not a number shows up after numbers were written, the column
+        is skipped and has to be built again with numeric=False.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        paths = {column: self.__path(filename, column) for column in columns}
+        kinds = {column: 'int64' if numeric else 'str' for column in columns}
+        rows = {column: 0 for column in columns}
+        dictionaries = {column: {} for column in columns}
+        files = {column: open(paths[column] + '.bin.tmp', 'wb') for column in columns}
+        try:
+            for batch in batches:
+                for column in columns:
+                    kind = kinds[column]
+                    if kind is None:
+                        continue
+                    values = batch[column]
+                    arr = None
+                    if kind != 'str':
+                        arr = self.__to_number(values, kind)
+                        if arr is None and kind == 'int64':
+                            arr = self.__to_number(values, 'float64')
+                            if arr is not None:
+                                self.__upcast(files[column], paths[column] + '.bin.tmp')
+                                kinds[column] = 'float64'
+                        if arr is None:
+                            if rows[column]:
+                                kinds[column] = None
+                                continue
+                            kinds[column] = kind = 'str'
+                    if kind == 'str':
+                        dictionary = dictionaries[column]
+                        arr = np.fromiter((dictionary.setdefault(v, len(dictionary)) for v in values),
+                                          dtype=np.int32, count=len(values))
+                    arr.tofile(files[column])
+                    rows[column] += len(arr)
+        finally:
+            for f in files.values():
+                f.close()
+        for column in columns:
+            path = paths[column]
+            if kinds[column] is None:
+                os.remove(path + '.bin.tmp')
+                continue
+            meta = {'column': column, 'rows': rows[column], 'dtype': kinds[column]}
+            if kinds[column] == 'str':
+                meta['dtype'] = 'int32'
+                meta['dictionary'] = list(dictionaries[column])
+            os.replace(path + '.bin.tmp', path + '.bin')
+            with open(path + '.json.tmp', 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(path + '.json.tmp', path + '.json')
+
+    @staticmethod
+    def __to_number(values, dtype):
+        if dtype == 'int64':
+            try:
+                return np.asarray(values, dtype=dtype)
+            except (ValueError, TypeError, OverflowError):
+                return None
+        return to_array(values, 'float')
+
+    @staticmethod
+    def __upcast(file, path):
+        file.flush()
+        values = np.fromfile(path, dtype='int64').astype('float64')
+        file.seek(0)
+        file.truncate()
+        values.tofile(file)
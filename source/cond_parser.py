@@ -1,5 +1,8 @@
+import ast
 from typing import Callable
 
+from expr_compiler import frame_name, used_columns, compile_row_func, compile_batch_func
+
 
 class CondParser:
     """
@@ -10,8 +13,12 @@ def __init__(self, cond):
         Initialize the condition parser.
         :param cond: Condition (string or callable)
         """
+        self.batch_cond = None
+        self.columns = None
+        self.source = None
         if isinstance(cond, str):
-            self.cond = self.__str_to_cond(cond)
+            self.source = cond.strip()
+            self.cond, self.batch_cond, self.columns = self.__str_to_cond(cond)
         elif isinstance(cond, Callable):
             self.cond = cond
         else:
@@ -21,13 +28,18 @@ def __init__(self, cond):
     def __str_to_cond(cond_str):
         """
         Convert string into a callable function.
+
+        The string is parsed and compiled once. Simple conditions (comparisons of columns
+        with each other or with constants joined with and/or/not) also get a function
+        computing the mask of a whole batch.
         :param cond_str: Condition string
-        :return: Callable parsed from the string
+        :return: Callable parsed from the string, the batch version of it (or None)
+                 and the set of the columns it uses (None if unknown)
         """
-        x_name = "df"  # TODO: parse x_name from cond_str
-        cond = cond_str.replace(x_name, "x", len(cond_str))
-
-        def tmp_fun(x):
-            return eval(cond)
-
-        return tmp_fun
+        try:
+            node = ast.parse(cond_str.strip(), mode='eval').body
+        except SyntaxError as e:
+            raise ValueError(f'Error: Invalid condition: {cond_str}') from e
+        x_name = frame_name(node)
+        return (compile_row_func(node, x_name, '<filter>'), compile_batch_func(node, x_name, kinds=('bool',)),
+                used_columns(node, x_name))
@@ -1,142 +1,618 @@
 import csv
 import io
 import os
-from sorted_in_disk.utils import read_iter_from_file
-from sorted_in_disk import sorted_in_disk
+import tempfile
+import time
+from contextlib import contextmanager
+from copy import copy
+from functools import partial
 from zipfile import ZipFile
-from math import sqrt
 import warnings
-from tqdm import tqdm_notebook
-from operation import FuncOperation, HeadOperation, ColumnOperation, StatOperation
+from itertools import islice, chain
+from operator import itemgetter
+import numpy as np
+from operation import FuncOperation, HeadOperation, AggOperation, GroupByOperation, JoinOperation, \
+    TopKOperation
+from batch import Batch
+import parallel
+import sources
+from row_index import RowIndex
+from column_cache import ColumnCache
+from schema import Schema
+from plan import Plan
+from join import JoinTable, JOIN_TYPES
+from result_cache import ResultCache
+from memory import manager
+from correlation import kendall_tau_b, average_ranks
+from aggregation import CoMoments, nearest_rank
+from writer import CsvWriter, BinaryWriter, TemporaryCsv
+from sorting import sort_rows, row_key
+from profiler import Profile
+from progress import make_progress
+from asynchronous import stream
 
 
 # logging.basicConfig(encoding='utf-8', level=logging.DEBUG)
 
 
 class Conveyor:
-    def __init__(self, filename: str):
+    results = ResultCache()
+
+    def __init__(self, filename: str, chunksize: int = 10000, workers: int = 1, cache=False, dtype: dict = None,
+                 profile=False):
         """
         Initialize the conveyor class which allows conse
-        :param filename: .zip or usual .csv file: works with any possible file
+        :param filename: .zip or usual .csv file, the csv file may be compressed with gzip, bz2, xz or zstd
+                         (recognized by the magic bytes or the extension, see sources.py)
+        :param chunksize: Number of rows parsed and processed at once
+        :param workers: Number of processes aggregations run in
+        :param cache: Keep the columns used by aggregations in the typed column cache,
+                      True for the default cache directory or a directory name
+        :param dtype: Mapping label -> column type (int, float, str), the other types are inferred
+        :param profile: Record per-stage statistics of the runs, True or a Profile to record into
         """
-        if not (filename.endswith('.csv') or filename.endswith('.zip')):
-            pass  # todo
         self.filename = filename
-        # https://docs.python.org/3/library/os.path.html#os.path.splitext
-        # self.fileformat = os.path.splitext(filename)[1].replace('.', '')
-        self.fileformat = filename.split('.')[-1]
+        self.fileformat, self.compression = sources.detect(filename)
+        self.chunksize = chunksize
+        self.workers = workers
+        if cache:
+            cache = ColumnCache(None if cache is True else cache)
+        self.cache = cache or None
+        self.dtype = dtype
         self.todos = []
+        self.profile = Profile() if profile is True else profile or None
+        self.temporary = None  # TemporaryCsv if the file is a temporary result, kept while the conveyor lives
 
         self.__keys = []
         self.__rows_cnt = 0
         self.not_computed = True
         self.labels = None
         self.__len = None
+        self.__row_index = None
+        self.__schema = None
+        self.__keys_known = False
+        self.__consumed = 0
 
-    def run(self):
+    def run(self, start=0):
         """
         Iteratively go through our conveyor of operations
 
         All the other methods configure this conveyor
 
-        We assume that a zipfile has one .csv file which we parse
+        Rows are yielded one by one as dicts (or lists of values if labels are set),
+        this is a thin adapter over run_batches.
+        :param start: Number of the first row of the file to read
+        :return:
+        """
+        for batch in self.run_batches(start=start, columns=self.labels):
+            yield from self.__rows(batch)
+
+    def __rows(self, batch):
+        if self.labels is not None:
+            columns = []
+            for label in self.labels:
+                columns.append(batch.typed(label))
+            for res in zip(*columns):
+                yield list(res)
+        else:
+            yield from batch.rows()
+
+    async def arun(self, start=0):
+        """
+        Async counterpart of run: the file is read, parsed and passed through the operations
+        in the thread pool shared by the async calls (see asynchronous.py), so the event loop is not blocked.
+        Rows are built in the pool too and handed over a batch at a time through a bounded queue.
+        :param start: Number of the first row of the file to read
+        :return: Async iterator over the rows
+        """
+        batches = stream(lambda: (list(self.__rows(batch))
+                                  for batch in self.run_batches(start=start, columns=self.labels)))
+        async for rows in batches:
+            for row in rows:
+                yield row
+
+    async def arun_batches(self, size=None, start=0, columns=None):
+        """
+        Async counterpart of run_batches, the batches are produced in the shared thread pool
+        at most asynchronous.QUEUE_SIZE batches ahead of the consumer.
+        :return: Async iterator over batches of the rows that passed all the operations
+        """
+        async for batch in stream(lambda: self.run_batches(size, start, columns)):
+            yield batch
+
+    def run_batches(self, size=None, start=0, columns=None):
+        """
+        Iteratively go through our conveyor of operations chunk by chunk
+
+        We assume that a zipfile has one or several .csv files which we parse
 
         Никаких параметров, только эвристики
-        :return:
+        :param size: Number of rows parsed at once, chunksize by default
+        :param start: Number of the first row of the result to yield. If no filter precedes the head
+                      operations, csv files seek to it with the row index and read only the rows taken
+        :param columns: Columns the caller reads from the batches, None for all of them.
+                        If the operations tell which columns they use, only these are parsed
+        :return: Iterator over batches of the rows that passed all the operations
         """
         self.__rows_cnt = 0
         self.__keys = []
+        self.__consumed = 0
+        for task in self.todos:
+            task.reset()
+        if self.profile is not None:
+            self.profile.start()
+        plan = Plan(self.todos, columns)
+        self.__keys_known = plan.columns is None
+        fingerprint = self.fingerprint() if start == 0 else None
+        seekable = all(task.op_type in ('apply', 'agg', 'groupby', 'topk') for task in plan.todos)
+        to_skip = plan.start + (start if seekable else 0)
+        out_skip = 0 if seekable else start
+        left = plan.limit
+        if left is not None and seekable:
+            left = max(0, left - start)
+        for batch, stop in self.__handled(plan, to_skip, left, size or self.chunksize):
+            if out_skip:
+                if out_skip >= len(batch):
+                    out_skip -= len(batch)
+                    batch = batch.slice(0, 0)
+                else:
+                    batch = batch.slice(out_skip, len(batch))
+                    out_skip = 0
+            if len(batch):
+                self.__rows_cnt += len(batch)
+                if not self.__keys:
+                    self.__keys = list(batch.keys)
+                yield batch
+            if stop:
+                break
+        self.results.put(('len', fingerprint), self.__rows_cnt)
+        if self.__keys_known:
+            self.results.put(('keys', fingerprint), self.__keys)
+        if self.profile is not None:
+            self.profile.finish(self.__rows_cnt)
+        self.__finish()
 
-        def update(row):
-            self.__rows_cnt += 1
-            if not self.__keys:
-                self.__keys = list(row.keys())
+    def __handled(self, plan, to_skip, left, size):
+        """
+        Read the window of rows of the plan and pass them through the operations,
+        then pass the rows the operations yield at the end (e.g. unmatched rows of a join) through the rest.
+        :return: Iterator over the batches passed and True if reading must stop
+        """
+        stop = left == 0
+        done = 0  # bytes of the sources read to the end
+        for file, header, skipped in ([] if stop else self.__sources(to_skip)):
+            to_skip -= skipped
+            chunk = size
+            if left is not None:
+                chunk = max(1, min(chunk, to_skip + left))
+            batches = self.__read_batches(file, chunk, header, columns=plan.columns)
+            if self.profile is not None:
+                batches = self.__timed(batches, self.profile.stage('read', 'read', self.filename), file)
+            for batch in batches:
+                self.__consumed = done + (sources.position(file) or 0)
+                if to_skip:
+                    if to_skip >= len(batch):
+                        to_skip -= len(batch)
+                        continue
+                    batch = batch.slice(to_skip, len(batch))
+                    to_skip = 0
+                if left is not None:
+                    if len(batch) >= left:
+                        batch = batch.slice(0, left)
+                        stop = True
+                    left -= len(batch)
+                batch, stop_head = self.batch_handler(batch, plan.todos)
+                if stop_head:
+                    yield batch, True
+                    return
+                yield batch, False
+                if stop:
+                    break
+            if stop:
+                break
+            done += sources.position(file) or 0
+            self.__consumed = done
+        for i, task in enumerate(plan.todos):
+            tails = task.finish(size)
+            if self.profile is not None:
+                tails = self.__timed(tails, self.profile.operation(self.todos.index(task), task))
+            for batch in tails:
+                batch, stop_head = self.batch_handler(batch, plan.todos[i + 1:])
+                yield batch, stop_head
+                if stop_head:
+                    return
 
+    @staticmethod
+    def __timed(batches, stage, file=None):
+        """
+        Record the time spent producing the batches, their rows and the bytes read from the file into a stage.
+        """
+        start = None if file is None else sources.position(file)
+        batches = iter(batches)
+        try:
+            while True:
+                began = time.perf_counter()
+                batch = next(batches, None)
+                stage.seconds += time.perf_counter() - began
+                if batch is None:
+                    return
+                stage.calls += 1
+                stage.rows_out += len(batch)
+                yield batch
+        finally:
+            end = None if start is None else sources.position(file)
+            if end is not None:
+                stage.bytes = (stage.bytes or 0) + end - start
+
+    def __input_size(self):
+        """
+        :return: Number of bytes of the (compressed) csv file or of the members of the zip file, None if unknown
+        """
+        try:
+            if self.fileformat == 'zip':
+                with ZipFile(self.filename) as arh:
+                    return sum(info.file_size for info in sources.zip_members(arh))
+            return os.path.getsize(self.filename)
+        except (OSError, ValueError):
+            return None
+
+    def fingerprint(self):
+        """
+        :return: Hashable description of the source file and the operations changing the rows,
+                 None if the file cannot be read
+        """
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+        dtype = tuple(sorted((key, str(kind)) for key, kind in (self.dtype or {}).items()))
+        return (os.path.abspath(self.filename), stat.st_mtime_ns, stat.st_size, dtype,
+                tuple(task.fingerprint() for task in self.todos if task.modifying))
+
+    def __finish(self):
+        # todo: recreate object before each test or reset todos after run
+        self.todos = [task for task in self.todos if task.modifying]
+        for task in self.todos:
+            task.reset()
+        self.not_computed = False
+
+    def __parts(self):
+        """
+        Split the input into parts which can be processed independently.
+        :return: List of parts, None if the pipeline must run sequentially
+        """
+        if self.workers <= 1 or not parallel.available():
+            return None
+        if any(task.op_type in ('head', 'join') for task in self.todos):
+            return None
         if self.fileformat == 'csv':
-            with open(self.filename, newline='') as csvfile:
-                for r in self.rows_handler(csv.DictReader(csvfile)):
-                    update(r)
-                    if self.labels is not None:
-                        res = []
-                        for label in self.labels:
-                            tmp = r[label]
-                            if tmp.isnumeric():
-                                res.append(float(r[label]))
-                            else:
-                                res.append(r[label])
-                        yield res
-                    else:
-                        yield r
+            opener = self.__opener()
+            if self.compression is not None and opener is None:
+                return None
+            header, ranges = parallel.split_csv(self.filename, self.workers * 4, opener=opener)
+            scale = 1 if opener is None or not ranges else os.path.getsize(self.filename) / ranges[-1][1]
+            parts = [('range', start, end, header, round((end - start) * scale)) for start, end in ranges]
         elif self.fileformat == 'zip':
-            # todo doesn't work if there is 1 directory with all files
+            with ZipFile(self.filename) as arh:
+                parts = [('member', info.filename, info.file_size) for info in sources.zip_members(arh)]
+        else:
+            return None
+        return parts if len(parts) > 1 else None
+
+    def __opener(self):
+        """
+        Compressed csv files are split into parts only in the zstd seekable format with several frames:
+        the records are found in one pass over the decompressed data and every part is decompressed
+        from the frame holding its start. Streams of the other codecs are read from the start.
+        :return: Function opening the decompressed data of the file for seeking (see parallel.RangeFile),
+                 None if the file is not compressed or cannot be seeked
+        """
+        if self.compression == 'zstd' and sources.zstandard is not None:
+            frames = sources.zstd_frames(self.filename)
+            if frames is not None and len(frames) > 2:
+                return partial(sources.SeekableZstdFile, frames=frames)
+        return None
+
+    def _scan_part(self, part):
+        """
+        Run the operations over one part of the input, called in a worker process.
+        :param part: ('range', start, end, header, size) of a csv file or ('member', name, size) of a zip file,
+                     size is the number of bytes of the input file the part covers
+        :return: Number of rows passed, keys, the mergeable operations and the stages recorded
+                 if the conveyor is profiled
+        """
+        if part[0] == 'range':
+            _, start, end, header, _ = part
+            file = parallel.open_range(self.filename, start, end, opener=self.__opener())
+            origin = start
+        else:
             arh = ZipFile(self.filename)
-            names = arh.namelist()
-            for n in names:
-                # files are not sorted here
-                with arh.open(n, "r") as file:
-                    with io.TextIOWrapper(file, encoding="utf-8") as f:
-                        for r in self.rows_handler(csv.DictReader(f)):
-                            update(r)
-                            if self.labels is not None:
-                                res = []
-                                for label in self.labels:
-                                    res.append(r[label])
-                                yield res
-                            else:
-                                yield r
+            file = sources.open_member(arh, arh.getinfo(part[1]))
+            header = None
+            origin = [info.filename for info in sources.zip_members(arh)].index(part[1])
+        for task in self.todos:
+            task.reset()
+            task.origin = origin
+        rows_cnt = 0
+        keys = []
+        plan = Plan(self.todos, set())
+        with file:
+            batches = self.__read_batches(file, self.chunksize, header, columns=plan.columns)
+            if self.profile is not None:
+                self.profile = Profile()
+                self.profile.start()
+                read = self.profile.stage('read', 'read', self.filename)
+                batches = self.__timed(batches, read, None if part[0] == 'range' else file)
+                if part[0] == 'range':
+                    read.bytes = part[-1]
+            for batch in batches:
+                batch, _ = self.batch_handler(batch, plan.todos)
+                rows_cnt += len(batch)
+                if len(batch) and not keys:
+                    keys = list(batch.keys)
+        stages = None if self.profile is None else self.profile.stages
+        return rows_cnt, keys, [task for task in self.todos if task.mergeable], stages
+
+    def run_parallel(self):
+        """
+        Run the conveyor in a process pool and merge the partial results of mergeable
+        operations (aggregations) into the ones in todos. Rows are not yielded.
+
+        Falls back to run_batches if the pipeline cannot be split (e.g. has a head operation).
+        :return: Iterator over the numbers of rows passed in every part
+        """
+        self.__consumed = 0
+        parts = self.__parts()
+        if parts is None:
+            for batch in self.run_batches(columns=set()):
+                yield len(batch)
+            return
+        self.__rows_cnt = 0
+        self.__keys = []
+        self.__keys_known = False
+        tasks = [task for task in self.todos if task.mergeable]
+        fingerprint = self.fingerprint()
+        total = self.__input_size()
+        if total is not None:
+            self.__consumed = max(0, total - sum(part[-1] for part in parts))  # e.g. the header line
+        self.schema  # infer it once before forking
+        if self.profile is not None:
+            self.profile.start()
+        for part, (rows_cnt, keys, results, stages) in zip(parts, parallel.scan(self, parts, self.workers)):
+            self.__consumed += part[-1]
+            for task, result in zip(tasks, results):
+                task.merge(result)
+            if stages is not None:
+                self.profile.merge(stages)
+            self.__rows_cnt += rows_cnt
+            if not self.__keys:
+                self.__keys = keys
+            yield rows_cnt
+        self.results.put(('len', fingerprint), self.__rows_cnt)
+        if self.profile is not None:
+            self.profile.finish(self.__rows_cnt)
+        self.__finish()
+
+    def __sources(self, start=0):
+        """
+        :param start: Number of the first row to read, a csv file is opened at the closest indexed row
+        :return: Iterator over text streams of all the csv files to parse, their headers
+                 if the stream does not start with one and the numbers of rows skipped by seeking
+        """
+        if self.fileformat == 'csv':
+            index = self.row_index if start else None
+            if index is not None:
+                offset, skipped = index.locate(start)
+                with open(self.filename, 'rb') as file:
+                    file.seek(offset)
+                    with io.TextIOWrapper(file, encoding="utf-8", newline='') as f:
+                        yield f, index.header, skipped
+            elif self.compression is not None:
+                with sources.open_text(sources.open_decompressed(self.filename, self.compression)) as f:
+                    yield f, None, 0
+            else:
+                with open(self.filename, newline='', encoding="utf-8") as csvfile:
+                    yield csvfile, None, 0
+        elif self.fileformat == 'zip':
+            with ZipFile(self.filename) as arh:
+                for info in sources.zip_members(arh):
+                    # files are not sorted here
+                    with sources.open_member(arh, info) as f:
+                        yield f, None, 0
         else:
             pass
-        # todo: recreate object before each test or reset todos after run
-        self.todos = [task for task in self.todos if task.modifying]
+
+    @property
+    def header(self):
+        """
+        Column labels in the header line of the (first) csv file.
+        """
+        index = self.row_index
+        if index is not None:
+            return index.header
+        for file, header, _ in self.__sources():
+            return header if header is not None else next(csv.reader(file), [])
+        return []
+
+    @property
+    def schema(self):
+        """
+        Types of the columns of the result: the columns of the file, inferred from its first rows
+        and the dtype mapping, and the columns joined to them.
+        """
+        schema = self.__file_schema()
         for task in self.todos:
-            task.reset()
-        self.not_computed = False
+            if task.op_type == 'join':
+                schema = task.schema(schema)
+        return schema
 
-    def rows_handler(self, reader):
-        for row in reader:
-            is_good_row = True
-            break_flag = False
-            for task in self.todos:
-                if task.op_type == 'filter':
-                    op = task.func
-                    is_good_row = is_good_row and op(row)
-                elif task.op_type == 'apply':
-                    op = task.func
-                    op(row)
-                elif task.op_type == 'head':
-                    if is_good_row:
-                        if task.cnt == task.n:
-                            break_flag = True
-                            break
-                        task.cnt += 1
-                elif task.op_type == 'sum':
-                    task.cnt += float(row[task.column])
-                elif task.op_type == 'pearson':
-                    xi = float(row[task.col_x])
-                    yi = float(row[task.col_y])
-                    mean_x = task.values['mean_x']
-                    mean_y = task.values['mean_y']
-                    dx = xi - mean_x
-                    dy = yi - mean_y
-                    task.values['sum_dx_dy'] += dx * dy
-                    task.values['sum_squares_dx'] += dx * dx
-                    task.values['sum_squares_dy'] += dy * dy
-                else:
-                    pass
+    def __file_schema(self):
+        if self.__schema is None:
+            sample = Batch([])
+            for file, header, _ in self.__sources():
+                for batch in self.__read_batches(file, Schema.SAMPLE, header, schema=False):
+                    sample = batch
+                    break
+                break
+            self.__schema = Schema.infer(sample, self.dtype)
+        return self.__schema
 
-            if break_flag:
+    @property
+    def row_index(self):
+        """
+        Offsets of the rows of a csv file, built on first use and kept on disk.
+        None for other formats and compressed files.
+        """
+        if self.fileformat != 'csv' or self.compression is not None:
+            return None
+        if self.__row_index is None or not self.__row_index.is_valid():
+            self.__row_index = RowIndex.load(self.filename)
+        return self.__row_index
+
+    def __read_batches(self, file, size, header=None, schema=True, columns=None):
+        """
+        Parse csv file into batches of at most size rows.
+        Missing trailing fields are filled with None, extra ones are dropped.
+        :param header: Column labels if the file has no header line
+        :param schema: Attach the schema of the file to the batches
+        :param columns: Columns to keep, None for all of them
+        """
+        schema = self.__file_schema() if schema else None
+        reader = csv.reader(file)
+        if header is None:
+            header = next(reader, None)
+        if header is None:
+            return
+        if columns is not None:
+            yield from self.__read_projected(file, size, header, columns, schema)
+            return
+        width = len(header)
+        while True:
+            rows = list(islice(reader, size))
+            if not rows:
+                return
+            if any(len(row) != width for row in rows):
+                rows = [(row + [None] * width)[:width] for row in rows if row]
+            yield Batch(header, rows, schema=schema)
+
+    @staticmethod
+    def __read_projected(file, size, header, columns, schema):
+        """
+        Parse only the given columns of csv file into batches of at most size rows.
+
+        Chunks without quotes are split on commas only up to the last needed field,
+        chunks with quotes go through csv.reader (which may read more lines if a quoted
+        field goes on after the chunk).
+        """
+        index = {key: i for i, key in enumerate(header)}
+        keys = [key for key in dict.fromkeys(columns) if key in index]
+        picks = [index[key] for key in keys]
+        need = max(picks) + 1 if picks else 0
+        if len(picks) == 1:
+            pick = lambda row, i=picks[0]: (row[i],)
+        elif picks:
+            pick = itemgetter(*picks)
+        else:
+            pick = lambda row: ()
+        while True:
+            lines = list(islice(file, size))
+            if not lines:
+                return
+            if any('"' in line for line in lines):
+                reader = csv.reader(chain(lines, file))
+                rows = []
+                while reader.line_num < len(lines):
+                    row = next(reader, None)
+                    if row is None:
+                        break
+                    if row:
+                        rows.append(row)
+            else:
+                rows = [line.rstrip('\r\n').split(',', need) for line in lines if line not in ('\n', '\r\n')]
+            if rows and min(map(len, rows)) < need:
+                rows = [row + [None] * (need - len(row)) for row in rows]
+            yield Batch(keys, list(map(pick, rows)), schema=schema)
+
+    def batch_handler(self, batch, todos=None):
+        """
+        Pass a batch through all the operations.
+        :param batch: Batch of parsed rows
+        :param todos: Operations in the order to run them, self.todos by default
+        :return: Batch of the rows that passed all the operations and True if reading must stop
+        """
+        stop = False
+        profile = self.profile
+        for task in self.todos if todos is None else todos:
+            if not len(batch):
                 break
+            if profile is None:
+                batch, stop_task = self.__handle(task, batch)
+            else:
+                stage = profile.operation(self.todos.index(task) if task in self.todos else -1, task)
+                rows_in = len(batch)
+                began = time.perf_counter()
+                batch, stop_task = self.__handle(task, batch)
+                stage.seconds += time.perf_counter() - began
+                stage.calls += 1
+                stage.rows_in += rows_in
+                stage.rows_out += len(batch)
+            stop = stop or stop_task
+        return batch, stop
 
-            if is_good_row:
-                yield row
+    @staticmethod
+    def __handle(task, batch):
+        """
+        Pass a batch through one operation.
+        :return: Batch of the rows that passed the operation and True if reading must stop
+        """
+        stop = False
+        if task.op_type == 'filter':
+            mask = None if task.batch_func is None else task.batch_func(batch)
+            if mask is None:
+                op = task.func
+                # compiled expressions see typed values on both paths, callables get the raw rows
+                rows = batch.rows() if task.batch_func is None else batch.typed_rows(task.columns)
+                mask = [bool(op(row)) for row in rows]
+            if not np.all(mask):
+                batch = batch.take(mask)
+        elif task.op_type == 'apply':
+            if task.batch_func is None or not task.batch_func(batch):
+                op = task.func
+                if task.batch_func is not None and task.target is not None:
+                    rows = batch.typed_rows(task.columns)
+                    for row in rows:
+                        op(row)
+                    batch[task.target] = [row[task.target] for row in rows]
+                else:
+                    rows = batch.rows()
+                    for row in rows:
+                        op(row)
+                    batch = Batch.from_dicts(rows, batch.schema)
+        elif task.op_type == 'head':
+            if task.skipped < task.offset:
+                skip = min(task.offset - task.skipped, len(batch))
+                task.skipped += skip
+                batch = batch.slice(skip, len(batch))
+            if task.n is not None:
+                left = task.n - task.cnt
+                if len(batch) >= left:
+                    batch = batch.slice(0, left)
+                    stop = True
+            task.cnt += len(batch)
+        elif task.op_type in ('agg', 'groupby', 'topk'):
+            task.update_batch(batch)
+        elif task.op_type == 'join':
+            batch = task.join_batch(batch)
+        return batch, stop
 
-    def filter(self, f):
-        self.todos.append(FuncOperation('filter', func=f))
+    def filter(self, f, batch_f=None, columns=None, source=None):
+        self.todos.append(FuncOperation('filter', func=f, batch_func=batch_f, columns=columns, source=source))
         self.not_computed = True
         return self
 
-    def apply(self, f):
-        self.todos.append(FuncOperation('apply', func=f))
+    def apply(self, f, batch_f=None, columns=None, target=None, source=None):
+        self.todos.append(FuncOperation('apply', func=f, batch_func=batch_f, columns=columns, target=target,
+                                        source=source))
         self.not_computed = True
         return self
 
@@ -145,220 +621,491 @@ def head(self, n):
         self.not_computed = True
         return self
 
+    def slice(self, start, stop=None):
+        """
+        Take the rows from start to stop (not included).
+        :param start: Number of the first row to take
+        :param stop: Number of the row to stop at, None to take all the rest
+        """
+        n = None if stop is None else max(0, stop - start)
+        self.todos.append(HeadOperation('head', n=n, offset=start))
+        self.not_computed = True
+        return self
+
+    def join(self, other, on, how='inner', suffixes=('_x', '_y')):
+        """
+        Join the rows with the rows of another conveyor having equal values of the key columns.
+        Nothing is read here: the smaller file (by size) is hashed when the result is first read
+        and the rows of the larger one are streamed through the hash table.
+        If the hash table does not fit into the memory limit, both sides are partitioned on disk
+        by the hash of the key and joined partition by partition (rows come in the order of the partitions then).
+        :param other: Conveyor of the right side, it is not changed
+        :param on: Key columns present on both sides
+        :param how: 'inner', 'left', 'right' or 'outer'
+        :param suffixes: Suffixes of the labels of the left and the right columns present on both sides
+        :return: New conveyor yielding the joined rows
+        """
+        if how not in JOIN_TYPES:
+            raise ValueError(f'Unexpected join type: {how}')
+        on = [on] if isinstance(on, str) else list(on)
+        for side in (self, other):
+            missing = [] if side.todos else [key for key in on if key not in side.header]
+            if missing:
+                raise ValueError(f'Key columns {missing} are not in {side.filename}')
+        stream_left = self.__file_size() >= other.__file_size()
+        stream, table = (self, other) if stream_left else (other, self)
+        res = stream.copy()
+        res.todos.append(JoinOperation('join', JoinTable(table, on), how, stream_left, stream.header, suffixes,
+                                       columns=stream.labels))
+        res.labels = None
+        res.not_computed = True
+        return res
+
+    def __file_size(self):
+        try:
+            return os.path.getsize(self.filename)
+        except OSError:
+            return 0
+
+    @contextmanager
+    def profiling(self, callback=None):
+        """
+        Record per-stage statistics of the runs inside the block.
+        :param callback: Function called with the report of every run
+        :return: Context manager giving the Profile
+        """
+        previous = self.profile
+        self.profile = Profile(callback)
+        try:
+            yield self.profile
+        finally:
+            self.profile = previous
+
+    def copy(self):
+        """
+        :return: Conveyor over the same file with a copy of the operations, results computed so far are shared
+        """
+        new = copy(self)
+        new.todos = [copy(task) for task in self.todos]
+        return new
+
     def __len__(self):
+        if self.not_computed and all(task.op_type in ('head', 'apply') for task in self.todos):
+            plan = Plan(self.todos, set())
+            if plan.limit is None or plan.limit > self.chunksize:
+                index = self.row_index
+                if index is not None:
+                    rows = max(0, len(index) - plan.start)
+                    return rows if plan.limit is None else min(rows, plan.limit)
         if self.not_computed:
-            for _ in self.run():
+            cached = self.results.get(('len', self.fingerprint()))
+            if cached is not None:
+                return cached
+            for _ in self.run_batches(columns=set()):
                 pass
         return self.__rows_cnt
 
     @property
     def keys(self):
-        if self.not_computed:
-            for _ in self.run():
+        if self.not_computed or not self.__keys_known:
+            if not self.todos:
+                return list(dict.fromkeys(self.header)) if len(self) else []
+            cached = self.results.get(('keys', self.fingerprint()))
+            if cached is not None:
+                return list(cached)
+            for _ in self.run_batches():
                 pass
         return self.__keys
 
-    def sort(self, key, inplace=True):
-        iterable_with_unsorted_data = read_iter_from_file(self.filename)
-        label = key
-        index = -1
-        for keys_string in iterable_with_unsorted_data:
-            keys = keys_string.split(',')
-            for key in keys:
-                index += 1
-                if key == label:
-                    break
-            break
+    def sort(self, by, ascending=True, inplace=False, limit=None):
+        """
+        Sort the rows that passed all the operations by the values of columns, on disk if needed.
+        Keys are typed by the schema and computed once per row.
+        The result is written to a temporary file first, so a failure leaves the source as it was.
+        :param by: Name of the column to sort by or a list of them
+        :param ascending: Sort ascending vs. descending, one value for all the columns or a list of them
+        :param inplace: Replace the csv file with the sorted rows (the operations are dropped then),
+                        otherwise write them to a new temporary csv file
+        :param limit: Number of the first sorted rows to keep, they are selected with a heap of that size
+        :return: Conveyor of the sorted rows
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        ascending = [ascending] * len(by) if isinstance(ascending, bool) else list(ascending)
+        if len(ascending) != len(by):
+            raise ValueError('Length of ascending must match the number of columns to sort by.')
+        if inplace and (self.fileformat != 'csv' or self.compression is not None):
+            raise ValueError('Only uncompressed csv files can be sorted in place.')
+        batches = self.run_batches()
+        first = next(batches, None)
+        header = list(first.keys) if first is not None else list(dict.fromkeys(self.header))
+        missing = [column for column in by if column not in header]
+        if missing:
+            raise ValueError(f'Unexpected columns to sort by: {missing}')
+        rows = (row for batch in chain([first] if first is not None else [], batches)
+                for row in zip(*[batch[label] for label in header]))
+        rows = sort_rows(rows, row_key(self.schema, header, by, ascending), limit)
+        temporary = None if inplace else TemporaryCsv('samwise-sort-')
+        filename = self.filename if inplace else temporary.filename
+        with CsvWriter(filename, header) as writer:
+            writer.write_rows(rows)
+        if inplace:
+            self.todos = []
+            self.not_computed = True
+            self.__row_index = None
+            self.__schema = None
+            return self
+        return self.derived(filename, temporary)
 
-        if index == -1:
-            return False
+    def derived(self, filename: str, temporary=None):
+        """
+        :param filename: Name of a csv file with a result of the conveyor
+        :param temporary: TemporaryCsv of the file if it is temporary, it is removed when the conveyor
+                          and its copies are collected
+        :return: Conveyor over the file with the settings (chunksize, workers, cache, dtype, profile) of this one
+        """
+        conveyor = Conveyor(filename, self.chunksize, self.workers, dtype=self.dtype, profile=self.profile)
+        conveyor.cache = self.cache
+        conveyor.temporary = temporary
+        return conveyor
 
-        def formatted(elem):
-            if elem.isdigit():
-                return float(elem)
-            return elem
+    def to_csv(self, filename: str, compression='infer', progressbar=True, desc="Writing"):
+        """
+        Stream the rows that passed all the operations to a csv file.
+        The file is written next to the target under a temporary name and renamed over it at the end,
+        so it may be the source file itself.
+        :param filename: Name of the file
+        :param compression: 'infer' to take it from the extension of the file (.gz, .bz2, .xz, .zst, .zip),
+                            'gzip', 'bz2', 'xz', 'zstd', 'zip' or None
+        :param progressbar: Show progress: True, False or a backend, see progress.make_progress
+        :param desc: Progress bar description
+        :return: Number of rows written
+        """
+        return self.__write(CsvWriter, filename, compression, progressbar, desc)
 
-        sid = sorted_in_disk(iterable_with_unsorted_data, key=lambda line: formatted(list(csv.reader(line.splitlines()))[0][index]))
+    def to_binary(self, filename: str, compression='infer', progressbar=True, desc="Writing"):
+        """
+        Stream the rows that passed all the operations to a columnar binary file of typed blocks
+        (see BinaryWriter), written like to_csv.
+        :return: Number of rows written
+        """
+        return self.__write(BinaryWriter, filename, compression, progressbar, desc)
 
-        if inplace:
-            filename = self.filename
-            with open(filename, 'w') as fout:
-                print(keys_string, file=fout)
-                for sorted_line in sid:
-                    print(sorted_line, file=fout)
-            return self
+    def __write(self, writer_class, filename, compression, progressbar, desc):
+        batches = self.run_batches(columns=self.labels)
+        first = next(batches, None)
+        if self.labels is not None:
+            header = list(self.labels)
+        elif first is not None:
+            header = list(first.keys)
         else:
-            filename = os.path.splitext(self.filename)[0] + '_sorted.csv'
-            with open(filename, 'w') as fout:
-                print(keys_string, file=fout)
-                for sorted_line in sid:
-                    print(sorted_line, file=fout)
-            return Conveyor(filename)
+            header = list(dict.fromkeys(self.header))
+        with writer_class(filename, header, compression) as writer:
+            for batch in self.__progress(chain([first] if first is not None else [], batches), desc, progressbar):
+                writer.write_batch(batch)
+        return writer.rows
 
     def procentile(self, key, procentile):
-        sorted_conveyor = self.sort(key, False)
-        num_rows = len(sorted_conveyor)
-        percent_row_num = int(procentile * num_rows)
-        for i, row in enumerate(sorted_conveyor.run()):
-            if i + 1 == percent_row_num:
-                return row
+        return self.procentiles(key, [procentile])[0]
+
+    def procentiles(self, key, procentiles):
+        """
+        Nearest-rank quantiles of the rows sorted by a column, like quantile for numeric columns:
+        rows with an empty value of the column are skipped. The rows are sorted once for all
+        the fractions and the sorted copy is removed at the end.
+        :param key: Name of the column to sort by
+        :param procentiles: Fractions between 0 and 1
+        :return: List of the rows (dicts), None if no row has a value of the column
+        """
+        present = self.copy().filter(lambda row: row[key] is not None and row[key] != '',
+                                     lambda batch: np.array([v is not None and v != '' for v in batch[key]],
+                                                            dtype=bool),
+                                     columns={key})
+        sorted_conveyor = present.sort(key)
+        try:
+            num_rows = len(sorted_conveyor)
+            res = []
+            for procentile in procentiles:
+                row = None
+                if num_rows:
+                    for batch in sorted_conveyor.run_batches(1, nearest_rank(procentile, num_rows) - 1):
+                        row = batch.rows()[0]
+                        break
+                res.append(row)
+            return res
+        finally:
+            sorted_conveyor.temporary.remove()
 
     def median(self, key):
         return self.procentile(key, 0.5)
 
-    def sum(self, column, progressbar=True, method='sum'):
-        total_rows = len(self)
-        task_sum = ColumnOperation('sum', column, False)
-        self.todos.append(task_sum)
-        if progressbar:
-            for _ in tqdm_notebook(self.run(), total=len(self), desc= "Searching {}".format(method)):
-                pass
+    def quantile(self, column, q, approx=False, error=0.01, progressbar=True):
+        """
+        Nearest-rank quantiles of a numeric column, missing values are skipped.
+
+        A mergeable KLL sketch is built in one pass (in parallel if workers are set).
+        In the exact mode one more pass keeps only the values between the sketch estimates
+        around every requested rank and selects the exact value among them.
+        :param column: Label of a numeric column
+        :param q: Fraction between 0 and 1 or a list of them
+        :param approx: Return the sketch estimates, their rank error is about error * number of rows
+        :param error: Rank error of the sketch, a smaller one takes more memory and
+                      makes the exact selection keep fewer values
+        :param progressbar: Show progress: True, False or a backend, see progress.make_progress
+        :return: Value of the quantile (a list for a list of fractions), None if there are no values
+        """
+        qs = list(q) if isinstance(q, (list, tuple)) else [q]
+        for fraction in qs:
+            if not 0 <= fraction <= 1:
+                raise ValueError(f'Quantile should be between 0 and 1, got {fraction}')
+        sketch = self.aggregate(quantiles=(column,), error=error, progressbar=progressbar,
+                                desc="Searching quantile").sketches[column]
+        n = sketch.count
+        if approx or not n:
+            res = sketch.quantiles(qs)
         else:
-            for _ in self.run():
+            res = self.__select(column, [nearest_rank(fraction, n) - 1 for fraction in qs],
+                                sketch, 2 * error, progressbar)
+        if self.schema.type(column) == 'int':
+            res = [None if value is None else int(value) for value in res]
+        return res if isinstance(q, (list, tuple)) else res[0]
+
+    def __select(self, column, ranks, sketch, margin, progressbar):
+        """
+        Find the values of the given ranks (0-based) of a column, reading it once
+        if the sketch estimates hold, once more for the ranks where they did not.
+        """
+        n = sketch.count
+        lows = sketch.quantiles([max(0.0, (rank + 1) / n - margin) for rank in ranks])
+        highs = sketch.quantiles([min(1.0, (rank + 1) / n + margin) for rank in ranks])
+        res = [None] * len(ranks)
+        while True:
+            todo = [i for i, value in enumerate(res) if value is None]
+            if not todo:
+                return res
+            below = [0] * len(ranks)
+            windows = [[] for _ in ranks]
+            for values, in self.__numeric_chunks((column,), progressbar, "Selecting quantile"):
+                for i in todo:
+                    below[i] += int(np.count_nonzero(values < lows[i]))
+                    windows[i].append(values[(values >= lows[i]) & (values <= highs[i])])
+            for i in todo:
+                window = np.concatenate(windows[i])
+                k = ranks[i] - below[i]
+                if k < 0:
+                    lows[i] = -np.inf
+                elif k >= len(window):
+                    highs[i] = np.inf
+                else:
+                    res[i] = np.partition(window, k)[k].item()
+
+    def __progress(self, iterable, desc, progressbar):
+        """
+        Report progress of a run of the conveyor if requested.
+
+        Progress is the number of bytes consumed from the file (or the members of the zip file)
+        out of its size, so nothing is counted beforehand.
+        :param iterable: Iterator over the results of run_batches or run_parallel
+        :param progressbar: True for the backend of the 'progress' option, a name of a backend
+                            or a callable making a Progress, see progress.make_progress
+        """
+        if not progressbar:
+            yield from iterable
+            return
+        reported = 0
+        with make_progress(progressbar, self.__input_size(), desc) as bar:
+            for item in iterable:
+                bar.update(self.__consumed - reported)
+                reported = self.__consumed
+                yield item
+            bar.update(self.__consumed - reported)
+
+    def aggregate(self, columns=(), pairs=(), extremes=(), progressbar=True, desc="Aggregating",
+                  quantiles=(), error=0.01):
+        """
+        Collect all the requested statistics in a single pass over the data.
+        :param columns: Numeric columns to collect count, sum, mean and variance for
+        :param pairs: (col_x, col_y) tuples to collect co-moments for
+        :param extremes: Columns to collect minimum and maximum for
+        :param progressbar: Show progress: True, False or a backend, see progress.make_progress
+        :param desc: Progress bar description
+        :param quantiles: Numeric columns to build quantile sketches for
+        :param error: Rank error of the quantile sketches as a fraction of the number of rows
+        :return: AggOperation holding the collected statistics
+        """
+        task = AggOperation('agg', columns, pairs, extremes, False, quantiles, error)
+        fingerprint = self.fingerprint()
+        key = None if fingerprint is None else ('agg', fingerprint, task.fingerprint())
+        cached = self.results.get(key)
+        if cached is not None:
+            return cached
+        if self.cache is not None and not self.todos:
+            used = list(dict.fromkeys(list(columns) + [col for pair in pairs for col in pair] + list(extremes)
+                                      + list(quantiles)))
+            task.update_arrays(self.cached_columns(used))
+        else:
+            self.todos.append(task)
+            for _ in self.__progress(self.run_parallel(), desc, progressbar):
                 pass
-        return task_sum.cnt
+        self.results.put(key, task)
+        return task
+
+    def group(self, keys, columns, progressbar=True, desc="Grouping"):
+        """
+        Collect statistics of numeric columns per group of rows in a single pass over the data.
+        :param keys: Columns the rows are grouped by
+        :param columns: Numeric columns to collect the statistics for
+        :param progressbar: Show progress: True, False or a backend, see progress.make_progress
+        :param desc: Progress bar description
+        :return: GroupTable with the statistics, its groups may be spilled to disk
+        """
+        task = GroupByOperation('groupby', keys, columns)
+        self.todos.append(task)
+        for _ in self.__progress(self.run_parallel(), desc, progressbar):
+            pass
+        return task.table
+
+    def top_k(self, columns, n, largest=True, rows=True, progressbar=True, desc="Selecting"):
+        """
+        Select the rows with the largest (or smallest) values of numeric columns in a single pass
+        over the data with a heap of n rows (a heap per worker, merged at the end). Nothing is sorted.
+        :param columns: Column label or a list of them, compared in turn
+        :param n: Number of rows to select
+        :param largest: Select the largest values, the smallest ones otherwise
+        :param rows: Return the whole rows, only the values of the columns otherwise
+        :param progressbar: Show progress: True, False or a backend, see progress.make_progress
+        :param desc: Progress bar description
+        :return: List of row dicts (of raw values) or tuples of the values of the columns, from the first in the order.
+                 Ties go in the order of the rows
+        """
+        columns = [columns] if isinstance(columns, str) else list(columns)
+        task = TopKOperation('topk', columns, n, largest, rows)
+        self.todos.append(task)
+        for _ in self.__progress(self.run_parallel(), desc, progressbar):
+            pass
+        return task.result()
+
+    def cached_columns(self, columns):
+        """
+        Typed values of the columns of the file, read from the column cache and
+        built there on first access.
+        :param columns: Column labels
+        :return: Dict label -> (values, dictionary) as returned by ColumnCache.load, None if the cache is off
+        """
+        if self.cache is None:
+            return None
+        return self.cache.load(self.filename, columns,
+                               lambda: Conveyor(self.filename, self.chunksize).run_batches(columns=columns),
+                               self.__file_schema())
+
+    def paired_arrays(self, col_x, col_y, progressbar=True, desc="Reading columns", directory=None):
+        """
+        Values of two numeric columns of the rows that passed all the operations,
+        read from the column cache if possible.
+        :param directory: Directory to write the values to as binary files, they are kept in memory if None
+        :return: Two float64 arrays (memmaps if directory is given), pairs with a missing value are dropped
+        """
+        chunks = self.__numeric_chunks((col_x, col_y), progressbar, desc)
+        if directory is None:
+            xs, ys = [np.empty(0)], [np.empty(0)]
+            for x, y in chunks:
+                xs.append(x)
+                ys.append(y)
+            return np.concatenate(xs), np.concatenate(ys)
+        paths = [os.path.join(directory, name) for name in ('x.bin', 'y.bin')]
+        n = 0
+        with open(paths[0], 'wb') as fx, open(paths[1], 'wb') as fy:
+            for x, y in chunks:
+                x.tofile(fx)
+                y.tofile(fy)
+                n += len(x)
+        if not n:
+            return np.empty(0), np.empty(0)
+        return tuple(np.memmap(path, dtype=np.float64, mode='r', shape=(n,)) for path in paths)
+
+    def __numeric_chunks(self, columns, progressbar, desc, chunk=1 << 20):
+        """
+        :param columns: Labels of numeric columns
+        :return: Iterator over tuples of float64 arrays with the values of the columns,
+                 rows with a missing value are dropped
+        """
+        if self.cache is not None and not self.todos:
+            entries = self.cached_columns(list(columns))
+            for column in columns:
+                if entries[column][1] is not None:
+                    raise ValueError(f'Column {column} is not numeric')
+            arrays = [entries[column][0] for column in columns]
+            parts = ([values[i:i + chunk] for values in arrays] for i in range(0, len(arrays[0]), chunk))
+        else:
+            batches = self.__progress(self.run_batches(columns=set(columns)), desc, progressbar)
+            parts = ([batch.array(column) for column in columns] for batch in batches)
+        for part in parts:
+            part = [values.astype(np.float64) for values in part]
+            mask = ~np.logical_or.reduce([np.isnan(values) for values in part])
+            if not mask.all():
+                part = [values[mask] for values in part]
+            yield tuple(part)
+
+    def sum(self, column, progressbar=True):
+        task = self.aggregate(columns=(column,), progressbar=progressbar, desc="Searching sum")
+        return task.moments[column].total
 
     def mean(self, column, progressbar=True):
-        return self.sum(column, progressbar, 'mean') / len(self)
+        task = self.aggregate(columns=(column,), progressbar=progressbar, desc="Searching mean")
+        moments = task.moments[column]
+        if moments.count == 0:
+            warnings.warn("Mean of empty data is not defined.")
+            return None
+        return moments.mean
+
+    def var(self, column, ddof=1, progressbar=True):
+        task = self.aggregate(columns=(column,), progressbar=progressbar, desc="Searching variance")
+        return task.moments[column].variance(ddof)
 
     def min(self, column, progressbar=True):
-        res = None
-        if progressbar:
-            for row in tqdm_notebook(self.run(), total=len(self), desc="Searching minimum"):
-                if res is None:
-                    res = row[column]
-                else:
-                    res = min(res, row[column])
-        else:
-            for row in self.run():
-                if res is None:
-                    res = row[column]
-                else:
-                    res = min(res, row[column])
-        return res
+        task = self.aggregate(extremes=(column,), progressbar=progressbar, desc="Searching minimum")
+        return task.extremes[column].min
 
     def max(self, column, progressbar=True):
-        res = None
-        if progressbar:
-            for row in tqdm_notebook(self.run(), total=len(self),desc="Searching maximum"):
-                if res is None:
-                    res = row[column]
-                else:
-                    res = max(res, row[column])
-        else:
-            for row in self.run():
-                if res is None:
-                    res = row[column]
-                else:
-                    res = max(res, row[column])
-        return res
+        task = self.aggregate(extremes=(column,), progressbar=progressbar, desc="Searching maximum")
+        return task.extremes[column].max
 
     def pearson(self, col_x, col_y, progressbar=True):
-        task_pearson = StatOperation('pearson', col_x, col_y, False)
-        task_pearson.values = {'mean_x': self.mean(col_x, progressbar), 'mean_y': self.mean(col_y, progressbar), 'sum_dx_dy': 0,
-                               'sum_squares_dx': 0, 'sum_squares_dy': 0}
-        self.todos.append(task_pearson)
-        if progressbar:
-            for _ in tqdm_notebook(self.run(), total=len(self), desc="Pearson correlation"):
-                pass
-        else:
-            for _ in self.run():
-                pass
-        if task_pearson.values['sum_squares_dx'] * task_pearson.values['sum_squares_dy'] == 0:
+        task = self.aggregate(pairs=((col_x, col_y),), progressbar=progressbar, desc="Pearson correlation")
+        coef = task.comoments[(col_x, col_y)].pearson()
+        if coef is None:
             warnings.warn("An input array is constant; the correlation coefficient is not defined.")
-            return None
-        task_pearson.coef = task_pearson.values['sum_dx_dy'] / sqrt(
-            task_pearson.values['sum_squares_dx'] * task_pearson.values['sum_squares_dy'])
-        return task_pearson.coef
-
-    def ranking(self, col_x, col_y, progressbar=True):
-        tmpfile = "tmp.csv"
-        with open(self.filename, "r", newline='') as fin:
-            with open(tmpfile, "w", newline='') as fout:
-                reader = csv.reader(fin, lineterminator='\n')
-                writer = csv.writer(fout)
-                row = next(reader) + ['Index']
-                writer.writerow(row)
-                if progressbar:
-                    for i, row in enumerate(tqdm_notebook(reader, total=len(self), desc="1. Ranking")):
-                        writer.writerow(row + [str(i)])
-                else:
-                    for i, row in enumerate(reader):
-                        writer.writerow(row + [str(i)])
-
-        tmp_conveyor = Conveyor(tmpfile)
-        tmp_conveyor.sort(col_x, False)
-
-        with open('tmp_sorted.csv', "r", newline='') as fin:
-            with open(tmpfile, "w", newline='') as fout:
-                reader = csv.reader(fin, lineterminator='\n')
-                writer = csv.writer(fout)
-                row = next(reader) + ['Rank1']
-                writer.writerow(row)
-                if progressbar:
-                    for i, row in enumerate(tqdm_notebook(reader, total=len(self),desc="2. Ranking")):
-                        writer.writerow(row + [str(i)])
-                else:
-                    for i, row in enumerate(reader):
-                        writer.writerow(row + [str(i)])
-
-        tmp_conveyor = Conveyor(tmpfile)
-        tmp_conveyor.sort(col_y, False)
-
-        with open('tmp_sorted.csv', "r", newline='') as fin:
-            with open(tmpfile, "w", newline='') as fout:
-                reader = csv.reader(fin, lineterminator='\n')
-                writer = csv.writer(fout)
-                row = next(reader) + ['Rank2']
-                writer.writerow(row)
-
-                if progressbar:
-                    for i, row in enumerate(tqdm_notebook(reader, total=len(self), desc="3. Ranking")):
-                        writer.writerow(row + [str(i)])
-                else:
-                    for i, row in enumerate(reader):
-                        writer.writerow(row + [str(i)])
-
-        tmp_conveyor.sort('Index', False)
-        return Conveyor('tmp_sorted.csv')
+        return coef
 
     def spearman(self, col_x, col_y, progressbar=True):
-        tmp_conveyor = self.ranking(col_x, col_y, progressbar)
-        sum_d = 0
-        if progressbar:
-            for row in tqdm_notebook(tmp_conveyor.run(), total=len(self), desc="Spearman correlation"):
-                d = int(row['Rank1']) - int(row['Rank2'])
-                sum_d += d * d
-        else:
-            for row in tmp_conveyor.run():
-                d = int(row['Rank1']) - int(row['Rank2'])
-                sum_d += d * d
-        n = len(self)
-        return 1 - 6 * sum_d / (n * (n * n - 1))
+        """
+        Spearman rank correlation of two numeric columns, equal values get average ranks,
+        rows with a missing value are skipped.
+
+        The columns are written to a temporary directory of their own, which is removed afterwards.
+        """
+        with tempfile.TemporaryDirectory(prefix='samwise-') as directory:
+            x, y = self.paired_arrays(col_x, col_y, progressbar, "Spearman correlation", directory)
+            # values, their order and ranks of a part are held at once
+            max_rows = max(1 << 16, manager.available() // 24)
+            rank_x = average_ranks(x, directory, 'x', max_rows)
+            rank_y = average_ranks(y, directory, 'y', max_rows)
+            comoments = CoMoments()
+            chunk = 1 << 20
+            for i in range(0, len(rank_x), chunk):
+                comoments.merge(CoMoments.from_arrays(np.asarray(rank_x[i:i + chunk]),
+                                                      np.asarray(rank_y[i:i + chunk])))
+            del x, y, rank_x, rank_y
+        coef = comoments.pearson()
+        if coef is None:
+            warnings.warn("An input array is constant; the correlation coefficient is not defined.")
+        return coef
 
     def kendall(self, col_x, col_y, progressbar=True):
-        num = 0
-        if progressbar:
-            for row_i in tqdm_notebook(self.run(), total=len(self), desc="Kendall correlation"):
-                for row_j in self.run():
-                    x_i = int(row_i[col_x])
-                    y_i = int(row_i[col_y])
-                    x_j = int(row_j[col_x])
-                    y_j = int(row_j[col_y])
-                    if (x_i - x_j) * (y_i - y_j) > 0:
-                        num += 1
-                    else:
-                        num -= 1
-        else:
-            for row_i in self.run():
-                for row_j in self.run():
-                    x_i = int(row_i[col_x])
-                    y_i = int(row_i[col_y])
-                    x_j = int(row_j[col_x])
-                    y_j = int(row_j[col_y])
-                    if (x_i - x_j) * (y_i - y_j) > 0:
-                        num += 1
-                    else:
-                        num -= 1
-        n = len(self)
-        return num / (n * (n - 1))
\ No newline at end of file
+        """
+        Kendall tau-b rank correlation of two numeric columns, rows with a missing value are skipped.
+        """
+        x, y = self.paired_arrays(col_x, col_y, progressbar, desc="Kendall correlation")
+        coef = kendall_tau_b(x, y)
+        if coef is None:
+            warnings.warn("An input array is constant; the correlation coefficient is not defined.")
+        return coef
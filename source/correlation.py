@@ -0,0 +1,151 @@
+import math
+import os
+
+import numpy as np
+
+MAX_ROWS = 1 << 24
+
+
+def tie_pairs(sorted_values):
+    """
+    :param sorted_values: Sorted array or a boolean array, True where a new group of equal values starts
+    :return: Number of pairs of equal values
+    """
+    if len(sorted_values) == 0:
+        return 0
+    if sorted_values.dtype == bool:
+        starts = sorted_values
+    else:
+        starts = np.empty(len(sorted_values), dtype=bool)
+        starts[0] = True
+        np.not_equal(sorted_values[1:], sorted_values[:-1], out=starts[1:])
+    sizes = np.diff(np.append(np.flatnonzero(starts), len(starts)))
+    return int((sizes * (sizes - 1) // 2).sum())
+
+
+def count_swaps(values):
+    """
+    Count the swaps a merge sort makes to sort values, i.e. the pairs i < j with values[i] > values[j].
+
+    Such a pair is counted at the highest bit where the two values differ. The values are
+    stably partitioned by one bit at a time from the highest, within the groups sharing the
+    higher bits, and every element with a 0 bit is paired with the elements with a 1 bit
+    before it in its group. Every bit takes a few linear passes, O(n log k) in total.
+    :param values: Array of non-negative integers (e.g. dense ranks), k - 1 is the largest of them
+    :return: Number of swaps
+    """
+    n = len(values)
+    values = np.asarray(values, dtype=np.int64)
+    if n < 2:
+        return 0
+    index = np.arange(n, dtype=np.int64)
+    ones_before = np.empty(n + 1, dtype=np.int64)
+    ones_before[0] = 0
+    swaps = 0
+    for bit in range(int(values.max()).bit_length() - 1, -1, -1):
+        starts = np.empty(n, dtype=bool)
+        starts[0] = True
+        prefix = values >> (bit + 1)
+        np.not_equal(prefix[1:], prefix[:-1], out=starts[1:])
+        first = np.flatnonzero(starts)
+        sizes = np.diff(np.append(first, n))
+        group_start = np.repeat(first, sizes)
+        ones = (values >> bit) & 1
+        np.cumsum(ones, out=ones_before[1:])
+        # elements with a 1 bit before each element within its group
+        earlier = ones_before[:-1] - ones_before[group_start]
+        zero = ones == 0
+        swaps += int(earlier[zero].sum())
+        zeros_in_group = np.repeat(sizes - (ones_before[first + sizes] - ones_before[first]), sizes)
+        position = np.where(zero, index - earlier, group_start + zeros_in_group + earlier)
+        partitioned = np.empty(n, dtype=np.int64)
+        partitioned[position] = values
+        values = partitioned
+    return swaps
+
+
+def kendall_tau_b(x, y):
+    """
+    Kendall tau-b with Knight's O(n log n) algorithm.
+    :param x: Numeric array
+    :param y: Numeric array of the same length
+    :return: Kendall tau-b, None if one of the arrays is constant
+    """
+    n = len(x)
+    order = np.lexsort((y, x))
+    x, y = x[order], y[order]
+    n0 = n * (n - 1) // 2
+    x_ties = tie_pairs(x)
+    starts = np.ones(n, dtype=bool)
+    if n:
+        starts[1:] = (x[1:] != x[:-1]) | (y[1:] != y[:-1])
+    joint_ties = tie_pairs(starts)
+    _, ranks = np.unique(y, return_inverse=True)
+    swaps = count_swaps(ranks)
+    y_ties = tie_pairs(np.sort(y))
+    denominator = (n0 - x_ties) * (n0 - y_ties)
+    if denominator == 0:
+        return None
+    return (n0 - x_ties - y_ties + joint_ties - 2 * swaps) / math.sqrt(denominator)
+
+
+def average_ranks(values, directory: str = None, name: str = 'ranks', max_rows: int = MAX_ROWS):
+    """
+    Ranks of the values starting from 1, equal values get the average of their ranks.
+
+    Up to max_rows values are ranked with an in-memory argsort. Larger arrays are
+    distributed into value ranges on disk (split points are taken from a sample) and
+    every range is ranked in memory, so at most about max_rows values are held at once.
+    :param values: Numeric array without NaN, may be a memmap
+    :param directory: Directory for the temporary files of larger arrays
+    :param name: Prefix of the temporary files
+    :param max_rows: Number of values ranked in memory at once
+    :return: float64 array of the ranks (a memmap in directory for larger arrays)
+    """
+    n = len(values)
+    if n <= max_rows or directory is None:
+        return _ranks_in_memory(np.asarray(values))
+    parts = 2 * -(-n // max_rows)
+    sample = np.sort(np.asarray(values[::max(1, n // (parts * 100))]))
+    bounds = np.unique(sample[len(sample) * np.arange(1, parts) // parts])
+    paths = [os.path.join(directory, f'{name}.{i}') for i in range(len(bounds) + 1)]
+    files = [(open(path + '.val', 'wb'), open(path + '.pos', 'wb')) for path in paths]
+    try:
+        for start in range(0, n, max_rows):
+            chunk = np.asarray(values[start:start + max_rows])
+            part_ids = np.searchsorted(bounds, chunk, side='right')
+            order = np.argsort(part_ids, kind='stable')
+            cuts = np.searchsorted(part_ids[order], np.arange(len(files) + 1))
+            for i, (val_file, pos_file) in enumerate(files):
+                picked = order[cuts[i]:cuts[i + 1]]
+                chunk[picked].tofile(val_file)
+                (picked + start).tofile(pos_file)
+    finally:
+        for val_file, pos_file in files:
+            val_file.close()
+            pos_file.close()
+    ranks = np.memmap(os.path.join(directory, f'{name}.bin'), dtype=np.float64, mode='w+', shape=(n,))
+    offset = 0
+    for path in paths:
+        part = np.fromfile(path + '.val', dtype=np.float64)
+        ranks[np.fromfile(path + '.pos', dtype=np.int64)] = _ranks_in_memory(part) + offset
+        offset += len(part)
+        os.remove(path + '.val')
+        os.remove(path + '.pos')
+    ranks.flush()
+    return ranks
+
+
+def _ranks_in_memory(values):
+    n = len(values)
+    order = np.argsort(values, kind='stable')
+    starts = np.empty(n, dtype=bool)
+    if n:
+        starts[0] = True
+        sorted_values = values[order]
+        np.not_equal(sorted_values[1:], sorted_values[:-1], out=starts[1:])
+    first = np.flatnonzero(starts)
+    sizes = np.diff(np.append(first, n))
+    ranks = np.empty(n, dtype=np.float64)
+    ranks[order] = np.repeat(first + (sizes + 1) / 2, sizes)
+    return ranks
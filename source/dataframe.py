@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 from copy import copy, deepcopy
 from typing import List
 
@@ -5,32 +6,76 @@
 from conveyor import Conveyor
 from expr_parser import ExprParser
 from column import Column
+from groupby import GroupBy
+from writer import CsvWriter, TemporaryCsv
+from asynchronous import run_blocking
 
 
 class DataFrame:
     """
     Data structure containing tabular data, based on Conveyor.
     """
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, workers: int = 1, cache=False, dtype: dict = None, profile=False):
         """
         Initialize dataframe.
         :param filename: Name of the file to read the data from
+        :param workers: Number of processes aggregations run in
+        :param cache: Keep the columns used by aggregations in the typed column cache,
+                      True for the default cache directory or a directory name
+        :param dtype: Mapping label -> column type (int, float, str), the other types are inferred
+        :param profile: Record per-stage statistics of the runs, True or a Profile to record into
         """
         self.__filename = filename
+        self.__workers = workers
+        self.__cache = cache
+        self.__dtype = dtype
         self.__labels = None
-        self.__conveyor = Conveyor(filename)
+        self.__conveyor = Conveyor(filename, workers=workers, cache=cache, dtype=dtype, profile=profile)
+
+    @property
+    def profile(self):
+        """
+        Profile of the runs of the dataframe, None if it is not profiled.
+        """
+        return self.__conveyor.profile
+
+    @contextmanager
+    def profiling(self, callback=None):
+        """
+        Record per-stage statistics (rows in and out, time, selectivity, bytes read) of the runs inside the block.
+        :param callback: Function called with the report of every run
+        :return: Context manager giving the Profile
+        """
+        with self.__conveyor.profiling(callback) as profile:
+            yield profile
 
     def __iter__(self):
         return iter(self.__conveyor.run())
 
+    def __aiter__(self):
+        """
+        Rows for `async for`, read in the thread pool shared by the async calls.
+        """
+        return self.__conveyor.copy().arun()
+
     def __getitem__(self, label):
         if type(label) == str:
-            return Column(label, self.__filename)
+            return Column(label, self.__filename, self.__workers, self.__cache, self.__dtype,
+                          conveyor=self.__conveyor.copy())
         elif type(label) == list:
-            df = DataFrame(self.__filename)
+            df = self.__derive()
             df.__labels = label
             df.__conveyor.labels = label
             return df
+        elif type(label) == slice:
+            if label.step not in (None, 1):
+                raise ValueError('Slicing with a step is not supported.')
+            start, stop = label.start or 0, label.stop
+            if start < 0 or (stop is not None and stop < 0):
+                start, stop, _ = label.indices(len(self))
+            df = self.__derive()
+            df.__conveyor.slice(start, stop)
+            return df
 
     def __len__(self):
         return len(self.__conveyor)
@@ -50,14 +95,16 @@ def size(self):
         """
         Return an int representing the number of elements in this object.
         """
-        return len(self) * len(self.columns)
+        columns = self.columns
+        return len(self) * len(columns)
 
     @property
     def shape(self):
         """
         Return a tuple representing the dimensionality of the DataFrame.
         """
-        return len(self), len(self.columns)
+        columns = self.columns
+        return len(self), len(columns)
 
     @property
     def empty(self):
@@ -83,10 +130,18 @@ def head(self, n: int = 5):
         :param n: Number of rows to select
         :return: A new dataframe containing the first n rows
         """
-        new_df = deepcopy(self)
+        new_df = self.__derive()
         new_df.__conveyor.head(n)
         return new_df
 
+    def __derive(self):
+        """
+        :return: Dataframe over the same file with a copy of the pipeline, nothing is read
+        """
+        new_df = copy(self)
+        new_df.__conveyor = self.__conveyor.copy()
+        return new_df
+
     def transform(self, func, inplace: bool = False):
         """
         Call func on self producing a DataFrame with transformed values.
@@ -99,17 +154,18 @@ def transform(self, func, inplace: bool = False):
                 for f in func:
                     self.transform(f, True)
             else:
-                f = ExprParser(func).expr
-                self.__conveyor.apply(f)
+                parser = ExprParser(func)
+                self.__conveyor.apply(parser.expr, parser.batch_expr, parser.columns, parser.target, parser.source)
             return self
         else:
-            new_df = self.copy()
+            new_df = self.__derive()
             if isinstance(func, List):
                 for f in func:
                     new_df.transform(f, True)
             else:
-                f = ExprParser(func).expr
-                new_df.__conveyor.apply(f)
+                parser = ExprParser(func)
+                new_df.__conveyor.apply(parser.expr, parser.batch_expr, parser.columns, parser.target,
+                                        parser.source)
             return new_df
 
     def filter(self, cond, inplace: bool = True):
@@ -120,45 +176,146 @@ def filter(self, cond, inplace: bool = True):
         :return: Filtered dataframe
         """
         if inplace:
-            op = CondParser(cond).cond
-            self.__conveyor.filter(op)
+            parser = CondParser(cond)
+            self.__conveyor.filter(parser.cond, parser.batch_cond, parser.columns, parser.source)
             return self
         else:
-            new_df = self.copy()
+            new_df = self.__derive()
             return new_df.filter(cond, True)
 
-    def sort_values(self, by: str, ascending: bool = True, inplace: bool = False):
+    def sort_values(self, by, ascending=True, inplace: bool = False):
         """
-        Sort dataframe by the values of a specified column.
-        :param by: Name of the column to sort by
-        :param ascending: Sort ascending vs. descending
+        Sort dataframe by the values of specified columns.
+        The sorted rows are written to a temporary file, the file of the dataframe is not changed.
+        :param by: Name of the column to sort by or a list of them
+        :param ascending: Sort ascending vs. descending, one value for all the columns or a list of them
         :param inplace: If True, perform operation in-place
         :return: DataFrame with sorted values
         """
-        if inplace:
-            self.__conveyor = self.__conveyor.sort(by, ascending)
-            return self
-        else:
-            new_df = self.copy()
-            new_df.__conveyor = new_df.__conveyor.sort(by, ascending)
-            return new_df
+        new_df = self if inplace else self.__derive()
+        new_df.__conveyor = self.__conveyor.copy().sort(by, ascending)
+        new_df.__conveyor.labels = self.__labels
+        new_df.__filename = new_df.__conveyor.filename
+        return new_df
+
+    def to_csv(self, filename: str, compression='infer', progressbar: bool = True):
+        """
+        Write the rows to a csv file in large blocks. The file is replaced atomically,
+        it may be the file the dataframe reads.
+        :param filename: Name of the file
+        :param compression: 'infer' to take it from the extension of the file (.gz, .bz2, .xz, .zst, .zip),
+                            'gzip', 'bz2', 'xz', 'zstd', 'zip' or None
+        :param progressbar: Show progress bar
+        :return: Number of rows written
+        """
+        return self.__conveyor.copy().to_csv(filename, compression, progressbar)
+
+    def to_binary(self, filename: str, compression='infer', progressbar: bool = True):
+        """
+        Write the rows to a columnar binary file of typed NumPy blocks, read back with writer.read_blocks.
+        :param filename: Name of the file
+        :param compression: Like in to_csv
+        :param progressbar: Show progress bar
+        :return: Number of rows written
+        """
+        return self.__conveyor.copy().to_binary(filename, compression, progressbar)
+
+    def nlargest(self, n: int, columns, progressbar: bool = True):
+        """
+        Select the rows with the largest values of numeric columns in one pass over the data,
+        without sorting it. Rows with missing values in the columns are skipped.
+        :param n: Number of rows to select
+        :param columns: Column label or a list of them, compared in turn
+        :param progressbar: Show progress bar
+        :return: DataFrame with the rows in descending order of the columns, ties in the order of the rows
+        """
+        return self.__top(n, columns, True, progressbar)
 
-    def quantile(self, q: float, sort_by: str):
+    def nsmallest(self, n: int, columns, progressbar: bool = True):
         """
-        :param q: Value between 0 <= q <= 1, the quantile to compute
+        Like nlargest, but with the smallest values in ascending order.
+        """
+        return self.__top(n, columns, False, progressbar)
+
+    def __top(self, n, columns, largest, progressbar):
+        conveyor = self.__conveyor.copy()
+        rows = conveyor.top_k(columns, n, largest, True, progressbar)
+        header = list(rows[0]) if rows else self.columns
+        temporary = TemporaryCsv('samwise-top-')
+        with CsvWriter(temporary.filename, header) as writer:
+            writer.write_rows([row.get(key) for key in header] for row in rows)
+        return self.__frame(temporary.filename, temporary, self.__labels)
+
+    def __frame(self, filename, temporary=None, labels=None):
+        """
+        :param filename: Name of a csv file with a result of the dataframe
+        :param temporary: TemporaryCsv of the file if it is temporary, it lives as long as the new dataframe
+        :param labels: Columns of the new dataframe, all the columns of the file if None
+        :return: Dataframe over the file with the settings of this one
+        """
+        new_df = copy(self)
+        new_df.__conveyor = self.__conveyor.derived(filename, temporary)
+        new_df.__conveyor.labels = labels
+        new_df.__filename = filename
+        new_df.__labels = labels
+        return new_df
+
+    def groupby(self, by, sort: bool = True):
+        """
+        Group the rows by the values of key columns.
+        :param by: Column label or a list of them
+        :param sort: Sort the groups by their keys
+        :return: GroupBy, its agg method computes the aggregations
+        """
+        return GroupBy(self.__conveyor.copy(), by, sort, self.__frame)
+
+    def merge(self, right, on=None, how: str = 'inner', suffixes=('_x', '_y')):
+        """
+        Join the rows with the rows of another dataframe having equal values of the key columns.
+        The result is lazy: the smaller file is hashed and the larger one is streamed when it is read.
+        :param right: DataFrame to join with
+        :param on: Key column label or a list of them, the columns present in both dataframes by default
+        :param how: 'inner', 'left', 'right' or 'outer'
+        :param suffixes: Suffixes of the labels of the left and the right columns present in both dataframes
+        :return: Dataframe of the joined rows
+        """
+        if on is None:
+            on = [key for key in self.columns if key in right.columns]
+            if not on:
+                raise ValueError('No common columns to merge on.')
+        new_df = self.__derive()
+        new_df.__conveyor = self.__conveyor.join(right.__conveyor, on, how, suffixes)
+        new_df.__filename = new_df.__conveyor.filename
+        new_df.__labels = None
+        return new_df
+
+    def quantile(self, q: float, sort_by: str, approx: bool = False, error: float = 0.01, progressbar: bool = True):
+        """
+        :param q: Value between 0 <= q <= 1 (or a list of them), the quantile to compute
         :param sort_by: Name of the column to sort by
+        :param approx: Estimate the quantile from a streaming sketch in one pass,
+                       its rank error is about error * number of rows
+        :param error: Rank error of the sketch
+        :param progressbar: Show progress bar
         :return: Values at the given quantile over the specified column
         """
-        if q < 0 or q > 1:
+        qs = q if isinstance(q, (list, tuple)) else [q]
+        if any(x < 0 or x > 1 for x in qs):
             raise ValueError('Quantile must be  0 <= q <= 1.')
-        return self.__conveyor.procentile(sort_by, q)
+        if self.__conveyor.schema.type(sort_by) == 'str' and not approx:
+            res = self.__conveyor.procentiles(sort_by, qs)
+            res = [None if row is None else row[sort_by] for row in res]
+            return res if isinstance(q, (list, tuple)) else res[0]
+        return self.__conveyor.quantile(sort_by, q, approx, error, progressbar)
 
-    def median(self, sort_by: str):
+    def median(self, sort_by: str, approx: bool = False, progressbar: bool = True):
         """
         :param sort_by: Name of the column to sort by
+        :param approx: Estimate the median from a streaming sketch in one pass
+        :param progressbar: Show progress bar
         :return: The median of the values over the specified column
         """
-        return self.__conveyor.median(sort_by)
+        return self.quantile(0.5, sort_by, approx, progressbar=progressbar)
 
     def sum(self, column, progressbar=True):
         return self.__conveyor.sum(column, progressbar)
@@ -166,6 +323,9 @@ def sum(self, column, progressbar=True):
     def mean(self, column, progressbar=True):
         return self.__conveyor.mean(column, progressbar)
 
+    def var(self, column, ddof=1, progressbar=True):
+        return self.__conveyor.var(column, ddof, progressbar)
+
     def min(self, column, progressbar=True):
         return self.__conveyor.min(column, progressbar)
 
@@ -179,4 +339,46 @@ def spearman(self, col_x, col_y, progressbar=True):
         return self.__conveyor.spearman(col_x, col_y, progressbar)
 
     def kendall(self, col_x, col_y, progressbar=True):
-        return self.__conveyor.kendall(col_x, col_y, progressbar)
\ No newline at end of file
+        return self.__conveyor.kendall(col_x, col_y, progressbar)
+
+    async def __async(self, method, *args):
+        """
+        Call a method of a dataframe over a copy of the pipeline in the thread pool shared by
+        the async calls (see asynchronous.py), so concurrent calls neither block the event loop
+        nor share the state of a run.
+        """
+        return await run_blocking(getattr(self.__derive(), method), *args)
+
+    async def alen(self):
+        return await self.__async('__len__')
+
+    async def asum(self, column, progressbar=False):
+        return await self.__async('sum', column, progressbar)
+
+    async def amean(self, column, progressbar=False):
+        return await self.__async('mean', column, progressbar)
+
+    async def avar(self, column, ddof=1, progressbar=False):
+        return await self.__async('var', column, ddof, progressbar)
+
+    async def amin(self, column, progressbar=False):
+        return await self.__async('min', column, progressbar)
+
+    async def amax(self, column, progressbar=False):
+        return await self.__async('max', column, progressbar)
+
+    async def aquantile(self, q: float, sort_by: str, approx: bool = False, error: float = 0.01,
+                        progressbar: bool = False):
+        return await self.__async('quantile', q, sort_by, approx, error, progressbar)
+
+    async def amedian(self, sort_by: str, approx: bool = False, progressbar: bool = False):
+        return await self.__async('median', sort_by, approx, progressbar)
+
+    async def apearson(self, col_x, col_y, progressbar=False):
+        return await self.__async('pearson', col_x, col_y, progressbar)
+
+    async def aspearman(self, col_x, col_y, progressbar=False):
+        return await self.__async('spearman', col_x, col_y, progressbar)
+
+    async def akendall(self, col_x, col_y, progressbar=False):
+        return await self.__async('kendall', col_x, col_y, progressbar)
@@ -0,0 +1,210 @@
+import ast
+import operator
+
+import numpy as np
+
+COMPARE_OPS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+
+class NotVectorizable(Exception):
+    """
+    Raised when an expression cannot be evaluated over whole columns.
+    """
+
+
+def frame_name(node: ast.AST, default: str = 'df'):
+    """
+    :param node: Parsed expression
+    :return: Name the expression uses for the dataframe, e.g. df in df['x'] > 5
+    """
+    names = {n.value.id for n in ast.walk(node)
+             if isinstance(n, ast.Subscript) and isinstance(n.value, ast.Name)}
+    if len(names) == 1:
+        return names.pop()
+    return default
+
+
+def column_label(node: ast.AST, x_name: str):
+    """
+    :return: Label if node is x_name['label'], None otherwise
+    """
+    if (isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == x_name
+            and isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str)):
+        return node.slice.value
+    return None
+
+
+def used_columns(node: ast.AST, x_name: str):
+    """
+    :return: Set of the labels the expression reads as x_name['label'],
+             None if it uses x_name in any other way (e.g. passes the whole row somewhere)
+    """
+    columns = set()
+    labelled = set()
+    for n in ast.walk(node):
+        label = column_label(n, x_name)
+        if label is not None:
+            columns.add(label)
+            labelled.add(id(n.value))
+    for n in ast.walk(node):
+        if isinstance(n, ast.Name) and n.id == x_name and id(n) not in labelled:
+            return None
+    return columns
+
+
+def compile_row_func(node: ast.expr, x_name: str, source: str = '<expr>'):
+    """
+    Compile an expression into a function of a row, once.
+    :param node: Parsed expression
+    :param x_name: Name the expression uses for the row
+    :param source: Name shown in tracebacks
+    :return: Function row -> value of the expression
+    """
+    args = ast.arguments(posonlyargs=[], args=[ast.arg(arg=x_name)], kwonlyargs=[], kw_defaults=[], defaults=[])
+    tree = ast.fix_missing_locations(ast.Expression(body=ast.Lambda(args=args, body=node)))
+    return eval(compile(tree, source, 'eval'), {})
+
+
+def compile_batch_func(node: ast.expr, x_name: str, kinds=('num', 'str', 'bool')):
+    """
+    Build a function evaluating a simple expression (column comparisons, boolean logic,
+    arithmetic) over whole columns of a batch. Columns are taken with the types of the schema,
+    so the row function has to get the rows of Batch.typed_rows when a batch is not handled.
+    :param node: Parsed expression
+    :param x_name: Name the expression uses for the row
+    :param kinds: Kinds of results ('num', 'str', 'bool') the caller accepts
+    :return: Function batch -> NumPy array (None if the batch cannot be handled this way),
+             None if the expression is not simple
+    """
+    try:
+        evaluate = _vectorize(node, x_name)
+    except NotVectorizable:
+        return None
+
+    def batch_func(batch):
+        try:
+            kind, value = evaluate(batch)
+        except NotVectorizable:
+            return None
+        if kind not in kinds:
+            return None
+        if not isinstance(value, np.ndarray):
+            value = np.full(len(batch), value, dtype=object if kind == 'str' else None)
+        return value
+
+    return batch_func
+
+
+def _vectorize(node, x_name):
+    """
+    :return: Function batch -> (kind, value), kind is 'num', 'str' or 'bool', value is an array or a scalar
+    """
+    label = column_label(node, x_name)
+    if label is not None:
+        def column(batch):
+            if batch.schema is not None and batch.schema.type(label) == 'str':
+                return 'str', np.asarray(batch[label], dtype=object)
+            try:
+                return 'num', batch.array(label)
+            except ValueError:
+                raise NotVectorizable(label)
+        return column
+
+    if isinstance(node, ast.Constant):
+        value = node.value
+        if isinstance(value, bool):
+            kind = 'bool'
+        elif isinstance(value, (int, float)):
+            kind = 'num'
+        elif isinstance(value, str):
+            kind = 'str'
+        else:
+            raise NotVectorizable(node)
+        return lambda batch: (kind, value)
+
+    if isinstance(node, ast.Compare):
+        operands = [_vectorize(n, x_name) for n in [node.left] + node.comparators]
+        ops = []
+        for op in node.ops:
+            if type(op) not in COMPARE_OPS:
+                raise NotVectorizable(node)
+            ops.append(COMPARE_OPS[type(op)])
+
+        def compare(batch):
+            values = [operand(batch) for operand in operands]
+            res = True
+            for op, (kind_a, a), (kind_b, b) in zip(ops, values, values[1:]):
+                if kind_a != kind_b or kind_a == 'bool':
+                    raise NotVectorizable(node)
+                res = res & op(a, b)
+            return 'bool', res
+        return compare
+
+    if isinstance(node, ast.BoolOp):
+        operands = [_vectorize(n, x_name) for n in node.values]
+        combine = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+
+        def boolop(batch):
+            res = None
+            for operand in operands:
+                kind, value = operand(batch)
+                if kind != 'bool':
+                    raise NotVectorizable(node)
+                res = value if res is None else combine(res, value)
+            return 'bool', res
+        return boolop
+
+    if isinstance(node, ast.UnaryOp):
+        operand = _vectorize(node.operand, x_name)
+        if isinstance(node.op, ast.Not):
+            def invert(batch):
+                kind, value = operand(batch)
+                if kind != 'bool':
+                    raise NotVectorizable(node)
+                return 'bool', np.logical_not(value)
+            return invert
+        if isinstance(node.op, ast.USub):
+            def negative(batch):
+                kind, value = operand(batch)
+                if kind != 'num':
+                    raise NotVectorizable(node)
+                return 'num', -value
+            return negative
+        raise NotVectorizable(node)
+
+    if isinstance(node, ast.BinOp) and type(node.op) in BIN_OPS:
+        left = _vectorize(node.left, x_name)
+        right = _vectorize(node.right, x_name)
+        op = BIN_OPS[type(node.op)]
+        is_add = isinstance(node.op, ast.Add)
+
+        def binop(batch):
+            kind_a, a = left(batch)
+            kind_b, b = right(batch)
+            if kind_a == kind_b == 'num' or (kind_a == kind_b == 'str' and is_add):
+                try:
+                    return kind_a, op(a, b)
+                except (ValueError, TypeError, ZeroDivisionError, OverflowError):
+                    # e.g. integers to negative integer powers, the row function handles them
+                    raise NotVectorizable(node)
+            raise NotVectorizable(node)
+        return binop
+
+    raise NotVectorizable(node)
@@ -1,5 +1,8 @@
+import ast
 from typing import Callable
 
+from expr_compiler import column_label, used_columns, compile_row_func, compile_batch_func
+
 
 class ExprParser:
     """
@@ -10,8 +13,13 @@ def __init__(self, expr):
         Initialize the expression parser.
         :param expr: Expression (string or callable)
         """
+        self.batch_expr = None
+        self.columns = None
+        self.target = None
+        self.source = None
         if isinstance(expr, str):
-            self.expr = self.__str_to_expr(expr)
+            self.source = expr.strip()
+            self.expr, self.batch_expr, self.columns, self.target = self.__str_to_expr(expr)
         elif isinstance(expr, Callable):
             self.expr = expr
         else:
@@ -21,28 +29,48 @@ def __init__(self, expr):
     def __str_to_expr(expr_str):
         """
         Convert string into a callable function.
+
+        The string is parsed and compiled once. Simple expressions (arithmetic over columns
+        and constants, concatenation of strings) also get a function transforming a whole batch.
         :param expr_str: Expression string
-        :return: Callable parsed from the string
+        :return: Callable parsed from the string, the batch version of it (or None),
+                 the set of the columns it uses (None if unknown) and the column it assigns to
         """
+        if ' = ' not in expr_str:
+            raise ValueError('Error: Specifying transforming dataframe column expected. Please use  df[label] = ...  '
+                             'notation.\nTransforming aborted.')
         try:
-            col, expr = expr_str.split(sep=' = ')
-        except ValueError:
+            tree = ast.parse(expr_str.strip(), mode='exec')
+        except SyntaxError as e:
+            raise ValueError(f'Error: Invalid expression: {expr_str}') from e
+        if len(tree.body) != 1 or not isinstance(tree.body[0], ast.Assign) or len(tree.body[0].targets) != 1:
             raise ValueError('Error: Specifying transforming dataframe column expected. Please use  df[label] = ...  '
                              'notation.\nTransforming aborted.')
-        x_name = col[:col.find('[')]
-        if not len(x_name):
+        target = tree.body[0].targets[0]
+        if not isinstance(target, ast.Subscript) or not isinstance(target.value, ast.Name):
             raise ValueError('Error: Specifying dataframe name expected. Please use  df[label] = ...  notation.\n'
-                  'Transforming aborted.')
-        else:
-            col = col.replace(x_name, "x", len(col))
-            expr = expr.replace(x_name, "x", len(expr))
-
-        if col.find("['") == -1 or col.find("']") == -1:
+                             'Transforming aborted.')
+        x_name = target.value.id
+        col_label = column_label(target, x_name)
+        if col_label is None:
             raise ValueError('Error: Specifying transforming dataframe column expected. Please use  df[label] = ...  '
                              'notation.\nTransforming aborted.')
-        col_label = col[col.find("['") + 2:col.find("']")]
+        value = tree.body[0].value
+        fun = compile_row_func(value, x_name, '<transform>')
 
         def tmp_fun(x):
-            x[col_label] = eval(expr)
+            x[col_label] = fun(x)
+
+        columns = used_columns(value, x_name)
+        batch_fun = compile_batch_func(value, x_name)
+        if batch_fun is None:
+            return tmp_fun, None, columns, col_label
+
+        def tmp_batch_fun(batch):
+            res = batch_fun(batch)
+            if res is None:
+                return False
+            batch[col_label] = res
+            return True
 
-        return tmp_fun
+        return tmp_fun, tmp_batch_fun, columns, col_label
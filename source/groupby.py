@@ -0,0 +1,299 @@
+import os
+import pickle
+import shutil
+import tempfile
+import zlib
+
+import numpy as np
+
+from memory import manager
+from sorting import sort_rows, row_key
+from writer import CsvWriter, TemporaryCsv
+
+AGG_FUNCS = ('sum', 'count', 'mean', 'min', 'max', 'var')
+
+
+class GroupTable:
+    """
+    Hash table of per-group statistics of numeric columns: number of rows, count, sum,
+    mean and second central moment (merged with Chan's formula), minimum and maximum.
+
+    The memory of the table is reserved from the memory manager. When it is refused,
+    the groups are split by the hash of their key into partitions written to disk and
+    the table starts over, so every partition can later be merged on its own.
+    """
+    PARTITIONS = 16
+    GROUP_BYTES = 160  # dict entry and key tuple of a group
+    MIN_GROUPS = 1024  # never spill smaller tables
+    STATS = ('count', 'total', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self, width: int):
+        """
+        Initialize an empty table.
+        :param width: Number of numeric columns
+        """
+        self.width = width
+        self.index = {}
+        self.partitions = None
+        self.directories = []
+        self.__reserved = 0
+        self.__allocate(0)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __allocate(self, capacity):
+        self.capacity = capacity
+        self.size = np.zeros(capacity, dtype=np.int64)
+        self.stats = {stat: np.zeros((self.width, capacity)) for stat in self.STATS}
+        self.stats['min'].fill(np.inf)
+        self.stats['max'].fill(-np.inf)
+
+    def __group_bytes(self):
+        return self.GROUP_BYTES + 8 + 8 * len(self.STATS) * self.width
+
+    def __grow(self, groups):
+        """
+        :return: False if the memory for the groups was refused
+        """
+        if groups <= self.capacity:
+            return True
+        capacity = max(groups, 2 * self.capacity, 64)
+        nbytes = (capacity - self.capacity) * self.__group_bytes()
+        granted = manager.reserve(nbytes)
+        if granted:
+            self.__reserved += nbytes
+        size, stats, old = self.size, self.stats, self.capacity
+        self.__allocate(capacity)
+        self.size[:old] = size
+        for stat, values in stats.items():
+            self.stats[stat][:, :old] = values
+        return granted or groups < self.MIN_GROUPS
+
+    def update(self, keys, values):
+        """
+        Add rows to the groups.
+        :param keys: List of the group keys of the rows
+        :param values: float64 array of shape (width, number of rows), missing values are NaN
+        """
+        index = self.index
+        codes = np.fromiter((index.setdefault(key, len(index)) for key in keys), dtype=np.int64, count=len(keys))
+        fits = self.__grow(len(index))
+        touched, codes = np.unique(codes, return_inverse=True)
+        groups = len(touched)
+        self.size[touched] += np.bincount(codes, minlength=groups)
+        part = {stat: np.zeros((self.width, groups)) for stat in ('count', 'total', 'mean', 'm2')}
+        part['min'] = np.full((self.width, groups), np.inf)
+        part['max'] = np.full((self.width, groups), -np.inf)
+        for j in range(self.width):
+            x = values[j]
+            valid = ~np.isnan(x)
+            c, x = codes[valid], x[valid]
+            count = np.bincount(c, minlength=groups).astype(np.float64)
+            total = np.bincount(c, x, minlength=groups)
+            mean = np.divide(total, count, out=np.zeros(groups), where=count > 0)
+            part['count'][j] = count
+            part['total'][j] = total
+            part['mean'][j] = mean
+            part['m2'][j] = np.bincount(c, np.square(x - mean[c]), minlength=groups)
+            np.minimum.at(part['min'][j], c, x)
+            np.maximum.at(part['max'][j], c, x)
+        self.__combine(touched, part)
+        if not fits:
+            self.spill()
+
+    def __combine(self, codes, part):
+        """
+        Merge statistics of other parts of the data into the groups with the given codes.
+        """
+        stats = self.stats
+        count_a, count_b = stats['count'][:, codes], part['count']
+        n = count_a + count_b
+        delta = part['mean'] - stats['mean'][:, codes]
+        weight = np.divide(count_b, n, out=np.zeros_like(n), where=n > 0)
+        stats['m2'][:, codes] += part['m2'] + delta * delta * count_a * weight
+        stats['mean'][:, codes] += delta * weight
+        stats['count'][:, codes] = n
+        stats['total'][:, codes] += part['total']
+        stats['min'][:, codes] = np.minimum(stats['min'][:, codes], part['min'])
+        stats['max'][:, codes] = np.maximum(stats['max'][:, codes], part['max'])
+
+    def merge(self, other):
+        """
+        Combine the table of another part of the data, including its partitions on disk.
+        :param other: GroupTable with the same columns
+        :return: self
+        """
+        index = self.index
+        codes = np.fromiter((index.setdefault(key, len(index)) for key in other.index), dtype=np.int64,
+                            count=len(other.index))
+        fits = self.__grow(len(index))
+        groups = len(other)
+        self.size[codes] += other.size[:groups]
+        self.__combine(codes, {stat: values[:, :groups] for stat, values in other.stats.items()})
+        if other.partitions is not None:
+            self.__partitions()
+            for mine, theirs in zip(self.partitions, other.partitions):
+                mine.extend(theirs)
+            self.directories.extend(other.directories)
+            other.partitions, other.directories = None, []
+        if not fits:
+            self.spill()
+        return self
+
+    def __partitions(self):
+        if self.partitions is None:
+            self.directories.append(tempfile.mkdtemp(prefix='samwise-groupby-'))
+            self.partitions = [[] for _ in range(self.PARTITIONS)]
+
+    def spill(self):
+        """
+        Move the groups to the partitions on disk and empty the table.
+        :return: Number of bytes freed
+        """
+        self.__partitions()
+        keys = list(self.index)
+        groups = len(keys)
+        hashes = np.fromiter((zlib.crc32(repr(key).encode('utf-8')) % self.PARTITIONS for key in keys),
+                             dtype=np.int64, count=groups)
+        directory = self.directories[0]
+        for p, paths in enumerate(self.partitions):
+            picked = np.flatnonzero(hashes == p)
+            if not len(picked):
+                continue
+            state = ([keys[i] for i in picked], self.size[picked],
+                     {stat: values[:, picked] for stat, values in self.stats.items()})
+            fd, path = tempfile.mkstemp(dir=directory, suffix='.part')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            paths.append(path)
+        freed = self.__reserved
+        manager.release(freed)
+        self.__reserved = 0
+        self.index = {}
+        self.__allocate(0)
+        return freed
+
+    def tables(self):
+        """
+        Tables holding all the groups, one per partition if the groups were spilled.
+        Partition files are removed as they are read.
+        :return: Iterator over GroupTables without partitions
+        """
+        if self.partitions is None:
+            yield self
+            return
+        if self.index:
+            self.spill()
+        try:
+            for paths in self.partitions:
+                table = GroupTable(self.width)
+                table.MIN_GROUPS = float('inf')  # a partition is merged in memory
+                for path in paths:
+                    with open(path, 'rb') as f:
+                        keys, size, stats = pickle.load(f)
+                    os.remove(path)
+                    part = GroupTable(self.width)
+                    part.index = dict(zip(keys, range(len(keys))))
+                    part.capacity = len(keys)
+                    part.size = size
+                    part.stats = stats
+                    table.merge(part)
+                yield table
+        finally:
+            for directory in self.directories:
+                shutil.rmtree(directory, ignore_errors=True)
+            self.partitions, self.directories = None, []
+
+    def result(self, func: str, j: int):
+        """
+        :param func: One of AGG_FUNCS
+        :param j: Number of the column
+        :return: float64 array of the values for the groups, NaN if not defined
+        """
+        groups = len(self)
+        stats = {stat: values[j, :groups] for stat, values in self.stats.items()}
+        count = stats['count']
+        if func == 'count':
+            return count
+        if func == 'sum':
+            return stats['total']
+        if func == 'var':
+            return np.divide(stats['m2'], count - 1, out=np.full(groups, np.nan), where=count > 1)
+        if func in ('mean', 'min', 'max'):
+            return np.where(count > 0, stats[func], np.nan)
+        raise ValueError(f'Unexpected aggregation: {func}')
+
+    def __del__(self):
+        manager.release(self.__reserved)
+
+
+class GroupBy:
+    """
+    Rows of a dataframe grouped by the values of key columns.
+    """
+    def __init__(self, conveyor, keys, sort: bool = True, make_frame=None):
+        """
+        Initialize the grouping.
+        :param conveyor: Conveyor of the dataframe, it is not changed
+        :param keys: Key column label or a list of them
+        :param sort: Sort the groups by their keys
+        :param make_frame: Function (filename, temporary) -> DataFrame building the result,
+                           temporary is the TemporaryCsv of the file or None
+        """
+        self.__conveyor = conveyor
+        self.keys = [keys] if isinstance(keys, str) else list(keys)
+        self.sort = sort
+        self.__make_frame = make_frame
+
+    def agg(self, spec: dict, progressbar: bool = True, filename: str = None):
+        """
+        Aggregate numeric columns over the groups in one pass over the data
+        (in parallel if the dataframe has workers).
+        :param spec: Mapping label -> aggregation ('sum', 'count', 'mean', 'min', 'max', 'var') or a list of them,
+                     the result columns are named after the label for a single aggregation and label_aggregation
+                     for a list
+        :param progressbar: Show progress bar
+        :param filename: Name of the csv file to write the result to, a temporary file by default
+                         (removed when the result is collected)
+        :return: DataFrame with the key columns and the aggregations, a row per group
+        """
+        outputs = []
+        for column, funcs in spec.items():
+            single = isinstance(funcs, str)
+            for func in [funcs] if single else funcs:
+                if func not in AGG_FUNCS:
+                    raise ValueError(f'Unexpected aggregation: {func}')
+                outputs.append((column, func, column if single else f'{column}_{func}'))
+        columns = list(dict.fromkeys(column for column, _, _ in outputs))
+        conveyor = self.__conveyor.copy()
+        table = conveyor.group(self.keys, columns, progressbar)
+        temporary = None
+        if filename is None:
+            temporary = TemporaryCsv('samwise-groupby-')
+            filename = temporary.filename
+        schema = conveyor.schema
+        rows = self.__rows(table, columns, outputs, schema)
+        if self.sort:
+            rows = sort_rows(rows, row_key(schema, self.keys, self.keys, [True] * len(self.keys)))
+        with CsvWriter(filename, self.keys + [name for _, _, name in outputs]) as writer:
+            writer.write_rows(rows)
+        return self.__make_frame(filename, temporary)
+
+    def __rows(self, table, columns, outputs, schema):
+        """
+        :return: Iterator over the result rows, keys are raw values as they are in the file
+        """
+        single = len(self.keys) == 1
+        for part in table.tables():
+            values = []
+            for column, func, _ in outputs:
+                res = part.result(func, columns.index(column))
+                if func == 'count' or (func in ('sum', 'min', 'max') and schema.type(column) == 'int'):
+                    res = [None if np.isnan(v) else int(v) for v in res.tolist()]
+                else:
+                    res = [None if np.isnan(v) else v for v in res.tolist()]
+                values.append(res)
+            for key, row in zip(part.index, zip(*values) if values else [()] * len(part)):
+                yield ([key] if single else list(key)) + list(row)
+
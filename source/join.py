@@ -0,0 +1,227 @@
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import zlib
+
+from memory import manager
+
+JOIN_TYPES = ('inner', 'left', 'right', 'outer')
+
+_build_lock = threading.Lock()  # copies of a conveyor run in threads share their tables
+
+
+def join_keys(batch, on):
+    """
+    :param batch: Batch of rows
+    :param on: Key columns
+    :return: List of tuples of the typed values of the key columns, one per row
+    """
+    return list(zip(*[batch.typed(key) for key in on]))
+
+
+def join_keys_of_rows(rows, keys, on, schema):
+    """
+    :param rows: Row tuples aligned with keys
+    :param keys: Column labels of the rows
+    :param on: Key columns
+    :param schema: Schema of the side
+    :return: Join keys of the rows
+    """
+    picks = [keys.index(key) for key in on]
+    converters = [schema.converter(key) if schema.type(key) != 'str' else None for key in on]
+    return [tuple(row[i] if convert is None else convert(row[i]) for i, convert in zip(picks, converters))
+            for row in rows]
+
+
+def partition_of(key, partitions):
+    """
+    :return: Number of the partition of a join key, equal for keys comparing equal (1 and 1.0)
+    """
+    key = tuple(float(value) if isinstance(value, int) else value for value in key)
+    return zlib.crc32(repr(key).encode('utf-8')) % partitions
+
+
+def read_chunks(path):
+    """
+    :return: Iterator over the chunks pickled one after another into a file
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def append_chunk(path, chunk):
+    with open(path, 'ab') as f:
+        pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+
+
+def build_index(keys, start=0, index=None):
+    """
+    Add rows to a hash index of a join side. Keys with missing values match nothing.
+    :param keys: Keys of the rows
+    :param start: Number of the first of the rows
+    :param index: Dict key -> list of row numbers to add to, a new one by default
+    :return: The index
+    """
+    index = {} if index is None else index
+    for i, key in enumerate(keys, start):
+        if None in key:
+            continue
+        ids = index.get(key)
+        if ids is None:
+            index[key] = [i]
+        else:
+            ids.append(i)
+    return index
+
+
+class JoinTable:
+    """
+    Hash table of the rows of the smaller side of a join, keyed by the typed values of the key columns.
+
+    The memory of the rows is reserved from the memory manager. When it is refused, the rows
+    are split by the hash of their key into partitions on disk: the join becomes a grace hash
+    join, the rows of the other side are partitioned the same way and every pair of partitions
+    is joined in memory on its own.
+    """
+    PARTITIONS = 16
+    ROW_BYTES = 120  # row tuple, its number in the index and the dict entry of its key
+    VALUE_BYTES = 56  # str object without its characters
+
+    def __init__(self, conveyor, on):
+        """
+        Initialize the table, the rows are read on the first call to build.
+        :param conveyor: Conveyor of the side to hash, it is not changed
+        :param on: Key columns
+        """
+        self.__conveyor = conveyor.copy()
+        self.on = tuple(on)
+        self.columns = None if conveyor.labels is None else list(dict.fromkeys([*self.on, *conveyor.labels]))
+        self.keys = None
+        self.index = {}
+        self.rows = []
+        self.directory = None
+        self.built = False
+        self.__built_from = None
+        self.__reserved = 0
+
+    @property
+    def schema(self):
+        return self.__conveyor.schema
+
+    @property
+    def header(self):
+        return list(dict.fromkeys(self.__conveyor.header)) if self.columns is None else self.columns
+
+    @property
+    def spilled(self):
+        return self.directory is not None
+
+    def fingerprint(self):
+        columns = None if self.columns is None else tuple(self.columns)
+        return self.__conveyor.fingerprint(), self.on, columns
+
+    def build(self):
+        """
+        Read the rows of the side into the table, or into the partitions if they do not fit.
+        The rows are read again if the file or the tasks of the side changed since the last build.
+        """
+        fingerprint = self.fingerprint()
+        if self.built and fingerprint[0] is not None and fingerprint == self.__built_from:
+            return
+        with _build_lock:
+            if self.built and fingerprint[0] is not None and fingerprint == self.__built_from:
+                return
+            self.clear()
+            for batch in self.__conveyor.run_batches(columns=self.columns):
+                if self.keys is None:
+                    self.keys = list(batch.keys)
+                rows = list(zip(*[batch[key] if key in batch else [None] * len(batch) for key in self.keys]))
+                keys = join_keys(batch, self.on)
+                if not self.spilled and not self.__fits(rows):
+                    self.spill()
+                if self.spilled:
+                    self.__write(keys, rows)
+                else:
+                    build_index(keys, len(self.rows), self.index)
+                    self.rows.extend(rows)
+            if self.keys is None:
+                self.keys = self.header
+            self.__built_from = fingerprint
+            self.built = True
+
+    def clear(self):
+        """
+        Drop the rows of the table and its partitions on disk.
+        """
+        self.keys = None
+        self.index = {}
+        self.rows = []
+        self.built = False
+        self.__built_from = None
+        manager.release(self.__reserved)
+        self.__reserved = 0
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory = None
+
+    def __fits(self, rows):
+        nbytes = len(rows) * (self.ROW_BYTES + self.VALUE_BYTES * len(self.keys))
+        nbytes += sum(len(value) for row in rows for value in row if isinstance(value, str))
+        if manager.reserve(nbytes):
+            self.__reserved += nbytes
+            return True
+        return False
+
+    def spill(self):
+        """
+        Move the rows to the partitions on disk and empty the table.
+        :return: Number of bytes freed
+        """
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='samwise-join-')
+        rows, self.rows, self.index = self.rows, [], {}
+        if rows:
+            self.__write(join_keys_of_rows(rows, self.keys, self.on, self.schema), rows)
+        freed = self.__reserved
+        manager.release(freed)
+        self.__reserved = 0
+        return freed
+
+    def __write(self, keys, rows):
+        parts = [([], []) for _ in range(self.PARTITIONS)]
+        for key, row in zip(keys, rows):
+            part = parts[partition_of(key, self.PARTITIONS)]
+            part[0].append(key)
+            part[1].append(row)
+        for p, chunk in enumerate(parts):
+            if chunk[0]:
+                append_chunk(self.path(p), chunk)
+
+    def path(self, p):
+        return os.path.join(self.directory, f'{p}.part')
+
+    def partition(self, p):
+        """
+        :param p: Number of the partition
+        :return: Hash index and rows of the partition, read from disk
+        """
+        rows = []
+        index = {}
+        for keys, part in read_chunks(self.path(p)):
+            build_index(keys, len(rows), index)
+            rows.extend(part)
+        return index, rows
+
+    def __del__(self):
+        manager.release(self.__reserved)
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
@@ -125,9 +125,9 @@ def test_df_quantile():
         print('----Running Test DF Quantile-----')
 
         df = DataFrame('../data/data400.csv').head(10)
-        print('q=0.1', df.quantile(0.1, 'Музей')['Музей'])
-        print('q=0.5', df.quantile(0.5, 'Музей')['Музей'])
-        print('q=0.9', df.quantile(0.9, 'Музей')['Музей'])
+        print('q=0.1', df.quantile(0.1, 'Музей'))
+        print('q=0.5', df.quantile(0.5, 'Музей'))
+        print('q=0.9', df.quantile(0.9, 'Музей'))
 
         for i, x in enumerate(df.sort_values('Музей')):
             print(i, x['Музей'])
@@ -0,0 +1,77 @@
+import threading
+import weakref
+
+from options import get_option
+
+
+class MemoryManager:
+    """
+    Accounting of the memory taken by column buffers, loaded arrays and sort runs
+    against the process-wide memory_limit option.
+
+    Consumers reserve bytes before holding data. If the budget is exhausted, the holders
+    registered with the manager are asked to spill (drop what they can read again or move
+    it to disk), the least recently registered first. A consumer which still does not get
+    its reservation has to work from disk itself.
+    """
+    def __init__(self):
+        self.used = 0
+        self.__holders = []
+        self.__lock = threading.RLock()
+
+    @property
+    def limit(self):
+        return get_option('memory_limit')
+
+    def available(self):
+        """
+        :return: Number of bytes which can be reserved without spilling
+        """
+        return max(0, self.limit - self.used)
+
+    def reserve(self, nbytes: int, owner=None):
+        """
+        Reserve memory, making the other holders spill if needed.
+        :param nbytes: Number of bytes
+        :param owner: Holder asking for memory, it is not asked to spill
+        :return: True if the memory is reserved, False if the caller should not hold it
+        """
+        with self.__lock:
+            if self.used + nbytes > self.limit:
+                self.__relieve(self.used + nbytes - self.limit, owner)
+            if self.used + nbytes > self.limit:
+                return False
+            self.used += nbytes
+            return True
+
+    def release(self, nbytes: int):
+        with self.__lock:
+            self.used = max(0, self.used - nbytes)
+
+    def track(self, array, nbytes: int):
+        """
+        Release reserved memory once the array holding it is garbage collected.
+        """
+        weakref.finalize(array, self.release, nbytes)
+
+    def register(self, holder):
+        """
+        :param holder: Object with a spill() method releasing its memory and returning the number of bytes freed
+        """
+        with self.__lock:
+            self.__holders.append(weakref.ref(holder))
+
+    def __relieve(self, nbytes, owner):
+        alive = []
+        freed = 0
+        for ref in self.__holders:
+            holder = ref()
+            if holder is None:
+                continue
+            alive.append(ref)
+            if freed < nbytes and holder is not owner:
+                freed += holder.spill()
+        self.__holders = alive
+
+
+manager = MemoryManager()
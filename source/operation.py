@@ -1,6 +1,18 @@
 from abc import ABC
 from typing import Callable
 
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from aggregation import Moments, CoMoments, Extremes, QuantileSketch, TopK
+from batch import Batch
+from groupby import GroupTable
+from join import JOIN_TYPES, join_keys, partition_of, read_chunks, append_chunk
+from schema import Schema
+
 
 class Operation:
     """
@@ -8,6 +20,8 @@ class Operation:
     """
     op_type: str
     modifying: bool
+    mergeable: bool = False
+    origin: int = 0  # position of the part of the input a mergeable operation runs over in a worker
 
     def __init__(self, op_type: str, modifying: bool, *args):
         raise NotImplementedError
@@ -15,6 +29,31 @@ def __init__(self, op_type: str, modifying: bool, *args):
     def reset(self):
         raise NotImplementedError
 
+    def reads(self):
+        """
+        :return: Set of the columns the operation uses, None if it may use any of them
+        """
+        return None
+
+    def writes(self):
+        """
+        :return: Set of the columns the operation changes, None if it may change any of them
+        """
+        return set()
+
+    def fingerprint(self):
+        """
+        :return: Hashable description of the operation, equal for operations giving the same results
+        """
+        raise NotImplementedError
+
+    def finish(self, size: int):
+        """
+        :param size: Number of rows in a batch
+        :return: Iterator over the batches of rows the operation yields after all the rows passed through it
+        """
+        return iter(())
+
 
 class FuncOperation(Operation, ABC):
 
@@ -23,12 +62,18 @@ class FuncOperation(Operation, ABC):
         'apply': lambda x: x,
     }
 
-    def __init__(self, op_type: str, modifying: bool = True, func: Callable = None):
+    def __init__(self, op_type: str, modifying: bool = True, func: Callable = None, batch_func: Callable = None,
+                 columns=None, target: str = None, source: str = None):
         """
         Initialize an operation operating with a function.
         :param op_type: Name of operation type
         :param modifying: True if operation modifies Conveyor, False otherwise
         :param func: Function the operation uses
+        :param batch_func: Optional version of func working with a whole batch, returns the mask
+                           of a filter or True if it transformed the batch, None/False to fall back to func
+        :param columns: Columns func uses, None if unknown
+        :param target: Column an apply func assigns to, None if unknown
+        :param source: Expression func was compiled from, None if it is a callable
         """
         if op_type not in self.OP_TYPES_BASE_FUNC.keys():
             raise ValueError(f'Unexpected operation type: {op_type}')
@@ -37,10 +82,27 @@ def __init__(self, op_type: str, modifying: bool = True, func: Callable = None):
         if func is None:
             func = self.OP_TYPES_BASE_FUNC[self.op_type]
         self.func = func
+        self.batch_func = batch_func
+        self.columns = None if columns is None else set(columns)
+        self.target = target
+        self.source = source
 
     def reset(self):
         return
 
+    def reads(self):
+        return self.columns
+
+    def writes(self):
+        if self.op_type == 'filter':
+            return set()
+        if self.target is None or self.columns is None:
+            return None
+        return {self.target}
+
+    def fingerprint(self):
+        return self.op_type, self.func, self.batch_func
+
 
 class HeadOperation(Operation, ABC):
 
@@ -48,67 +110,476 @@ class HeadOperation(Operation, ABC):
         'head',
     )
 
-    def __init__(self, op_type: str, modifying: bool = True, n: int = 5):
+    def __init__(self, op_type: str, modifying: bool = True, n: int = 5, offset: int = 0):
         """
         Initialize an operation taking first N rows.
         :param op_type: Name of operation type
         :param modifying: True if operation modifies Conveyor, False otherwise
-        :param n: Number of rows to take
+        :param n: Number of rows to take, None for all of them
+        :param offset: Number of rows to skip before taking them
         """
         if op_type not in self.OP_TYPES:
             raise ValueError(f'Unexpected operation type: {op_type}')
         self.op_type = op_type
         self.modifying = modifying
         self.n = n
+        self.offset = offset
         self.cnt = 0
+        self.skipped = 0
 
     def reset(self):
         self.cnt = 0
+        self.skipped = 0
 
-class ColumnOperation(Operation, ABC):
+    def reads(self):
+        return set()
 
-    OP_TYPES = {
-        'sum': lambda x: x,
-    }
+    def fingerprint(self):
+        return self.op_type, self.n, self.offset
 
-    def __init__(self, op_type: str, column: str, modifying: bool = True, func: Callable = None):
+
+class AggOperation(Operation, ABC):
+
+    OP_TYPES = (
+        'agg',
+    )
+    mergeable = True
+
+    def __init__(self, op_type: str, columns=(), pairs=(), extremes=(), modifying: bool = False,
+                 quantiles=(), error: float = 0.01):
         """
-        Initialize an operation operating with a function.
+        Initialize an operation collecting statistics over the rows passing through it.
         :param op_type: Name of operation type
+        :param columns: Numeric columns to collect count, sum, mean and variance for
+        :param pairs: (col_x, col_y) tuples to collect co-moments for
+        :param extremes: Columns to collect minimum and maximum for
         :param modifying: True if operation modifies Conveyor, False otherwise
-        :param func: Function the operation uses
+        :param quantiles: Numeric columns to build quantile sketches for
+        :param error: Rank error of the quantile sketches as a fraction of the number of rows
         """
-        if op_type not in self.OP_TYPES.keys():
+        if op_type not in self.OP_TYPES:
             raise ValueError(f'Unexpected operation type: {op_type}')
         self.op_type = op_type
-        self.column = column
         self.modifying = modifying
-        if func is None:
-            func = self.OP_TYPES[self.op_type]
-        self.func = func
-        self.cnt = 0
+        self.columns = tuple(columns)
+        self.pairs = tuple(tuple(pair) for pair in pairs)
+        self.extremes_columns = tuple(extremes)
+        self.quantile_columns = tuple(quantiles)
+        self.error = error
+        self.reset()
 
-class StatOperation(Operation, ABC):
+    def reads(self):
+        return (set(self.columns) | {col for pair in self.pairs for col in pair} | set(self.extremes_columns)
+                | set(self.quantile_columns))
 
-    OP_TYPES = {
-        'pearson': lambda x: x,
-    }
+    def fingerprint(self):
+        return (self.op_type, self.columns, self.pairs, self.extremes_columns, self.quantile_columns,
+                self.error if self.quantile_columns else None)
+
+    def update_batch(self, batch):
+        for column, moments in self.moments.items():
+            moments.merge(Moments.from_array(batch.array(column)))
+        for (col_x, col_y), comoments in self.comoments.items():
+            comoments.merge(CoMoments.from_arrays(batch.array(col_x), batch.array(col_y)))
+        for column, extremes in self.extremes.items():
+            kind = 'str' if batch.schema is None else batch.schema.type(column)
+            if kind in ('int', 'float'):
+                extremes.update_array(batch.array(column))
+                continue
+            if kind is None:
+                # unknown type: numbers while the values parse
+                try:
+                    extremes.update_array(batch.array(column))
+                    continue
+                except ValueError:
+                    pass
+            values = batch[column]
+            if len(values):
+                extremes.update(min(values))
+                extremes.update(max(values))
+        for column, sketch in self.sketches.items():
+            sketch.update_array(batch.array(column))
 
-    def __init__(self, op_type: str, col_x: str, col_y: str, modifying: bool = True, func: Callable = None):
+    def update_arrays(self, entries, chunk: int = 1 << 20):
         """
-        Initialize an operation operating with a function.
+        Collect the statistics from whole columns read from the column cache.
+        :param entries: Dict label -> (values, dictionary) as returned by ColumnCache.load
+        :param chunk: Number of values converted to float at once
+        """
+        def numeric(column):
+            values, dictionary = entries[column]
+            if dictionary is not None:
+                raise ValueError(f'Column {column} is not numeric')
+            return values
+
+        for column, moments in self.moments.items():
+            values = numeric(column)
+            for i in range(0, len(values), chunk):
+                moments.merge(Moments.from_array(values[i:i + chunk].astype(np.float64)))
+        for (col_x, col_y), comoments in self.comoments.items():
+            x, y = numeric(col_x), numeric(col_y)
+            for i in range(0, len(x), chunk):
+                comoments.merge(CoMoments.from_arrays(x[i:i + chunk].astype(np.float64),
+                                                      y[i:i + chunk].astype(np.float64)))
+        for column, extremes in self.extremes.items():
+            values, dictionary = entries[column]
+            if dictionary is not None:
+                if dictionary:
+                    extremes.update(min(dictionary))
+                    extremes.update(max(dictionary))
+            else:
+                extremes.update_array(values)
+        for column, sketch in self.sketches.items():
+            values = numeric(column)
+            for i in range(0, len(values), chunk):
+                sketch.update_array(values[i:i + chunk])
+
+    def merge(self, other):
+        """
+        Combine statistics collected by the same operation over another part of the data.
+        :param other: AggOperation with the same columns
+        :return: self
+        """
+        for column, moments in self.moments.items():
+            moments.merge(other.moments[column])
+        for pair, comoments in self.comoments.items():
+            comoments.merge(other.comoments[pair])
+        for column, extremes in self.extremes.items():
+            extremes.merge(other.extremes[column])
+        for column, sketch in self.sketches.items():
+            sketch.merge(other.sketches[column])
+        return self
+
+    def reset(self):
+        self.moments = {column: Moments() for column in self.columns}
+        self.comoments = {pair: CoMoments() for pair in self.pairs}
+        self.extremes = {column: Extremes() for column in self.extremes_columns}
+        self.sketches = {column: QuantileSketch.with_error(self.error) for column in self.quantile_columns}
+
+
+class GroupByOperation(Operation, ABC):
+
+    OP_TYPES = (
+        'groupby',
+    )
+    mergeable = True
+
+    def __init__(self, op_type: str, keys=(), columns=(), modifying: bool = False):
+        """
+        Initialize an operation collecting statistics of numeric columns per group of rows.
         :param op_type: Name of operation type
+        :param keys: Columns the rows are grouped by
+        :param columns: Numeric columns to collect the statistics for
         :param modifying: True if operation modifies Conveyor, False otherwise
-        :param func: Function the operation uses
         """
-        if op_type not in self.OP_TYPES.keys():
+        if op_type not in self.OP_TYPES:
             raise ValueError(f'Unexpected operation type: {op_type}')
         self.op_type = op_type
-        self.col_x = col_x
-        self.col_y = col_y
         self.modifying = modifying
-        self.values = dict()
-        if func is None:
-            func = self.OP_TYPES[self.op_type]
-        self.func = func
-        self.coef = 0
+        self.keys = tuple(keys)
+        self.columns = tuple(columns)
+        self.reset()
+
+    def reads(self):
+        return set(self.keys) | set(self.columns)
+
+    def fingerprint(self):
+        return self.op_type, self.keys, self.columns
+
+    def update_batch(self, batch):
+        if len(self.keys) == 1:
+            keys = batch[self.keys[0]]
+        else:
+            keys = list(zip(*[batch[key] for key in self.keys]))
+        values = np.empty((len(self.columns), len(batch)))
+        for j, column in enumerate(self.columns):
+            values[j] = batch.array(column)
+        self.table.update(keys, values)
+
+    def merge(self, other):
+        self.table.merge(other.table)
+        return self
+
+    def reset(self):
+        self.table = GroupTable(len(self.columns))
+
+
+class JoinOperation(Operation, ABC):
+
+    OP_TYPES = (
+        'join',
+    )
+
+    def __init__(self, op_type: str, table=None, how: str = 'inner', stream_left: bool = True, header=(),
+                 suffixes=('_x', '_y'), modifying: bool = True, columns=None):
+        """
+        Initialize an operation joining the rows passing through it with the rows of a hash table.
+        :param op_type: Name of operation type
+        :param table: JoinTable of the other side of the join
+        :param how: 'inner', 'left', 'right' or 'outer'
+        :param stream_left: True if the rows passing through are the left side of the join
+        :param header: Column labels of the rows passing through
+        :param suffixes: Suffixes of the labels of the left and the right columns present on both sides
+        :param modifying: True if operation modifies Conveyor, False otherwise
+        :param columns: Column labels of the rows passing through to join, all of them if None
+        """
+        if op_type not in self.OP_TYPES:
+            raise ValueError(f'Unexpected operation type: {op_type}')
+        if how not in JOIN_TYPES:
+            raise ValueError(f'Unexpected join type: {how}')
+        self.op_type = op_type
+        self.modifying = modifying
+        self.table = table
+        self.how = how
+        self.stream_left = stream_left
+        self.suffixes = tuple(suffixes)
+        self.keep_stream = how in ('outer', 'left' if stream_left else 'right')
+        self.keep_table = how in ('outer', 'right' if stream_left else 'left')
+        self.columns = None if columns is None else list(dict.fromkeys([*table.on, *columns]))
+        self.stream_keys = list(dict.fromkeys(header if self.columns is None else self.columns))
+        self.directory = None
+        self.__stream_schema = None
+        self.__schemas = {}
+        self.reset()
+
+    def reset(self):
+        self.matched = set()
+        self.__table_checked = False
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory = None
+
+    def reads(self):
+        renamed = set(self.stream_keys) & set(self.table.header)
+        return set(self.table.on) | renamed
+
+    def writes(self):
+        return None
+
+    def fingerprint(self):
+        columns = None if self.columns is None else tuple(self.columns)
+        return self.op_type, self.table.fingerprint(), self.how, self.stream_left, self.suffixes, columns
+
+    def join_batch(self, batch):
+        """
+        :param batch: Batch of rows of the streamed side
+        :return: Batch of the joined rows, empty if the table is partitioned on disk
+                 (the rows are joined by finish then)
+        """
+        self.__build_table()
+        self.stream_keys = [key for key in batch.keys if self.columns is None or key in self.columns]
+        self.__stream_schema = batch.schema
+        keys = join_keys(batch, self.table.on)
+        rows = list(zip(*[batch[key] for key in self.stream_keys]))
+        if not self.table.spilled:
+            return self.__probe(self.table.index, self.table.rows, self.matched, keys, rows)
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='samwise-join-')
+        partitions = self.table.PARTITIONS
+        parts = [([], []) for _ in range(partitions)]
+        for key, row in zip(keys, rows):
+            part = parts[partition_of(key, partitions)]
+            part[0].append(key)
+            part[1].append(row)
+        for p, chunk in enumerate(parts):
+            if chunk[0]:
+                append_chunk(os.path.join(self.directory, f'{p}.part'), chunk)
+        return batch.slice(0, 0)
+
+    def __build_table(self):
+        # the side is checked for changes once per run, the table is not rebuilt in the middle of it
+        if not self.__table_checked:
+            self.table.build()
+            self.__table_checked = True
+
+    def finish(self, size: int):
+        self.__build_table()
+        try:
+            if not self.table.spilled:
+                if self.keep_table:
+                    yield from self.__unmatched(self.table.rows, self.matched, size)
+                return
+            for p in range(self.table.PARTITIONS):
+                index, rows = self.table.partition(p)
+                matched = set()
+                if self.directory is not None:
+                    for keys, stream_rows in read_chunks(os.path.join(self.directory, f'{p}.part')):
+                        yield self.__probe(index, rows, matched, keys, stream_rows)
+                if self.keep_table:
+                    yield from self.__unmatched(rows, matched, size)
+        finally:
+            self.reset()
+
+    def __probe(self, index, rows, matched, keys, stream_rows):
+        """
+        Look the keys of the streamed rows up in a hash index of the table rows.
+        """
+        picked, found = [], []
+        for key, row in zip(keys, stream_rows):
+            ids = index.get(key)
+            if ids:
+                for i in ids:
+                    picked.append(row)
+                    found.append(rows[i])
+                if self.keep_table:
+                    matched.update(ids)
+            elif self.keep_stream:
+                picked.append(row)
+                found.append(None)
+        return self.__output(picked, found)
+
+    def __unmatched(self, rows, matched, size):
+        rows = [row for i, row in enumerate(rows) if i not in matched]
+        for start in range(0, len(rows), size):
+            part = rows[start:start + size]
+            yield self.__output([None] * len(part), part)
+
+    def __sides(self):
+        """
+        :return: Column labels of the left and the right rows
+        """
+        table_keys = self.table.header if self.table.keys is None else self.table.keys
+        if self.stream_left:
+            return self.stream_keys, table_keys
+        return table_keys, self.stream_keys
+
+    def __layout(self):
+        """
+        :return: List of (label, side, position in the row of the side, position of the key in the row
+                 of the other side or None) of the output columns, left ones first
+        """
+        left, right = self.__sides()
+        on = self.table.on
+        layout = []
+        for i, key in enumerate(left):
+            if key in on:
+                layout.append((key, 0, i, right.index(key)))
+            else:
+                layout.append((key + self.suffixes[0] if key in right else key, 0, i, None))
+        for i, key in enumerate(right):
+            if key not in on:
+                layout.append((key + self.suffixes[1] if key in left else key, 1, i, None))
+        return layout
+
+    def __output(self, stream_rows, table_rows):
+        sides = (stream_rows, table_rows) if self.stream_left else (table_rows, stream_rows)
+        layout = self.__layout()
+        columns = {}
+        for label, side, i, j in layout:
+            if j is None:
+                columns[label] = [row[i] if row is not None else None for row in sides[side]]
+            else:
+                columns[label] = [row[i] if row is not None else other[j] for row, other in zip(*sides)]
+        return Batch([label for label, _, _, _ in layout], columns=columns, schema=self.schema(self.__stream_schema))
+
+    def schema(self, stream_schema):
+        """
+        :param stream_schema: Schema of the streamed side
+        :return: Schema of the joined rows
+        """
+        cache_key = id(stream_schema), tuple(self.stream_keys)
+        schema = self.__schemas.get(cache_key)
+        if schema is None:
+            schemas = (stream_schema, self.table.schema) if self.stream_left else (self.table.schema, stream_schema)
+            sides = self.__sides()
+            types = {}
+            for label, side, i, j in self.__layout():
+                kind = None if schemas[side] is None else schemas[side].type(sides[side][i])
+                if j is not None and schemas[1 - side] is not None:
+                    other = schemas[1 - side].type(sides[1 - side][j])
+                    if kind != other:
+                        kind = 'float' if {kind, other} <= {'int', 'float'} else 'str'
+                if kind is not None:
+                    types[label] = kind
+            schema = Schema(types)
+            self.__schemas[cache_key] = schema
+        return schema
+
+
+class TopKOperation(Operation, ABC):
+
+    OP_TYPES = (
+        'topk',
+    )
+    mergeable = True
+
+    def __init__(self, op_type: str, columns=(), n: int = 5, largest: bool = True, rows: bool = True,
+                 modifying: bool = False):
+        """
+        Initialize an operation keeping the rows with the largest (or smallest) values of numeric columns.
+        :param op_type: Name of operation type
+        :param columns: Columns compared in turn, rows with a missing value in them are skipped
+        :param n: Number of rows to keep
+        :param largest: Keep the largest values, the smallest ones otherwise
+        :param rows: Keep the whole rows, only the values of the columns otherwise
+        :param modifying: True if operation modifies Conveyor, False otherwise
+        """
+        if op_type not in self.OP_TYPES:
+            raise ValueError(f'Unexpected operation type: {op_type}')
+        if n < 0:
+            raise ValueError(f'Number of rows should not be negative, got {n}')
+        self.op_type = op_type
+        self.modifying = modifying
+        self.columns = tuple(columns)
+        self.n = n
+        self.largest = largest
+        self.rows = rows
+        self.reset()
+
+    def reset(self):
+        self.top = TopK(self.n)
+        self.keys = None
+        self.seen = 0
+
+    def reads(self):
+        return None if self.rows else set(self.columns)
+
+    def fingerprint(self):
+        return self.op_type, self.columns, self.n, self.largest, self.rows
+
+    def update_batch(self, batch):
+        """
+        Only the rows which can get into the heap are pushed: the ones not smaller than its threshold
+        in the first column and, of them, the ones not smaller than the n-th largest value of the batch.
+        """
+        if not self.n:
+            self.seen += len(batch)
+            return
+        sign = 1 if self.largest else -1
+        arrays = [sign * batch.array(column) for column in self.columns]
+        first = arrays[0]
+        valid = np.ones(len(batch), dtype=bool)
+        for values in arrays:
+            if values.dtype.kind == 'f':
+                valid &= ~np.isnan(values)
+        threshold = self.top.threshold()
+        if threshold is not None:
+            valid &= first >= threshold[0]
+        picked = np.flatnonzero(valid)
+        if len(picked) > self.n:
+            kth = np.partition(first[picked], len(picked) - self.n)[len(picked) - self.n]
+            picked = picked[first[picked] >= kth]
+        if self.keys is None:
+            self.keys = list(batch.keys)
+        columns = [batch[key] for key in batch.keys] if self.rows else None
+        for i in picked.tolist():
+            key = tuple(values[i].item() for values in arrays)
+            payload = None if columns is None else dict(zip(batch.keys, (column[i] for column in columns)))
+            self.top.push(key, (self.origin << 40) + self.seen + i, payload)
+        self.seen += len(batch)
+
+    def merge(self, other):
+        self.top.merge(other.top)
+        if self.keys is None:
+            self.keys = other.keys
+        return self
+
+    def result(self):
+        """
+        :return: List of row dicts (of raw values) if rows are kept, tuples of the values of the columns otherwise,
+                 from the first in the order
+        """
+        sign = 1 if self.largest else -1
+        if self.rows:
+            return [row for _, row in self.top.result()]
+        return [tuple(sign * value for value in key) for key, _ in self.top.result()]
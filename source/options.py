@@ -0,0 +1,67 @@
+import os
+import re
+
+UNITS = {
+    '': 1,
+    'B': 1,
+    'KB': 1 << 10,
+    'MB': 1 << 20,
+    'GB': 1 << 30,
+    'TB': 1 << 40,
+}
+
+OPTIONS = {
+    'memory_limit': 1 << 30,  # bytes the buffers, sort runs and arrays of the process may take
+    'buffer_rows': 65536,  # rows of a column kept around the last accessed one
+    'async_workers': min(32, (os.cpu_count() or 1) + 4),  # threads of the pool shared by async calls
+    'progress': 'auto',  # backend of progress bars: notebook in Jupyter, console in a terminal, logging otherwise
+}
+
+PROGRESS_BACKENDS = ('auto', 'console', 'notebook', 'logging', 'none')
+
+
+def parse_size(size):
+    """
+    :param size: Number of bytes or a string like '512MB', '2GB', '1.5 GB'
+    :return: Number of bytes
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = re.fullmatch(r'\s*(\d+(?:\.\d*)?)\s*([KMGT]?B?)\s*', str(size).upper())
+    if match is None:
+        raise ValueError(f'Unexpected size: {size}')
+    number, unit = match.groups()
+    if unit and not unit.endswith('B'):
+        unit += 'B'
+    return int(float(number) * UNITS[unit])
+
+
+def set_option(name: str, value):
+    """
+    Set a process-wide option.
+    :param name: 'memory_limit' (bytes or a string like '2GB'), 'buffer_rows',
+                 'async_workers' (taken when the pool is created) or 'progress'
+                 (one of PROGRESS_BACKENDS or a callable making a progress.Progress)
+    :param value: New value
+    """
+    if name not in OPTIONS:
+        raise ValueError(f'Unexpected option: {name}')
+    if name == 'progress':
+        if not callable(value) and value not in PROGRESS_BACKENDS:
+            raise ValueError(f'Unexpected progress backend: {value}')
+        OPTIONS[name] = value
+        return
+    value = parse_size(value) if name == 'memory_limit' else int(value)
+    if value <= 0:
+        raise ValueError(f'Option {name} should be positive, got {value}')
+    OPTIONS[name] = value
+
+
+def get_option(name: str):
+    """
+    :param name: Name of the option
+    :return: Current value of the option
+    """
+    if name not in OPTIONS:
+        raise ValueError(f'Unexpected option: {name}')
+    return OPTIONS[name]
@@ -0,0 +1,136 @@
+import csv
+import io
+import multiprocessing
+import os
+
+BLOCK_SIZE = 1 << 20
+
+_conveyor = None
+
+
+class RangeFile(io.RawIOBase):
+    """
+    Read-only binary file limited to the byte range [start, end).
+    """
+    def __init__(self, filename: str, start: int, end: int, opener=None):
+        """
+        :param opener: Function of the file name returning a seekable binary stream of the data,
+                       the file itself by default
+        """
+        self.__file = opener(filename) if opener is not None else open(filename, 'rb')
+        self.__file.seek(start)
+        self.__left = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self.__left)
+        if n <= 0:
+            return 0
+        data = self.__file.read(n)
+        b[:len(data)] = data
+        self.__left -= len(data)
+        return len(data)
+
+    def close(self):
+        self.__file.close()
+        super().close()
+
+
+def open_range(filename: str, start: int, end: int, encoding: str = 'utf-8', opener=None):
+    """
+    :param opener: Function of the file name returning a seekable binary stream of the data, see RangeFile
+    :return: Text stream over the byte range [start, end) of the file
+    """
+    return io.TextIOWrapper(io.BufferedReader(RangeFile(filename, start, end, opener), BLOCK_SIZE),
+                            encoding=encoding, newline='')
+
+
+def split_csv(filename: str, parts: int, encoding: str = 'utf-8', opener=None):
+    """
+    Split a csv file into byte ranges which start at the beginning of a record.
+
+    Newlines inside quoted fields are skipped by tracking the parity of the quotes seen
+    so far, escaped quotes come in pairs and do not change it.
+    :param filename: Name of the csv file
+    :param parts: Desired number of ranges
+    :param opener: Function of the file name returning a seekable binary stream of the data (e.g. of
+                   the decompressed data), the ranges are offsets in it. The file itself by default
+    :return: Parsed header and the list of (start, end) ranges covering the records
+    """
+    if opener is None:
+        size = os.path.getsize(filename)
+        f = open(filename, 'rb')
+    else:
+        f = io.BufferedReader(opener(filename), BLOCK_SIZE)
+        size = f.seek(0, io.SEEK_END)
+        f.seek(0)
+    with f:
+        line = f.readline()
+        while line.count(b'"') % 2:
+            rest = f.readline()
+            if not rest:
+                break
+            line += rest
+        header = next(csv.reader([line.decode(encoding)]), [])
+        offset = f.tell()
+        step = (size - offset) / parts
+        targets = [int(offset + step * k) for k in range(1, parts)]
+        bounds = [offset]
+        in_quotes = 0
+        while targets:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            pos = 0
+            while targets:
+                target = targets[0] - offset
+                if target >= len(block):
+                    break
+                if target > pos:
+                    in_quotes ^= block.count(b'"', pos, target) & 1
+                    pos = target
+                nl = block.find(b'\n', pos)
+                if nl == -1:
+                    break
+                in_quotes ^= block.count(b'"', pos, nl) & 1
+                pos = nl + 1
+                if not in_quotes:
+                    bounds.append(offset + pos)
+                    while targets and targets[0] < offset + pos:
+                        targets.pop(0)
+            in_quotes ^= block.count(b'"', pos) & 1
+            offset += len(block)
+    bounds.append(size)
+    ranges = [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+    return header, ranges
+
+
+def available():
+    """
+    Workers get the pipeline (with all its lambdas) by forking, so fork is required.
+    """
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def _init(conveyor):
+    global _conveyor
+    _conveyor = conveyor
+
+
+def _scan(part):
+    return _conveyor._scan_part(part)
+
+
+def scan(conveyor, parts, workers: int):
+    """
+    Run the conveyor over the parts in a process pool.
+    :param conveyor: Conveyor with the operations to run
+    :param parts: Parts of the input, see Conveyor._scan_part
+    :param workers: Number of processes
+    :return: Iterator over the results of the parts in the order of parts
+    """
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(min(workers, len(parts)), initializer=_init, initargs=(conveyor,)) as pool:
+        yield from pool.imap(_scan, parts)
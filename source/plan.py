@@ -0,0 +1,82 @@
+class Plan:
+    """
+    Logical view of the operations of a conveyor.
+
+    Works out which columns of the file the operations and the consumer of the result
+    need, and moves filters which can be evaluated over whole columns ahead of the
+    operations they do not depend on, so that fewer rows reach the rest of the pipeline.
+    Head operations which no filter precedes are turned into the range of rows to read.
+    """
+    def __init__(self, todos, output=None):
+        """
+        Initialize the plan.
+        :param todos: Operations of the conveyor in the order they were added
+        :param output: Columns the consumer of the result reads, None for all of them
+        """
+        self.start, self.limit, self.todos = self.__window(self.__reorder(list(todos)))
+        self.columns = self.__columns(self.todos, output)
+
+    @staticmethod
+    def __window(todos):
+        """
+        Take the head operations preceded only by transforms out of the operations.
+        :return: Number of the first row of the file to read, number of rows to read (None for all of them)
+                 and the rest of the operations
+        """
+        start, limit = 0, None
+        rest = []
+        pushable = True
+        for task in todos:
+            if pushable and task.op_type == 'head':
+                start += task.offset
+                if limit is not None:
+                    limit = max(0, limit - task.offset)
+                if task.n is not None:
+                    limit = task.n if limit is None else min(limit, task.n)
+                continue
+            if task.op_type != 'apply':
+                pushable = False
+            rest.append(task)
+        return start, limit, rest
+
+    @staticmethod
+    def __columns(todos, output):
+        """
+        :return: Set of the columns to read from the file, None for all of them
+        """
+        if output is None:
+            return None
+        columns = set(output)
+        for task in todos:
+            reads = task.reads()
+            if reads is None:
+                return None
+            columns |= reads
+        return columns
+
+    @staticmethod
+    def __reorder(todos):
+        """
+        Push vectorized filters over the filters and transforms they do not depend on.
+        Head and aggregation operations are never crossed.
+        """
+        for i in range(1, len(todos)):
+            task = todos[i]
+            if task.op_type != 'filter' or task.batch_func is None or task.reads() is None:
+                continue
+            j = i
+            while j > 0:
+                prev = todos[j - 1]
+                if prev.op_type == 'filter':
+                    if prev.batch_func is not None:
+                        break
+                elif prev.op_type == 'apply':
+                    writes = prev.writes()
+                    if writes is None or writes & task.reads():
+                        break
+                else:
+                    break
+                j -= 1
+            if j < i:
+                todos.insert(j, todos.pop(i))
+        return todos
@@ -0,0 +1,145 @@
+import time
+
+
+class Stage:
+    """
+    Statistics of one stage of a pipeline: reading and parsing of the file or an operation.
+    """
+    __slots__ = ('name', 'operation', 'detail', 'rows_in', 'rows_out', 'seconds', 'calls', 'bytes')
+
+    def __init__(self, name, operation, detail=None):
+        self.name = name
+        self.operation = operation
+        self.detail = detail
+        self.rows_in = 0
+        self.rows_out = 0
+        self.seconds = 0.0
+        self.calls = 0
+        self.bytes = None
+
+    def merge(self, other):
+        self.rows_in += other.rows_in
+        self.rows_out += other.rows_out
+        self.seconds += other.seconds
+        self.calls += other.calls
+        if other.bytes is not None:
+            self.bytes = (self.bytes or 0) + other.bytes
+        return self
+
+    def report(self):
+        return {
+            'stage': self.name,
+            'operation': self.operation,
+            'detail': self.detail,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'selectivity': self.rows_out / self.rows_in if self.rows_in else None,
+            'seconds': self.seconds,
+            'calls': self.calls,
+            'bytes': self.bytes,
+        }
+
+
+def describe(task):
+    """
+    :return: Short description of an operation for the report: the expression it was compiled from,
+             the name of its function or the columns it uses
+    """
+    source = getattr(task, 'source', None)
+    if source is not None:
+        return source
+    func = getattr(task, 'func', None)
+    if func is not None:
+        return getattr(func, '__name__', repr(func))
+    columns = getattr(task, 'columns', None)
+    return ', '.join(map(str, columns)) if columns else None
+
+
+class Profile:
+    """
+    Per-stage instrumentation of conveyor runs: rows in and out, time, selectivity and bytes read.
+
+    A conveyor records into its profile only if it has one, so there is no cost otherwise.
+    Stages of parallel runs are summed over the worker processes, so their time may exceed the wall time.
+    Every run makes a report, it is kept in runs and passed to the callback if there is one.
+    """
+    def __init__(self, callback=None):
+        """
+        Initialize an empty profile.
+        :param callback: Function called with the report of every run, e.g. to send it to a metrics system
+        """
+        self.callback = callback
+        self.runs = []
+        self.stages = {}
+        self.__start = None
+
+    def start(self):
+        """
+        Begin the report of a run.
+        """
+        self.stages = {}
+        self.__start = time.perf_counter()
+
+    def stage(self, key, operation, detail=None):
+        """
+        :param key: Hashable identifier of the stage in the run
+        :return: Stage to record into
+        """
+        stage = self.stages.get(key)
+        if stage is None:
+            stage = self.stages[key] = Stage(str(key), operation, detail)
+        return stage
+
+    def operation(self, position, task):
+        """
+        :param position: Number of the operation in the todos of the conveyor
+        :return: Stage of the operation
+        """
+        return self.stage(f'{position}:{task.op_type}', task.op_type, describe(task))
+
+    def merge(self, stages):
+        """
+        Add the stages recorded by a worker process.
+        :param stages: Dict key -> Stage
+        """
+        for key, other in stages.items():
+            self.stage(key, other.operation, other.detail).merge(other)
+
+    def finish(self, rows: int):
+        """
+        Finish the report of a run and pass it to the callback.
+        :param rows: Number of rows the run yielded
+        :return: The report
+        """
+        seconds = time.perf_counter() - self.__start if self.__start is not None else None
+        report = {
+            'rows': rows,
+            'seconds': seconds,
+            'stages': [stage.report() for stage in self.stages.values()],
+        }
+        self.runs.append(report)
+        self.__start = None
+        if self.callback is not None:
+            self.callback(report)
+        return report
+
+    def report(self):
+        """
+        :return: Report of the last run: dict with the number of rows yielded, wall time and the list of stages
+                 (stage, operation, detail, rows_in, rows_out, selectivity, seconds, calls, bytes),
+                 None if nothing ran
+        """
+        return self.runs[-1] if self.runs else None
+
+    def __str__(self):
+        report = self.report()
+        if report is None:
+            return 'Profile: no runs'
+        lines = [f"{'stage':<16} {'detail':<24} {'rows in':>10} {'rows out':>10} {'select':>7} {'seconds':>9} {'MB':>8}"]
+        for stage in report['stages']:
+            selectivity = '' if stage['selectivity'] is None else f"{stage['selectivity']:.3f}"
+            megabytes = '' if stage['bytes'] is None else f"{stage['bytes'] / 2 ** 20:.1f}"
+            lines.append(f"{stage['stage']:<16} {str(stage['detail'] or '')[:24]:<24} {stage['rows_in']:>10} "
+                         f"{stage['rows_out']:>10} {selectivity:>7} {stage['seconds']:>9.4f} {megabytes:>8}")
+        lines.append(f"total: {report['rows']} rows in {report['seconds'] or 0:.4f} s")
+        return '\n'.join(lines)
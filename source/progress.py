@@ -0,0 +1,183 @@
+import logging
+import sys
+import time
+
+from options import get_option
+
+logger = logging.getLogger('samwise')
+
+
+class Progress:
+    """
+    Progress of a pass over a file, in bytes consumed of its known size. Reports nothing:
+    backends override report and close.
+    """
+    def __init__(self, total: int = None, desc: str = None):
+        """
+        Initialize the progress.
+        :param total: Number of bytes to consume, None if unknown
+        :param desc: Description of the pass
+        """
+        self.total = total
+        self.desc = desc or ''
+        self.done = 0
+        self.started = time.monotonic()
+
+    def update(self, n: int):
+        """
+        :param n: Number of bytes consumed since the last update
+        """
+        if n:
+            self.done += n
+            self.report()
+
+    def report(self):
+        pass
+
+    def close(self):
+        pass
+
+    def fraction(self):
+        """
+        :return: Part of the total consumed, None if the total is unknown
+        """
+        if not self.total:
+            return None
+        return min(1.0, self.done / self.total)
+
+    def describe(self):
+        """
+        :return: Line like 'desc: 42.0% 10.5/25.0 MB 12.3 MB/s'
+        """
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        fraction = self.fraction()
+        done = f'{self.done / 2 ** 20:.1f}' + ('' if self.total is None else f'/{self.total / 2 ** 20:.1f}')
+        percent = '' if fraction is None else f'{100 * fraction:5.1f}% '
+        return f'{self.desc}: {percent}{done} MB {self.done / 2 ** 20 / elapsed:.1f} MB/s'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class NullProgress(Progress):
+    """
+    No-op backend.
+    """
+
+
+class ConsoleProgress(Progress):
+    """
+    Single line on stderr rewritten at most every interval seconds.
+    """
+    interval = 0.1
+
+    def __init__(self, total: int = None, desc: str = None, stream=None):
+        super().__init__(total, desc)
+        self.stream = stream or sys.stderr
+        self.__shown = 0.0
+
+    def report(self):
+        now = time.monotonic()
+        if now - self.__shown >= self.interval:
+            self.__shown = now
+            self.stream.write('\r' + self.describe())
+            self.stream.flush()
+
+    def close(self):
+        self.stream.write('\r' + self.describe() + '\n')
+        self.stream.flush()
+
+
+class LoggingProgress(Progress):
+    """
+    INFO records of the samwise logger every step of the total (every interval seconds if it is unknown),
+    for processes without a terminal.
+    """
+    step = 0.1
+    interval = 10.0
+
+    def __init__(self, total: int = None, desc: str = None):
+        super().__init__(total, desc)
+        self.__next = self.step
+        self.__shown = time.monotonic()
+
+    def report(self):
+        fraction = self.fraction()
+        if fraction is None:
+            now = time.monotonic()
+            if now - self.__shown < self.interval:
+                return
+            self.__shown = now
+        elif fraction < self.__next:
+            return
+        else:
+            self.__next = (int(fraction / self.step) + 1) * self.step
+        logger.info(self.describe())
+
+    def close(self):
+        logger.info(self.describe())
+
+
+class NotebookProgress(Progress):
+    """
+    tqdm widget of a Jupyter notebook.
+    """
+    def __init__(self, total: int = None, desc: str = None):
+        super().__init__(total, desc)
+        from tqdm.notebook import tqdm
+        self.__bar = tqdm(total=total, desc=desc, unit='B', unit_scale=True, unit_divisor=1024)
+
+    def update(self, n: int):
+        if n:
+            self.done += n
+            self.__bar.update(n)
+
+    def close(self):
+        self.__bar.close()
+
+
+BACKENDS = {
+    'none': NullProgress,
+    'console': ConsoleProgress,
+    'logging': LoggingProgress,
+    'notebook': NotebookProgress,
+}
+
+
+def in_notebook():
+    """
+    :return: True if the code runs in a Jupyter kernel
+    """
+    shell = getattr(sys.modules.get('IPython'), 'get_ipython', lambda: None)()
+    return shell is not None and 'IPKernelApp' in getattr(shell, 'config', {})
+
+
+def make_progress(progressbar, total: int = None, desc: str = None):
+    """
+    :param progressbar: False for no progress, True for the backend of the 'progress' option,
+                        a name of a backend ('console', 'notebook', 'logging', 'none', 'auto')
+                        or a callable (e.g. a Progress subclass) taking total and desc
+    :param total: Number of bytes to consume, None if unknown
+    :param desc: Description of the pass
+    :return: Progress
+    """
+    if not progressbar:
+        return NullProgress(total, desc)
+    if progressbar is True:
+        progressbar = get_option('progress')
+    if callable(progressbar):
+        return progressbar(total=total, desc=desc)
+    if progressbar == 'auto':
+        if in_notebook():
+            progressbar = 'notebook'
+        else:
+            progressbar = 'console' if sys.stderr is not None and sys.stderr.isatty() else 'logging'
+    if progressbar not in BACKENDS:
+        raise ValueError(f'Unexpected progress backend: {progressbar}')
+    try:
+        return BACKENDS[progressbar](total, desc)
+    except ImportError:
+        return ConsoleProgress(total, desc)
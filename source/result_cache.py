@@ -0,0 +1,53 @@
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Results of conveyor runs (row counts, keys, aggregations) keyed by the fingerprint
+    of the pipeline that produced them, the least recently used ones are evicted.
+
+    A fingerprint includes the modification time and size of the source file,
+    so results of a changed file are never returned. The cache is shared by the threads
+    running conveyors (see asynchronous.py), so it is guarded by a lock.
+    """
+    def __init__(self, maxsize: int = 256):
+        """
+        Initialize the cache.
+        :param maxsize: Number of results to keep
+        """
+        self.maxsize = maxsize
+        self.__items = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        :param key: Fingerprint, None is never found
+        :return: Result stored under the key, default if there is none
+        """
+        if key is None:
+            return default
+        with self.__lock:
+            if key not in self.__items:
+                return default
+            self.__items.move_to_end(key)
+            return self.__items[key]
+
+    def put(self, key, value):
+        """
+        Store a result, a None key is ignored.
+        """
+        if key is None:
+            return
+        with self.__lock:
+            self.__items[key] = value
+            self.__items.move_to_end(key)
+            while len(self.__items) > self.maxsize:
+                self.__items.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__items.clear()
+
+    def __len__(self):
+        return len(self.__items)
@@ -0,0 +1,125 @@
+import csv
+import os
+import struct
+
+import numpy as np
+
+BLOCK_SIZE = 1 << 22
+
+
+class RowIndex:
+    """
+    Byte offsets of every step-th record of a csv file.
+
+    The index is stored next to the file (filename + '.idx') and reused while
+    the modification time and the size of the file stay the same.
+    """
+    MAGIC = b'SWIDX001'
+    HEADER = struct.Struct('<8sqqqqq')
+
+    def __init__(self, filename: str, step: int, mtime: int, size: int, rows: int, header_end: int, offsets):
+        self.filename = filename
+        self.step = step
+        self.mtime = mtime
+        self.size = size
+        self.rows = rows
+        self.header_end = header_end
+        self.offsets = offsets
+        self.__header = None
+
+    @classmethod
+    def load(cls, filename: str, step: int = 64):
+        """
+        Read the index from its sidecar file or build it if it is missing or outdated.
+        :param filename: Name of the csv file
+        :param step: Every step-th record offset is stored
+        :return: RowIndex of the file
+        """
+        stat = os.stat(filename)
+        path = filename + '.idx'
+        try:
+            with open(path, 'rb') as f:
+                magic, mtime, size, idx_step, rows, header_end = cls.HEADER.unpack(f.read(cls.HEADER.size))
+                if (magic, mtime, size, idx_step) == (cls.MAGIC, stat.st_mtime_ns, stat.st_size, step):
+                    offsets = np.fromfile(f, dtype='<i8')
+                    return cls(filename, step, mtime, size, rows, header_end, offsets)
+        except (OSError, struct.error):
+            pass
+        index = cls.build(filename, step)
+        try:
+            index.save(path)
+        except OSError:
+            pass  # read-only location: keep the index in memory only
+        return index
+
+    @classmethod
+    def build(cls, filename: str, step: int = 64):
+        """
+        Scan the file and find where its records start.
+
+        A newline ends a record only if an even number of quotes precede it,
+        blank lines are skipped like csv.reader does.
+        """
+        stat = os.stat(filename)
+        starts = []
+        with open(filename, 'rb') as f:
+            in_quotes = 0
+            pos = 0
+            pending = False
+            while True:
+                block = f.read(BLOCK_SIZE)
+                if not block:
+                    break
+                arr = np.frombuffer(block, dtype=np.uint8)
+                parity = (np.cumsum(arr == ord('"')) + in_quotes) & 1
+                ends = np.flatnonzero((arr == ord('\n')) & (parity == 0)) + 1
+                if pending and int(arr[0]) not in b'\r\n':
+                    starts.append(np.array([pos], dtype=np.int64))
+                pending = len(ends) > 0 and ends[-1] == len(arr)
+                ends = ends[ends < len(arr)]
+                ends = ends[(arr[ends] != ord('\n')) & (arr[ends] != ord('\r'))]
+                starts.append(ends.astype(np.int64) + pos)
+                in_quotes = int(parity[-1])
+                pos += len(block)
+        starts = np.concatenate(starts) if starts else np.empty(0, dtype=np.int64)
+        header_end = int(starts[0]) if len(starts) else stat.st_size
+        return cls(filename, step, stat.st_mtime_ns, stat.st_size, len(starts), header_end, starts[::step].copy())
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.mtime, self.size, self.step, self.rows, self.header_end))
+            self.offsets.astype('<i8').tofile(f)
+
+    def is_valid(self):
+        """
+        :return: True if the file has not changed since the index was built
+        """
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return False
+        return (stat.st_mtime_ns, stat.st_size) == (self.mtime, self.size)
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def header(self):
+        """
+        Column labels parsed from the first record of the file.
+        """
+        if self.__header is None:
+            with open(self.filename, 'rb') as f:
+                line = f.read(self.header_end).decode('utf-8')
+            self.__header = next(csv.reader([line]), [])
+        return self.__header
+
+    def locate(self, row: int):
+        """
+        :param row: Number of the record (not counting the header)
+        :return: Byte offset of the closest indexed record at or before row and its number
+        """
+        if row >= self.rows:
+            return self.size, self.rows
+        i = row // self.step
+        return int(self.offsets[i]), i * self.step
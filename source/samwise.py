@@ -1,4 +1,5 @@
 from dataframe import DataFrame
+from options import set_option, get_option
 
-def read_csv(filename: str):
-    return DataFrame(filename)
\ No newline at end of file
+def read_csv(filename: str, workers: int = 1, cache=False, dtype: dict = None, profile=False):
+    return DataFrame(filename, workers, cache, dtype, profile)
\ No newline at end of file
@@ -0,0 +1,155 @@
+import numpy as np
+
+TYPES = {
+    'int': 'int',
+    'float': 'float',
+    'str': 'str',
+    int: 'int',
+    float: 'float',
+    str: 'str',
+}
+
+
+def infer_type(values):
+    """
+    :param values: Raw values of a column
+    :return: 'int' if all the non-empty values are integers, 'float' if they are numbers, 'str' otherwise,
+             None if all the values are empty: the type is unknown, values parsing as numbers are numbers
+    """
+    values = [v for v in values if v]
+    if not values:
+        return None
+    for kind, dtype in (('int', np.int64), ('float', np.float64)):
+        try:
+            np.asarray(values, dtype=dtype)
+            return kind
+        except (ValueError, TypeError, OverflowError):
+            pass
+    return 'str'
+
+
+def converter(kind):
+    """
+    :param kind: Column type
+    :return: Function converting a raw value to the type, empty strings become None,
+             values which do not parse and values which are not strings (e.g. computed
+             by transforms) are returned as they are
+    """
+    if kind == 'str':
+        return lambda value: value
+    cast = int if kind == 'int' else float
+
+    def convert(value):
+        if not isinstance(value, str):
+            return value
+        if not value:
+            return None
+        try:
+            return cast(value)
+        except ValueError:
+            return value
+
+    return convert
+
+
+def to_array(values, kind=None):
+    """
+    Convert raw values of a numeric column to a NumPy array.
+    :param values: Raw values
+    :param kind: Column type, None if unknown
+    :return: int64 array for integer columns without missing values, float64 array with NaN
+             for missing values otherwise, None if the values are not numbers
+    """
+    if kind == 'str':
+        return None
+    if kind == 'int':
+        try:
+            return np.asarray(values, dtype=np.int64)
+        except (ValueError, TypeError, OverflowError):
+            pass
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (ValueError, TypeError):
+        pass
+    try:
+        return np.asarray(['nan' if v is None or v == '' else v for v in values], dtype=np.float64)
+    except (ValueError, TypeError):
+        return None
+
+
+class Schema:
+    """
+    Types of the columns of a file, inferred from its first rows or given by the user.
+    """
+    SAMPLE = 1000
+
+    def __init__(self, types: dict):
+        """
+        Initialize the schema.
+        :param types: Mapping label -> 'int', 'float', 'str' or None if unknown
+        """
+        self.types = dict(types)
+        self.__converters = {}
+
+    @classmethod
+    def infer(cls, batch, dtype: dict = None):
+        """
+        :param batch: Batch with the first rows of the file
+        :param dtype: Mapping label -> type (int, float, str or their names) overriding the inferred ones
+        :return: Schema of the file
+        """
+        types = {key: infer_type(batch[key]) for key in batch.keys}
+        for key, kind in (dtype or {}).items():
+            if kind not in TYPES:
+                raise ValueError(f'Unexpected column type: {kind}')
+            types[key] = TYPES[kind]
+        return cls(types)
+
+    def type(self, column):
+        """
+        :return: Type of the column, None if it is unknown (e.g. added by apply or empty in the sample)
+        """
+        return self.types.get(column)
+
+    def converter(self, column):
+        """
+        :return: Function converting a raw value of the column to its type
+        """
+        convert = self.__converters.get(column)
+        if convert is None:
+            kind = self.type(column)
+            convert = converter('float' if kind is None else kind)
+            self.__converters[column] = convert
+        return convert
+
+    def convert(self, column, values):
+        """
+        :return: List of the values of the column converted to its type
+        """
+        if self.type(column) == 'str':
+            return list(values)
+        convert = self.converter(column)
+        return [convert(v) for v in values]
+
+    def to_array(self, column, values):
+        """
+        :return: Values of a numeric column as a NumPy array, None if the column holds strings
+        """
+        return to_array(values, self.type(column))
+
+    def sort_key(self, column):
+        """
+        :return: Function computing the sort key of a raw value, numbers go before
+                 the values which are missing or do not parse
+        """
+        if self.type(column) == 'str':
+            return lambda value: value
+        convert = self.converter(column)
+
+        def key(value):
+            res = convert(value)
+            if res is None or isinstance(res, str) or res != res:
+                return 1, value if isinstance(value, str) else ''
+            return 0, res
+
+        return key
@@ -0,0 +1,162 @@
+import heapq
+import os
+import pickle
+import shutil
+import tempfile
+from functools import total_ordering
+from itertools import islice
+from operator import itemgetter
+
+from memory import manager
+
+ROW_BYTES = 120  # row tuple, its key tuple and the list entry
+VALUE_BYTES = 56  # str object without its characters
+MIN_RUN_ROWS = 10000  # never write shorter runs
+FAN_IN = 64  # runs merged at once
+CHUNK = 4096  # rows pickled at once
+
+
+@total_ordering
+class Descending:
+    """
+    Wrapper reversing the order of a value which cannot be negated (e.g. a string).
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __reduce__(self):
+        return Descending, (self.value,)
+
+
+def row_key(schema, header, by, ascending):
+    """
+    :param schema: Schema of the rows
+    :param header: Column labels of the rows
+    :param by: Columns to sort by
+    :param ascending: Directions of the columns
+    :return: Function computing the sort key of a row of raw values. Numbers go before the values
+             which are missing or do not parse in both directions
+    """
+    parts = []
+    for column, asc in zip(by, ascending):
+        i = header.index(column)
+        if schema.type(column) == 'str':
+            parts.append((i, None, asc))
+        else:
+            parts.append((i, schema.converter(column), asc))
+
+    def key(row):
+        res = []
+        for i, convert, asc in parts:
+            value = row[i]
+            if convert is None:
+                value = value or ''
+                res.append(value if asc else Descending(value))
+                continue
+            number = convert(value)
+            if number is None or isinstance(number, str) or number != number:
+                res.append((1, value if isinstance(value, str) else ''))
+            else:
+                res.append((0, number if asc else -number))
+        return tuple(res)
+
+    return key
+
+
+def row_bytes(row):
+    """
+    :return: Estimate of the memory a row of raw values and its key take
+    """
+    return ROW_BYTES + VALUE_BYTES * len(row) + sum(len(value) for value in row if isinstance(value, str))
+
+
+def _write_run(directory, items):
+    """
+    :param items: Iterable of (key, row) pairs in sorted order
+    :return: Name of the file the pairs are written to
+    """
+    items = iter(items)
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.run')
+    with os.fdopen(fd, 'wb') as f:
+        while True:
+            chunk = list(islice(items, CHUNK))
+            if not chunk:
+                break
+            pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _read_run(path):
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                chunk = pickle.load(f)
+            except EOFError:
+                break
+            yield from chunk
+    os.remove(path)
+
+
+def _merge(paths):
+    return heapq.merge(*[_read_run(path) for path in paths], key=itemgetter(0))
+
+
+def sort_rows(rows, key, limit: int = None):
+    """
+    Sort rows of any size, computing the key of every row once.
+
+    Rows are collected into runs while the memory manager grants their memory, each run
+    is sorted and written to a temporary file, then the runs are merged k-way (in several
+    passes if there are more than FAN_IN of them). The sort is stable.
+    :param rows: Iterable of rows
+    :param key: Function computing the sort key of a row
+    :param limit: Number of the first rows to return, they are selected with a heap of that size
+    :return: Iterator over the sorted rows
+    """
+    if limit is not None:
+        yield from heapq.nsmallest(limit, rows, key=key)
+        return
+    directory = None
+    runs = []
+    items = []
+    reserved = 0
+    try:
+        for row in rows:
+            nbytes = row_bytes(row)
+            if manager.reserve(nbytes):
+                reserved += nbytes
+            elif len(items) >= MIN_RUN_ROWS:
+                if directory is None:
+                    directory = tempfile.mkdtemp(prefix='samwise-sort-')
+                items.sort(key=itemgetter(0))
+                runs.append(_write_run(directory, items))
+                items = []
+                manager.release(reserved)
+                reserved = 0
+                if manager.reserve(nbytes):
+                    reserved += nbytes
+            items.append((key(row), row))
+        items.sort(key=itemgetter(0))
+        if not runs:
+            yield from map(itemgetter(1), items)
+            return
+        runs.append(_write_run(directory, items))
+        items = []
+        manager.release(reserved)
+        reserved = 0
+        while len(runs) > FAN_IN:
+            runs = [_write_run(directory, _merge(runs[:FAN_IN]))] + runs[FAN_IN:]
+        yield from map(itemgetter(1), _merge(runs))
+    finally:
+        manager.release(reserved)
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
@@ -0,0 +1,347 @@
+import bz2
+import gzip
+import io
+import lzma
+import queue
+import struct
+import threading
+from bisect import bisect_right
+
+try:
+    import zstandard
+except ImportError:  # zstd inputs are optional
+    zstandard = None
+
+BLOCK_SIZE = 1 << 22  # bytes decompressed at once
+READ_AHEAD = 2  # blocks decompressed ahead of the parser
+
+ZIP_MAGIC = (b'PK\x03\x04', b'PK\x05\x06')
+ZSTD_SKIPPABLE = 0x184D2A5E  # magic of the skippable frame holding the seek table
+ZSTD_SEEKABLE = 0x8F92EAB1  # magic at the end of the seek table
+
+
+class Codec:
+    """
+    Compression of a file, recognized by the magic bytes at its start or by its extension.
+    The registry of codecs is shared by the inputs of conveyors and the files written by writer.py.
+    """
+    def __init__(self, name: str, extensions, magic, opener, compressor=None):
+        """
+        :param name: Name of the compression
+        :param extensions: Extensions of the compressed files, e.g. ('.gz',)
+        :param magic: Byte strings a compressed file may start with
+        :param opener: Function of a binary stream returning the stream of the decompressed data
+        :param compressor: Function of a binary stream returning a stream compressing the data written to it,
+                           closing it must leave the binary stream open. None if files cannot be written
+        """
+        self.name = name
+        self.extensions = tuple(extensions)
+        self.magic = tuple(magic)
+        self.opener = opener
+        self.compressor = compressor
+
+    def open(self, fileobj):
+        return self.opener(fileobj)
+
+    def compress(self, fileobj):
+        if self.compressor is None:
+            raise ValueError(f'Writing {self.name} files is not supported.')
+        return self.compressor(fileobj)
+
+
+def _open_zstd(fileobj):
+    if zstandard is None:
+        raise ValueError('Reading zstd files requires the zstandard package.')
+    return zstandard.ZstdDecompressor().stream_reader(fileobj, read_size=BLOCK_SIZE, read_across_frames=True)
+
+
+def _compress_zstd(fileobj):
+    if zstandard is None:
+        raise ValueError('Writing zstd files requires the zstandard package.')
+    return zstandard.ZstdCompressor().stream_writer(fileobj, closefd=False)
+
+
+CODECS = {}
+
+
+def register_codec(codec: Codec):
+    """
+    Add a compression of files or replace the one with the same name.
+    """
+    CODECS[codec.name] = codec
+
+
+register_codec(Codec('gzip', ('.gz', '.gzip'), (b'\x1f\x8b',), lambda f: gzip.GzipFile(fileobj=f, mode='rb'),
+                     lambda f: gzip.GzipFile(fileobj=f, mode='wb')))
+register_codec(Codec('bz2', ('.bz2',), tuple(b'BZh%d' % level for level in range(1, 10)),
+                     lambda f: bz2.BZ2File(f, 'rb'), lambda f: bz2.BZ2File(f, 'wb')))
+register_codec(Codec('xz', ('.xz', '.lzma'), (b'\xfd7zXZ\x00',), lambda f: lzma.LZMAFile(f, 'rb'),
+                     lambda f: lzma.LZMAFile(f, 'wb')))
+register_codec(Codec('zstd', ('.zst', '.zstd'),
+                     (b'\x28\xb5\x2f\xfd',) + tuple(bytes([n, 0x2a, 0x4d, 0x18]) for n in range(0x50, 0x60)),
+                     _open_zstd, _compress_zstd))
+
+
+def codec_of(name: str, head: bytes = b''):
+    """
+    :param name: Name of the file
+    :param head: First bytes of the file, the extension is used if they are not known
+    :return: Codec of the file, None if it is not compressed
+    """
+    for codec in CODECS.values():
+        if head.startswith(codec.magic):
+            return codec
+    if head:
+        return None
+    name = name.lower()
+    for codec in CODECS.values():
+        if name.endswith(codec.extensions):
+            return codec
+    return None
+
+
+def detect(filename: str):
+    """
+    :param filename: Name of the input file
+    :return: Format of the file ('csv' or 'zip') and the name of its compression, None if it is not compressed
+    """
+    try:
+        with open(filename, 'rb') as f:
+            head = f.read(16)
+    except OSError:
+        head = b''
+    if head.startswith(ZIP_MAGIC) or (not head and filename.lower().endswith('.zip')):
+        return 'zip', None
+    codec = codec_of(filename, head)
+    return 'csv', None if codec is None else codec.name
+
+
+class ThreadedReader(io.RawIOBase):
+    """
+    Binary stream of data decompressed in large blocks on a background thread, so decompression
+    (which releases the GIL) overlaps with parsing. At most READ_AHEAD blocks wait to be read.
+    """
+    def __init__(self, stream, raw):
+        """
+        Start the thread.
+        :param stream: Stream of the decompressed data
+        :param raw: Stream of the compressed data under it, closed together with it
+        """
+        self.__stream = stream
+        self.__raw = raw
+        self.__queue = queue.Queue(READ_AHEAD)
+        self.__stopped = threading.Event()
+        self.__block = memoryview(b'')
+        self.__pos = 0
+        self.__eof = False
+        self.consumed = 0  # bytes of the compressed stream behind the data read so far
+        self.__thread = threading.Thread(target=self.__produce, name='samwise-decompress', daemon=True)
+        self.__thread.start()
+
+    def __produce(self):
+        try:
+            while not self.__stopped.is_set():
+                data = self.__stream.read(BLOCK_SIZE)
+                self.__put((data, self.__raw.tell(), None))
+                if not data:
+                    return
+        except BaseException as exc:
+            self.__put((b'', None, exc))
+
+    def __put(self, item):
+        while not self.__stopped.is_set():
+            try:
+                self.__queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.__pos >= len(self.__block):
+            if self.__eof:
+                return 0
+            data, consumed, exc = self.__queue.get()
+            if exc is not None:
+                raise exc
+            self.consumed = consumed
+            if not data:
+                self.__eof = True
+                return 0
+            self.__block, self.__pos = memoryview(data), 0
+        n = min(len(b), len(self.__block) - self.__pos)
+        b[:n] = self.__block[self.__pos:self.__pos + n]
+        self.__pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.__stopped.set()
+            self.__thread.join()
+            self.__stream.close()
+            self.__raw.close()
+        super().close()
+
+
+def zstd_frames(filename: str):
+    """
+    Read the seek table of a file in the zstd seekable format (independent frames and
+    a skippable frame listing their sizes at the end).
+    :return: List of (compressed, decompressed) offsets of the frames followed by the ends of the data,
+             None if the file has no seek table
+    """
+    with open(filename, 'rb') as f:
+        size = f.seek(0, io.SEEK_END)
+        if size < 17:
+            return None
+        f.seek(size - 9)
+        frames, descriptor, magic = struct.unpack('<IBI', f.read(9))
+        if magic != ZSTD_SEEKABLE:
+            return None
+        entry = 12 if descriptor & 0x80 else 8
+        table = frames * entry + 9
+        if table + 8 > size:
+            return None
+        f.seek(size - table - 8)
+        skippable, frame_size = struct.unpack('<II', f.read(8))
+        if skippable != ZSTD_SKIPPABLE or frame_size != table:
+            return None
+        data = f.read(frames * entry)
+    offsets = [(0, 0)]
+    for i in range(frames):
+        compressed, decompressed = struct.unpack_from('<II', data, i * entry)
+        offsets.append((offsets[-1][0] + compressed, offsets[-1][1] + decompressed))
+    return offsets
+
+
+class SeekableZstdFile(io.RawIOBase):
+    """
+    Decompressed data of a file in the zstd seekable format. Seeking starts decompression
+    at the frame holding the offset, so parts of the file are read independently.
+    """
+    def __init__(self, filename: str, frames=None):
+        """
+        :param frames: Offsets of the frames as returned by zstd_frames, read from the file by default
+        """
+        if zstandard is None:
+            raise ValueError('Reading zstd files requires the zstandard package.')
+        self.__frames = frames or zstd_frames(filename)
+        if self.__frames is None:
+            raise ValueError(f'{filename} has no zstd seek table')
+        self.__starts = [start for _, start in self.__frames]
+        self.__file = open(filename, 'rb')
+        self.__reader = None
+        self.__pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.__pos
+        elif whence == io.SEEK_END:
+            offset += self.__starts[-1]
+        if offset != self.__pos or self.__reader is None:
+            self.__open(max(0, offset))
+        return self.__pos
+
+    def tell(self):
+        return self.__pos
+
+    def __open(self, offset):
+        if offset >= self.__starts[-1]:
+            self.__reader = io.BytesIO(b'')
+            self.__pos = offset
+            return
+        i = max(0, min(bisect_right(self.__starts, offset), len(self.__starts) - 1) - 1)
+        compressed, start = self.__frames[i]
+        self.__file.seek(compressed)
+        self.__reader = zstandard.ZstdDecompressor().stream_reader(self.__file, read_size=BLOCK_SIZE,
+                                                                   read_across_frames=True, closefd=False)
+        skip = offset - start
+        while skip > 0:
+            data = self.__reader.read(min(skip, BLOCK_SIZE))
+            if not data:
+                break
+            skip -= len(data)
+        self.__pos = offset - skip
+
+    def readinto(self, b):
+        if self.__reader is None:
+            self.__open(self.__pos)
+        data = self.__reader.read(len(b))
+        b[:len(data)] = data
+        self.__pos += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            if self.__reader is not None:
+                self.__reader.close()
+            self.__file.close()
+        super().close()
+
+
+def open_text(binary, encoding: str = 'utf-8'):
+    return io.TextIOWrapper(binary, encoding=encoding, newline='')
+
+
+def open_decompressed(filename: str, compression: str):
+    """
+    :param compression: Name of a registered codec
+    :return: Binary stream of the decompressed file, decompressed on a background thread
+    """
+    raw = open(filename, 'rb')
+    try:
+        stream = CODECS[compression].open(raw)
+    except BaseException:
+        raw.close()
+        raise
+    return io.BufferedReader(ThreadedReader(stream, raw), BLOCK_SIZE)
+
+
+def zip_members(archive):
+    """
+    :param archive: ZipFile
+    :return: ZipInfo of the data files of the archive in any directory, without directories,
+             hidden files and the metadata macOS adds
+    """
+    members = []
+    for info in archive.infolist():
+        parts = info.filename.split('/')
+        if info.is_dir() or parts[0] == '__MACOSX' or parts[-1].startswith('.'):
+            continue
+        members.append(info)
+    return members
+
+
+def open_member(archive, info, encoding: str = 'utf-8'):
+    """
+    :return: Text stream of a member of a zip archive, decompressed if the member itself is compressed
+    """
+    member = archive.open(info, 'r')
+    codec = codec_of(info.filename, member.peek(16)[:16])
+    if codec is None:
+        return open_text(member, encoding)
+    return open_text(io.BufferedReader(ThreadedReader(codec.open(member), member), BLOCK_SIZE), encoding)
+
+
+def position(file):
+    """
+    :param file: Text stream of an input file
+    :return: Number of bytes of the file (of the compressed data if it is compressed) read so far,
+             None if it is not known
+    """
+    buffer = getattr(file, 'buffer', file)
+    consumed = getattr(getattr(buffer, 'raw', None), 'consumed', None)
+    if consumed is not None:
+        return consumed
+    try:
+        return buffer.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
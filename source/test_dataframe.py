@@ -0,0 +1,83 @@
+import gc
+import math
+import os
+
+import pytest
+
+from options import get_option, set_option
+from samwise import read_csv
+
+
+def test_derived_frames_record_into_the_active_profile(tmp_path):
+    filename = str(tmp_path / 'numbers.csv')
+    with open(filename, 'w') as f:
+        f.write('a,b\n' + ''.join(f'{i},{i % 7}\n' for i in range(100)))
+    df = read_csv(filename)
+    with df.profiling() as profile:
+        assert df.filter("df['a'] > 10", inplace=False).sum('a') == sum(range(11, 100))
+        assert df.transform("df['c'] = df['a'] * 2").sum('c') == 2 * sum(range(100))
+    assert len(profile.runs) == 2
+    assert profile.runs[0]['stages'][1]['detail'] == "df['a'] > 10"
+    assert profile.runs[1]['stages'][1]['detail'] == "df['c'] = df['a'] * 2"
+
+
+def test_filtered_merge_keeps_the_spilled_join_table(tmp_path):
+    left, right = str(tmp_path / 'left.csv'), str(tmp_path / 'right.csv')
+    with open(left, 'w') as f:
+        f.write('k,x\n' + ''.join(f'{i % 10},{i}\n' for i in range(10)))
+    with open(right, 'w') as f:
+        f.write('k,y\n' + ''.join(f'{i % 10},{i}\n' for i in range(1000)))
+    limit = get_option('memory_limit')
+    set_option('memory_limit', 1024)
+    try:
+        merged = read_csv(left).merge(read_csv(right), on='k')
+        assert sum(1 for _ in merged) == 1000
+        filtered = merged.filter("df['x'] > 4", inplace=False)
+        assert sum(1 for _ in filtered) == 500
+        del filtered
+        gc.collect()
+        assert sum(1 for _ in merged) == 1000
+    finally:
+        set_option('memory_limit', limit)
+
+
+@pytest.mark.parametrize('q', [0, 0.05, 0.1, 0.15, 0.5, 0.7, 0.95, 1])
+def test_quantile_paths_agree_on_nearest_rank(tmp_path, q):
+    filename = str(tmp_path / 'words.csv')
+    with open(filename, 'w') as f:
+        # the last row has no values, it is skipped by both paths
+        f.write('n,s\n' + ''.join(f'{i},w{i:02d}\n' for i in range(10)) + ',\n')
+    df = read_csv(filename)
+    rank = max(1, math.ceil(round(q * 10, 9)))
+    assert df.quantile(q, 'n', progressbar=False) == rank - 1
+    assert df.quantile(q, 'n', approx=True, progressbar=False) == rank - 1
+    assert df.quantile(q, 's', progressbar=False) == f'w{rank - 1:02d}'
+
+
+def test_merge_reads_the_rewritten_right_file(tmp_path):
+    left, right = str(tmp_path / 'left.csv'), str(tmp_path / 'right.csv')
+    with open(left, 'w') as f:
+        f.write('k,x\n' + ''.join(f'{i},{i}\n' for i in range(100)))
+    with open(right, 'w') as f:
+        f.write('k,y\n0,old\n1,old\n')
+    merged = read_csv(left).merge(read_csv(right), on='k')
+    assert sorted(row['y'] for row in merged) == ['old', 'old']
+    with open(right, 'w') as f:
+        f.write('k,y\n0,new\n1,new\n2,new\n')
+    os.utime(right, ns=(0, 0))
+    assert sorted(row['y'] for row in merged) == ['new', 'new', 'new']
+
+
+@pytest.mark.parametrize('rows', [5, 1000])
+def test_merge_keeps_the_projection_of_the_right_frame(tmp_path, rows):
+    # the right file is hashed if it is the smaller one and streamed otherwise
+    left, right = str(tmp_path / 'left.csv'), str(tmp_path / 'right.csv')
+    with open(left, 'w') as f:
+        f.write('k,x\n' + ''.join(f'{i},{i}\n' for i in range(100)))
+    with open(right, 'w') as f:
+        f.write('k,y,z\n' + ''.join(f'{i},{i * 2},{i * 3}\n' for i in range(rows)))
+    merged = read_csv(left).merge(read_csv(right)[['k', 'y']], on='k')
+    res = list(merged)
+    assert len(res) == min(rows, 100)
+    assert all(set(row) == {'k', 'x', 'y'} for row in res)
+    assert merged.columns == ['k', 'x', 'y']
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from samwise import read_csv
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+@pytest.fixture
+def numbers(tmp_path):
+    filename = str(tmp_path / 'numbers.csv')
+    with open(filename, 'w') as f:
+        f.write('a,g\n' + ''.join(f'{i + 1},{i % 10}\n' for i in range(5000)))
+    return filename
+
+
+def test_computed_zeros_are_not_missing(numbers):
+    rows = list(read_csv(numbers).transform("df['c'] = df['a'] - df['a']")[['a', 'c']])
+    assert len(rows) == 5000
+    assert all(c == 0 for _, c in rows)
+
+
+def test_computed_zeros_in_filter_row_fallback(numbers):
+    zeros = read_csv(numbers).transform("df['c'] = df['a'] * 0")
+    # comparing the integer column with a string is not vectorized, every batch takes the row path
+    assert sum(1 for _ in zeros.filter("df['c'] == 0 or df['g'] == '5'", inplace=False)) == 5000
+    assert sum(1 for _ in zeros.filter("df['c'] == 0", inplace=False)) == 5000
+
+
+def test_computed_zeros_sort_first(numbers):
+    res = [int(row['c']) for row in read_csv(numbers).transform("df['c'] = df['a'] % 3").sort_values('c')]
+    assert res == sorted(res)
+    assert res[0] == 0
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_column_empty_in_the_first_member(workers):
+    # Ширина is empty in the first csv file of the archive, numbers in the later ones
+    df = read_csv(os.path.join(DATA, 'data_split.zip'), workers=workers)
+    assert df.max('Ширина') == 19.5
+    assert df.min('Ширина') == 4
+    assert df.sum('Ширина') == 41
+    assert df.pearson('Ширина', 'Идентификатор музея') == pytest.approx(0.5991885877231631)
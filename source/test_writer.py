@@ -0,0 +1,47 @@
+import csv
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+import writer
+from samwise import read_csv
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+@pytest.mark.parametrize('extension', ['', '.gz', '.zip'])
+def test_binary_round_trip(tmp_path, extension):
+    filename = str(tmp_path / f'data400.bin{extension}')
+    read_csv(os.path.join(DATA, 'data400.csv')).to_binary(filename, progressbar=False)
+    with open(os.path.join(DATA, 'data400.csv'), encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        labels = next(reader)
+        rows = list(reader)
+    header, blocks = writer.read_blocks(filename)
+    blocks = list(blocks)
+    assert header == list(dict.fromkeys(labels))
+    assert sum(len(block[header[0]]) for block in blocks) == len(rows)
+    museums = [value for block in blocks for value in block['Музей']]
+    assert museums == [row[labels.index('Музей')] for row in rows]
+    widths = np.concatenate([block['Ширина'] for block in blocks])
+    assert widths.dtype == np.float64
+    expected = [float(row[labels.index('Ширина')] or 'nan') for row in rows]
+    np.testing.assert_array_equal(widths, expected)
+
+
+def test_binary_file_is_not_unpickled(tmp_path):
+    class Payload:
+        def __reduce__(self):
+            return os.remove, (str(tmp_path / 'victim'),)
+
+    (tmp_path / 'victim').write_text('')
+    filename = str(tmp_path / 'evil.bin')
+    with open(filename, 'wb') as f:
+        f.write(writer.BINARY_MAGIC)
+        pickle.dump(Payload(), f)
+    with pytest.raises(ValueError):
+        header, blocks = writer.read_blocks(filename)
+        list(blocks)
+    assert (tmp_path / 'victim').exists()
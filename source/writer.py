@@ -0,0 +1,350 @@
+import csv
+import io
+import json
+import os
+import struct
+import tempfile
+import weakref
+from zipfile import ZipFile, ZIP_DEFLATED
+
+import numpy as np
+
+import sources
+
+BINARY_MAGIC = b'SAMWISE-BLOCKS-2\n'
+RECORD = struct.Struct('<I')  # length of the JSON header of a record
+
+
+def infer_compression(filename, compression='infer'):
+    """
+    :param filename: Name of the file to write
+    :param compression: 'infer' to take it from the extension of the file, 'zip', the name of a codec
+                        of sources.CODECS ('gzip', 'bz2', 'xz', 'zstd') or None
+    :return: Compression of the file, None if it is not compressed
+    """
+    if compression == 'infer':
+        if filename.lower().endswith('.zip'):
+            return 'zip'
+        codec = sources.codec_of(filename)
+        return None if codec is None else codec.name
+    if compression is not None and compression != 'zip' and compression not in sources.CODECS:
+        raise ValueError(f'Unexpected compression: {compression}')
+    return compression
+
+
+class AtomicWriter:
+    """
+    Binary stream of a file written to a temporary file in the same directory and renamed over
+    the target on commit, so the target is either left as it was or fully replaced.
+    Writes are buffered in large blocks and compressed on the way if requested.
+    """
+    BLOCK = 1 << 20
+
+    def __init__(self, filename: str, compression='infer', member: str = None):
+        """
+        Open the temporary file.
+        :param filename: Name of the file to replace
+        :param compression: 'infer' to take it from the extension of the file, 'gzip', 'bz2', 'xz', 'zstd', 'zip' or None
+        :param member: Name of the file inside a zip archive, the name of the target without .zip by default
+        """
+        self.filename = filename
+        self.compression = infer_compression(filename, compression)
+        directory, name = os.path.split(os.path.abspath(filename))
+        fd, self.temp = tempfile.mkstemp(prefix=f'.{name}.', suffix='.tmp', dir=directory)
+        self.__raw = os.fdopen(fd, 'wb', buffering=self.BLOCK)
+        self.__archive = None
+        if self.compression == 'zip':
+            if member is None:
+                member = name[:-4] if name.lower().endswith('.zip') else name
+            self.__archive = ZipFile(self.__raw, 'w', ZIP_DEFLATED)
+            self.stream = self.__archive.open(member, 'w', force_zip64=True)
+        elif self.compression is not None:
+            self.stream = sources.CODECS[self.compression].compress(self.__raw)
+        else:
+            self.stream = self.__raw
+
+    def write(self, data):
+        return self.stream.write(data)
+
+    def commit(self):
+        """
+        Flush the file and move it over the target.
+        """
+        if self.stream is not self.__raw:
+            self.stream.close()
+        if self.__archive is not None:
+            self.__archive.close()
+        self.__raw.flush()
+        os.fsync(self.__raw.fileno())
+        self.__raw.close()
+        os.chmod(self.temp, self.__mode())
+        os.replace(self.temp, self.filename)
+
+    def __mode(self):
+        """
+        :return: Permissions of the target, the default ones of a new file if it does not exist
+                 (mkstemp makes the temporary file private)
+        """
+        try:
+            return os.stat(self.filename).st_mode & 0o7777
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            return 0o666 & ~umask
+
+    def abort(self):
+        """
+        Drop the temporary file, the target is not changed.
+        """
+        for stream in (self.stream, self.__archive, self.__raw):
+            try:
+                if stream is not None:
+                    stream.close()
+            except (OSError, ValueError):
+                pass
+        if os.path.exists(self.temp):
+            os.remove(self.temp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+def remove_csv(filename: str):
+    """
+    Remove a csv file and the row index kept next to it.
+    """
+    for path in (filename, filename + '.idx'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class TemporaryCsv:
+    """
+    Temporary csv file holding the result of an operation (e.g. a sort). The file and its row index
+    are removed when the object is collected, so the conveyors reading the file keep a reference to it
+    (shared by their copies).
+    """
+    def __init__(self, prefix: str):
+        """
+        Create an empty file in the temporary directory.
+        :param prefix: Prefix of the name of the file
+        """
+        fd, self.filename = tempfile.mkstemp(prefix=prefix, suffix='.csv')
+        os.close(fd)
+        self.__finalizer = weakref.finalize(self, remove_csv, self.filename)
+
+    def remove(self):
+        """
+        Remove the file now, e.g. when its last reader is done.
+        """
+        self.__finalizer()
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class CsvWriter:
+    """
+    Writes rows to a csv file through an AtomicWriter.
+    """
+    def __init__(self, filename: str, header, compression='infer'):
+        """
+        Open the file and write the header line.
+        :param filename: Name of the file
+        :param header: Column labels
+        :param compression: 'infer' to take it from the extension of the file, 'gzip', 'bz2', 'xz', 'zstd', 'zip' or None
+        """
+        self.header = list(header)
+        self.file = AtomicWriter(filename, compression)
+        self.__text = io.TextIOWrapper(self.file.stream, encoding='utf-8', newline='', write_through=True)
+        self.__text_buffer = io.StringIO()
+        self.__writer = csv.writer(self.__text_buffer)
+        self.__writer.writerow(self.header)
+        self.rows = 0
+
+    def write_rows(self, rows):
+        """
+        :param rows: Iterable of lists of values aligned with the header
+        """
+        for row in rows:
+            self.__writer.writerow(row)
+            self.rows += 1
+            if self.__text_buffer.tell() >= AtomicWriter.BLOCK:
+                self.__flush()
+
+    def write_batch(self, batch):
+        """
+        :param batch: Batch with the columns of the header, missing ones are written empty
+        """
+        columns = [batch[key] if key in batch else [None] * len(batch) for key in self.header]
+        self.write_rows(zip(*columns))
+
+    def __flush(self):
+        self.__text.write(self.__text_buffer.getvalue())
+        self.__text_buffer.seek(0)
+        self.__text_buffer.truncate()
+
+    def commit(self):
+        self.__flush()
+        self.__text.flush()
+        self.__text.detach()
+        self.file.commit()
+
+    def abort(self):
+        self.file.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+class BinaryWriter:
+    """
+    Writes batches to a columnar binary file through an AtomicWriter.
+
+    The file starts with BINARY_MAGIC and a record with the column labels, then every batch
+    is a record with the number of rows and the kinds of the columns followed by their arrays
+    in the .npy format. A record is a JSON header prefixed with its length.
+    Numeric columns are int64 or float64 arrays (NaN for missing values). The values of
+    the other columns are stored as strings: an int64 array of their lengths in UTF-8
+    (-1 for missing values) and a uint8 array of their bytes.
+    Nothing is pickled, blocks are read back with read_blocks.
+    """
+    def __init__(self, filename: str, header, compression='infer'):
+        """
+        Open the file and write the column labels.
+        :param filename: Name of the file
+        :param header: Column labels
+        :param compression: 'infer' to take it from the extension of the file, 'gzip', 'bz2', 'xz', 'zstd', 'zip' or None
+        """
+        self.header = list(header)
+        self.file = AtomicWriter(filename, compression)
+        self.file.write(BINARY_MAGIC)
+        self.__record({'columns': self.header})
+        self.rows = 0
+
+    def __record(self, header):
+        data = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        self.file.write(RECORD.pack(len(data)))
+        self.file.write(data)
+
+    def write_batch(self, batch):
+        """
+        :param batch: Batch with the columns of the header, missing ones are written as None
+        """
+        kinds = []
+        arrays = []
+        for key in self.header:
+            values = None
+            if key in batch and (batch.schema is None or batch.schema.type(key) != 'str'):
+                try:
+                    values = batch.array(key)
+                except ValueError:
+                    values = None
+            if values is not None:
+                kinds.append(values.dtype.name)
+                arrays.append(values)
+                continue
+            raw = batch[key] if key in batch else [None] * len(batch)
+            encoded = [None if v is None else str(v).encode('utf-8') for v in raw]
+            kinds.append('str')
+            arrays.append(np.fromiter((-1 if v is None else len(v) for v in encoded), dtype=np.int64,
+                                      count=len(encoded)))
+            arrays.append(np.frombuffer(b''.join(v for v in encoded if v is not None), dtype=np.uint8))
+        self.__record({'rows': len(batch), 'kinds': kinds})
+        for values in arrays:
+            np.lib.format.write_array(self.file, values, allow_pickle=False)
+        self.rows += len(batch)
+
+    def commit(self):
+        self.file.commit()
+
+    def abort(self):
+        self.file.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+def read_blocks(filename, compression='infer'):
+    """
+    Read a file written by BinaryWriter. Arrays are loaded without unpickling anything.
+    :return: Column labels and an iterator over the blocks, dicts label -> NumPy array
+             (object arrays of strings and None for the columns which are not numeric)
+    """
+    compression = infer_compression(filename, compression)
+    if compression == 'zip':
+        archive = ZipFile(filename)
+        f = archive.open(archive.namelist()[0])
+    elif compression is not None:
+        f = sources.open_decompressed(filename, compression)
+    else:
+        f = open(filename, 'rb')
+    try:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError(f'{filename} is not a binary samwise file')
+        header = _read_record(f, filename)['columns']
+    except BaseException:
+        f.close()
+        raise
+
+    def blocks():
+        with f:
+            while True:
+                record = _read_record(f, filename)
+                if record is None:
+                    return
+                block = {}
+                for key, kind in zip(header, record['kinds']):
+                    values = np.lib.format.read_array(f, allow_pickle=False)
+                    if kind == 'str':
+                        data = np.lib.format.read_array(f, allow_pickle=False).tobytes()
+                        ends = np.cumsum(np.maximum(values, 0)).tolist()
+                        column = np.empty(len(values), dtype=object)
+                        column[:] = [None if length < 0 else data[end - length:end].decode('utf-8')
+                                     for length, end in zip(values.tolist(), ends)]
+                        values = column
+                    if len(values) != record['rows']:
+                        raise ValueError(f'{filename} is corrupted')
+                    block[key] = values
+                yield block
+
+    return header, blocks()
+
+
+def _read_record(f, filename):
+    """
+    :return: JSON header of the next record of a binary file, None at the end of the file
+    """
+    prefix = f.read(RECORD.size)
+    if not prefix:
+        return None
+    if len(prefix) != RECORD.size:
+        raise ValueError(f'{filename} is truncated')
+    size, = RECORD.unpack(prefix)
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError(f'{filename} is truncated')
+    return json.loads(data.decode('utf-8'))